@@ -0,0 +1,240 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Min, Sum
+
+from .filters import OR_PARAM, split_values
+from .models import Result
+
+
+AGGREGATION_CACHE_ALIAS = "aggregates"
+# Общий для процессов кэш с поколением и счётчиками попаданий
+# (settings.CACHES["versions"])
+VERSIONS_CACHE_ALIAS = "versions"
+GENERATION_KEY = "aggregate:generation"
+HITS_KEY = "aggregate:hits"
+MISSES_KEY = "aggregate:misses"
+
+
+# Группировка результатов: модель, параметр, единица измерения
+GROUP_FIELDS = (
+    "model_structure__model_name__name",
+    "model_structure__parameter__name",
+    "model_structure__parameter__unit__name",
+)
+
+# Параметры лечения строки с минимальным/максимальным значением
+META_FIELDS = {
+    "number_of_fractions": "data_set__clinical_case__number_of_fractions",
+    "single_dose": "data_set__clinical_case__single_dose",
+    "treatment_duration": "data_set__clinical_case__treatment_duration",
+    "clinical_case_id": "data_set__clinical_case_id",
+}
+
+
+def cohort_results(clinical_cases):
+    """Результаты с непустым значением для случаев (список id или подзапрос)."""
+    return Result.objects.filter(
+        data_set__clinical_case__in=clinical_cases,
+        value__isnull=False,
+    )
+
+
+def group_key(row):
+    model, param, unit = (row[field] for field in GROUP_FIELDS)
+    return (model, param if param is not None else "N/A", unit or "")
+
+
+def _extreme_metas(queryset, value_field, id_field, result_prefix, descending):
+    # DISTINCT ON по группе: первая строка группы после сортировки по значению,
+    # при равенстве значений берётся результат с меньшим id
+    value_order = f"-{value_field}" if descending else value_field
+    meta_lookups = {
+        name: F(f"{result_prefix}{lookup}") for name, lookup in META_FIELDS.items()
+    }
+    rows = (
+        queryset.order_by(*GROUP_FIELDS, value_order, id_field)
+        .distinct(*GROUP_FIELDS)
+        .values(*GROUP_FIELDS, **meta_lookups)
+    )
+    return {
+        group_key(row): {name: row[name] for name in META_FIELDS}
+        for row in rows
+    }
+
+
+def _build_aggregated(groups, min_metas, max_metas):
+    total_result_count = 0
+    aggregated = []
+    for group in groups:
+        key = group_key(group)
+        model, param, unit = key
+        total_result_count += group["count"]
+        aggregated.append({
+            "model": model,
+            "parameter": param,
+            "unit": unit,
+            "count": group["count"],
+            "average": round(group["average"], 2),
+            "min_value": round(group["min_value"], 2),
+            "min_meta": min_metas[key],
+            "max_value": round(group["max_value"], 2),
+            "max_meta": max_metas[key],
+        })
+    return total_result_count, aggregated
+
+
+def group_aggregates(results):
+    """GROUP BY по (модель, параметр, единица): количество, среднее, минимум, максимум."""
+    return (
+        results.values(*GROUP_FIELDS)
+        .annotate(
+            count=Count("id"),
+            average=Avg("value"),
+            min_value=Min("value"),
+            max_value=Max("value"),
+        )
+        .order_by(*GROUP_FIELDS)
+    )
+
+
+def aggregate_results(results):
+    """
+    Агрегирует результаты по (модель, параметр, единица) средствами БД.
+
+    Количество, среднее, минимум и максимум считаются одним GROUP BY,
+    строки с минимумом и максимумом выбираются через DISTINCT ON.
+    Возвращает (общее число результатов, список агрегатов).
+    """
+    return _build_aggregated(
+        group_aggregates(results),
+        _extreme_metas(results, "value", "id", "", descending=False),
+        _extreme_metas(results, "value", "id", "", descending=True),
+    )
+
+
+def aggregate_statistics(statistics):
+    """
+    То же, что aggregate_results, но по накопленной таблице ParameterStatistic:
+    время зависит от числа групп, а не от числа результатов.
+    """
+    # Имена агрегатов не должны совпадать с полями модели
+    rows = (
+        statistics.values(*GROUP_FIELDS)
+        .annotate(
+            total_count=Sum("count"),
+            total_sum=Sum("sum"),
+            lowest=Min("min_value"),
+            highest=Max("max_value"),
+        )
+        .order_by(*GROUP_FIELDS)
+    )
+    groups = [
+        {
+            **{field: row[field] for field in GROUP_FIELDS},
+            "count": row["total_count"],
+            "average": row["total_sum"] / row["total_count"],
+            "min_value": row["lowest"],
+            "max_value": row["highest"],
+        }
+        for row in rows
+    ]
+    return _build_aggregated(
+        groups,
+        _extreme_metas(statistics, "min_value", "min_result_id", "min_result__", descending=False),
+        _extreme_metas(statistics, "max_value", "max_result_id", "max_result__", descending=True),
+    )
+
+
+def _canonical_filter(name, value):
+    # Порядок условий OR-группы значим для разбора, значения __in — нет
+    if name == OR_PARAM:
+        return ";".join(split_values(value)) if isinstance(value, (list, tuple)) else str(value)
+    return sorted(set(split_values(value)))
+
+
+def cohort_fingerprint(spec):
+    """
+    Канонический хэш описания когорты: отсортированный набор id,
+    нормализованные фильтры и запрошенные статистики, независимо
+    от порядка и формата значений.
+    """
+    canonical = {}
+    if "clinical_case_ids" in spec:
+        canonical["ids"] = sorted({int(pk) for pk in spec["clinical_case_ids"]})
+    if "filters" in spec:
+        canonical["filters"] = {
+            name: _canonical_filter(name, value)
+            for name, value in spec["filters"].items()
+            if value not in (None, "", [])
+        }
+    if spec.get("stats"):
+        canonical["stats"] = sorted(set(spec["stats"]))
+    raw = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _generation():
+    cache = caches[VERSIONS_CACHE_ALIAS]
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Новое поколение не должно совпасть с поколением до очистки кэша
+        generation = time.time_ns()
+        if not cache.add(GENERATION_KEY, generation, timeout=None):
+            generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def _count(key):
+    # Счётчики общие для процессов: add создаёт ключ только один раз,
+    # дальше incr (атомарный в Redis и Memcached)
+    cache = caches[VERSIONS_CACHE_ALIAS]
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Ключ удалён между add и incr
+            cache.add(key, 1, timeout=None)
+
+
+def _bump_generation():
+    caches[VERSIONS_CACHE_ALIAS].set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_aggregations():
+    """
+    Сбрасывает все закэшированные агрегаты сменой поколения после
+    фиксации текущей транзакции: до неё параллельный запрос посчитал бы
+    агрегат по старым строкам и сохранил его под новым поколением.
+    """
+    transaction.on_commit(_bump_generation)
+
+
+def cached_aggregation(spec, compute):
+    """Возвращает агрегат когорты из кэша или вычисляет и кэширует его."""
+    cache = caches[AGGREGATION_CACHE_ALIAS]
+    key = f"aggregate:{_generation()}:{cohort_fingerprint(spec)}"
+    data = cache.get(key)
+    if data is not None:
+        _count(HITS_KEY)
+        return data
+    _count(MISSES_KEY)
+    data = compute()
+    cache.set(key, data)
+    return data
+
+
+def aggregation_cache_stats():
+    """Попадания и промахи кэша агрегатов по всем процессам."""
+    cache = caches[VERSIONS_CACHE_ALIAS]
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else None,
+    }
@@ -0,0 +1,154 @@
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .models import (
+    ClinicalCase,
+    Diagnosis,
+    Grade,
+    Histology,
+    Location,
+    Metastasis,
+    ModelName,
+    Node,
+    Parameter,
+    RadiationTherapyType,
+    Result,
+    RiskGroup,
+    Source,
+    SpecLocation,
+    Stage,
+    Tumor,
+    Unit,
+)
+
+
+ANALYSIS_FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+# Числовые столбцы: имя -> (путь от Result, тип Arrow)
+NUMERIC_COLUMNS = {
+    "result_id": ("id", pa.int64()),
+    "data_set_id": ("data_set_id", pa.int64()),
+    "clinical_case_id": ("data_set__clinical_case_id", pa.int64()),
+    "age": ("data_set__clinical_case__age", pa.int32()),
+    "age_min": ("data_set__clinical_case__age_min", pa.int32()),
+    "age_max": ("data_set__clinical_case__age_max", pa.int32()),
+    "quantity": ("data_set__clinical_case__quantity", pa.int32()),
+    "number_of_fractions": ("data_set__clinical_case__number_of_fractions", pa.int32()),
+    "single_dose": ("data_set__clinical_case__single_dose", pa.float64()),
+    "treatment_duration": ("data_set__clinical_case__treatment_duration", pa.int32()),
+    "value": ("value", pa.float64()),
+    "lower_value": ("lower_value", pa.float64()),
+    "upper_value": ("upper_value", pa.float64()),
+}
+
+# Категориальные столбцы: имя -> (путь к id от Result, справочник, поле подписи).
+# Выгружаются только id, подписи берутся из справочника один раз
+CATEGORY_COLUMNS = {
+    "location": ("data_set__clinical_case__spec_location__location_id", Location, "name"),
+    "spec_location": ("data_set__clinical_case__spec_location_id", SpecLocation, "name"),
+    "diagnosis": ("data_set__clinical_case__diagnosis_id", Diagnosis, "code"),
+    "stage": ("data_set__clinical_case__stage_id", Stage, "name"),
+    "risk_group": ("data_set__clinical_case__risk_group_id", RiskGroup, "name"),
+    "radiation_therapy_type": (
+        "data_set__clinical_case__radiation_therapy_type_id", RadiationTherapyType, "name"
+    ),
+    "tumor": ("data_set__clinical_case__tumor_id", Tumor, "short_name"),
+    "node": ("data_set__clinical_case__node_id", Node, "short_name"),
+    "metastasis": ("data_set__clinical_case__metastasis_id", Metastasis, "short_name"),
+    "histology": ("data_set__clinical_case__histology_id", Histology, "name"),
+    "grade": ("data_set__clinical_case__grade_id", Grade, "name"),
+    "source": ("data_set__source_id", Source, "name"),
+    "model": ("model_structure__model_name_id", ModelName, "name"),
+    "parameter": ("model_structure__parameter_id", Parameter, "name"),
+    "unit": ("model_structure__parameter__unit_id", Unit, "name"),
+}
+
+GENDER_LOOKUP = "data_set__clinical_case__gender"
+
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+def analysis_schema():
+    fields = [pa.field(name, arrow_type) for name, (_, arrow_type) in NUMERIC_COLUMNS.items()]
+    fields.append(pa.field("gender", DICTIONARY_TYPE))
+    fields.extend(pa.field(name, DICTIONARY_TYPE) for name in CATEGORY_COLUMNS)
+    return pa.schema(fields)
+
+
+class Dictionary:
+    """Словарь категориального столбца, общий для всех порций файла."""
+
+    def __init__(self, pairs):
+        # Подписи в справочниках необязательны и не уникальны: в словаре
+        # каждая непустая подпись один раз, ключ без подписи кодируется null
+        positions = {}
+        self.index = {}
+        for key, label in pairs:
+            if label is not None:
+                self.index[key] = positions.setdefault(label, len(positions))
+        self.labels = pa.array(list(positions), type=pa.string())
+
+    def encode(self, keys):
+        indices = pa.array([self.index.get(key) for key in keys], type=pa.int32())
+        return pa.DictionaryArray.from_arrays(indices, self.labels)
+
+
+def load_dictionaries():
+    dictionaries = {
+        name: Dictionary(model.objects.order_by("id").values_list("id", label_field))
+        for name, (_, model, label_field) in CATEGORY_COLUMNS.items()
+    }
+    dictionaries["gender"] = Dictionary(ClinicalCase.GenderChoices.choices)
+    return dictionaries
+
+
+def iter_batches(results, chunk_size):
+    """
+    Порции таблицы «случай × результат» как RecordBatch. Строки читаются
+    серверным курсором, в памяти одновременно только одна порция.
+    """
+    schema = analysis_schema()
+    dictionaries = load_dictionaries()
+    lookups = [lookup for lookup, _ in NUMERIC_COLUMNS.values()]
+    lookups.append(GENDER_LOOKUP)
+    lookups.extend(lookup for lookup, _, _ in CATEGORY_COLUMNS.values())
+
+    rows = results.order_by("id").values_list(*lookups).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        columns = list(zip(*chunk))
+        arrays = [
+            pa.array(column, type=arrow_type)
+            for column, (_, arrow_type) in zip(columns, NUMERIC_COLUMNS.values())
+        ]
+        categories = ["gender", *CATEGORY_COLUMNS]
+        for name, column in zip(categories, columns[len(NUMERIC_COLUMNS):]):
+            arrays.append(dictionaries[name].encode(column))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_analysis_table(sink, results=None, file_format="parquet", chunk_size=50000):
+    """
+    Записывает денормализованную таблицу в Parquet или Arrow IPC (файловый
+    формат, пригоден для memory-map). Возвращает число строк.
+    """
+    if results is None:
+        results = Result.objects.all()
+    schema = analysis_schema()
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+    row_count = 0
+    with writer:
+        for batch in iter_batches(results, chunk_size):
+            writer.write_batch(batch)
+            row_count += batch.num_rows
+    return row_count
@@ -0,0 +1,136 @@
+from django.db import connection, models, transaction
+
+from . import parameter_statistics
+from .aggregation import invalidate_aggregations
+from .case_summary import refresh_case_counts, refresh_case_summaries
+from .models import (
+    ClinicalCase,
+    ClinicalCaseComplication,
+    DataSet,
+    Result,
+)
+
+
+# Поля результата, от которых зависит накопленная статистика
+RESULT_STATISTIC_FIELDS = {"value", "model_structure", "data_set"}
+
+
+def _update_cases(case_ids, values):
+    results = Result.objects.filter(data_set__clinical_case__in=case_ids)
+    previous_groups = set()
+    if "spec_location" in values:
+        previous_groups = parameter_statistics.result_groups(results)
+    count = ClinicalCase.objects.filter(pk__in=case_ids).update(**values)
+    # Текст случаев и сводки
+    refresh_case_summaries(case_ids)
+    if previous_groups:
+        current_groups = parameter_statistics.result_groups(results)
+        parameter_statistics.refresh_statistics(previous_groups | current_groups)
+    return {"updated": count}
+
+
+def _update_results(result_ids, values):
+    results = Result.objects.filter(pk__in=result_ids)
+    previous_groups = set()
+    if RESULT_STATISTIC_FIELDS & values.keys():
+        previous_groups = parameter_statistics.result_groups(results)
+    previous_cases = set()
+    if "data_set" in values:
+        previous_cases = set(results.values_list("data_set__clinical_case", flat=True))
+        # Набор данных может сбрасываться в null
+        if values["data_set"] is not None:
+            previous_cases.add(values["data_set"].clinical_case_id)
+    count = results.update(**values)
+    if previous_groups:
+        current_groups = parameter_statistics.result_groups(results)
+        parameter_statistics.refresh_statistics(previous_groups | current_groups)
+    refresh_case_counts(previous_cases)
+    return {"updated": count}
+
+
+def _delete_with_dependents(model, condition, params, counts):
+    """
+    Удаляет строки model по SQL-условию condition вместе с зависимыми.
+    Связи берутся из метаданных моделей, как у Collector, но каждая
+    таблица обрабатывается одним запросом: CASCADE — DELETE, SET_NULL —
+    UPDATE, дочерние таблицы раньше родительской. Число удалённых строк
+    добавляется в counts[модель].
+    """
+    table = model._meta.db_table
+    selected = f"SELECT {model._meta.pk.column} FROM {table} WHERE {condition}"
+    with connection.cursor() as cursor:
+        for relation in model._meta.get_fields(include_hidden=True):
+            if not (relation.auto_created and not relation.concrete
+                    and (relation.one_to_many or relation.one_to_one)):
+                continue
+            related, column = relation.related_model, relation.field.column
+            if relation.on_delete is models.CASCADE:
+                _delete_with_dependents(related, f"{column} IN ({selected})", params, counts)
+            elif relation.on_delete is models.SET_NULL:
+                cursor.execute(
+                    f"UPDATE {related._meta.db_table} SET {column} = NULL "
+                    f"WHERE {column} IN ({selected})",
+                    params,
+                )
+            elif relation.on_delete is not models.DO_NOTHING:
+                raise ValueError(
+                    f"Связь {related.__name__}.{relation.field.name}: "
+                    f"on_delete={relation.on_delete.__name__} не поддерживается"
+                )
+        cursor.execute(f"DELETE FROM {table} WHERE {condition}", params)
+        counts[model] = counts.get(model, 0) + cursor.rowcount
+
+
+def _delete_cases(case_ids):
+    groups = parameter_statistics.result_groups(
+        Result.objects.filter(data_set__clinical_case__in=case_ids)
+    )
+    # Сигналы не отправляются: Collector удалял бы построчно
+    counts = {}
+    _delete_with_dependents(ClinicalCase, "id = ANY(%(ids)s)", {"ids": case_ids}, counts)
+    parameter_statistics.refresh_statistics(groups)
+    return {
+        "deleted": counts[ClinicalCase],
+        "datasets": counts[DataSet],
+        "results": counts[Result],
+        "complications": counts[ClinicalCaseComplication],
+    }
+
+
+def _delete_results(result_ids):
+    results = Result.objects.filter(pk__in=result_ids)
+    groups = parameter_statistics.result_groups(results)
+    case_ids = set(results.values_list("data_set__clinical_case", flat=True))
+    counts = {}
+    _delete_with_dependents(Result, "id = ANY(%(ids)s)", {"ids": result_ids}, counts)
+    parameter_statistics.refresh_statistics(groups)
+    refresh_case_counts(case_ids)
+    return {"deleted": counts[Result]}
+
+
+BULK_UPDATES = {ClinicalCase: _update_cases, Result: _update_results}
+BULK_DELETES = {ClinicalCase: _delete_cases, Result: _delete_results}
+
+
+def bulk_update(model, ids, values):
+    """
+    Записывает values (validated_data частичной проверки) в строки model
+    с указанными id одним UPDATE. Сигналы не отправляются: сводки,
+    статистика и кэш агрегатов обновляются здесь. Возвращает {"updated": n}.
+    """
+    with transaction.atomic():
+        counts = BULK_UPDATES[model](list(ids), values)
+    invalidate_aggregations()
+    return counts
+
+
+def bulk_delete(model, ids):
+    """
+    Удаляет строки model с указанными id (с зависимыми строками) по одному
+    DELETE на таблицу и обновляет производные данные. Возвращает число
+    удалённых строк по таблицам.
+    """
+    with transaction.atomic():
+        counts = BULK_DELETES[model](list(ids))
+    invalidate_aggregations()
+    return counts
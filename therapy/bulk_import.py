@@ -0,0 +1,515 @@
+import csv
+import io
+from itertools import chain, islice
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from . import parameter_statistics
+from .aggregation import invalidate_aggregations
+from .models import (
+    ClinicalCase,
+    ClinicalCaseComplication,
+    ClinicalCaseSummary,
+    Complication,
+    DataSet,
+    Diagnosis,
+    Grade,
+    Histology,
+    Metastasis,
+    ModelStructure,
+    Node,
+    RadiationTherapyType,
+    Result,
+    RiskGroup,
+    Source,
+    SpecLocation,
+    Stage,
+    Tumor,
+)
+from .natural_keys import KeyResolver, parse_integer
+from .serializers import ClinicalCaseSerializer, SUMMARY_FIELDS
+
+
+# Строка файла — «случай × результат», как в analysis-table: строки
+# с одинаковым значением столбца case относятся к одному случаю. Поля
+# случая и осложнения читаются из первой строки случая, в остальных их
+# можно не заполнять. Связи указываются id или естественным ключом
+# (therapy.natural_keys)
+IMPORT_FORMATS = ("csv", "xlsx")
+
+CASE_KEY = "case"
+COMPLICATIONS = "complications"
+COMPLICATION_SEPARATOR = ";"
+
+CASE_VALUES = {
+    "age": "integer",
+    "age_min": "integer",
+    "age_max": "integer",
+    "quantity": "integer",
+    "gender": "smallint",
+    "refined_diagnosis": "text",
+    "number_of_fractions": "integer",
+    "single_dose": "double precision",
+    "treatment_duration": "integer",
+    "note": "text",
+}
+CASE_RELATIONS = {
+    "diagnosis": Diagnosis,
+    "spec_location": SpecLocation,
+    "stage": Stage,
+    "risk_group": RiskGroup,
+    "radiation_therapy_type": RadiationTherapyType,
+    "tumor": Tumor,
+    "node": Node,
+    "metastasis": Metastasis,
+    "histology": Histology,
+    "grade": Grade,
+}
+RESULT_VALUES = ("value", "upper_value", "lower_value")
+# Структура модели: id в model_structure или пара model_name + parameter
+STRUCTURE_COLUMNS = ("model_structure", "model_name", "parameter")
+
+REQUIRED_COLUMNS = (CASE_KEY, "spec_location", "radiation_therapy_type")
+KNOWN_COLUMNS = {
+    CASE_KEY,
+    *CASE_VALUES,
+    *CASE_RELATIONS,
+    "source",
+    *STRUCTURE_COLUMNS,
+    *RESULT_VALUES,
+    COMPLICATIONS,
+}
+
+CASE_COLUMNS = [*CASE_VALUES, *(f"{name}_id" for name in CASE_RELATIONS)]
+
+# Промежуточные таблицы: случай (его первая строка) и строка результата.
+# Текст и подписи сводки случая собираются при проверке, счётчик
+# результатов — при переносе
+CASE_STAGING = {
+    "row_number": "integer",
+    "case_key": "text",
+    **CASE_VALUES,
+    **{f"{name}_id": "bigint" for name in CASE_RELATIONS},
+    "complication_ids": "bigint[]",
+    "rendered_text": "text",
+    **{name: "text" for name in SUMMARY_FIELDS},
+}
+RESULT_STAGING = {
+    "row_number": "integer",
+    "case_key": "text",
+    "source_id": "bigint",
+    "model_structure_id": "bigint",
+    **{name: "double precision" for name in RESULT_VALUES},
+}
+
+CHUNK_SIZE = 10000
+COPY_NULL = r"\N"
+
+GENDER_LABELS = {
+    label.lower(): value for value, label in ClinicalCase.GenderChoices.choices
+}
+# Значения по умолчанию полей модели, которые не допускают NULL или
+# заполняются ORM при создании
+DEFAULTS = {"quantity": 1, "gender": ClinicalCase.GenderChoices.INIT}
+
+
+class ImportFileError(ValueError):
+    """Файл нельзя импортировать целиком (формат, заголовок)."""
+
+
+def read_csv(stream):
+    """Строки CSV (словари по заголовку) из бинарного потока в UTF-8."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        # Поток принадлежит вызывающему коду
+        text.detach()
+
+
+def read_xlsx(stream):
+    """Строки первого листа XLSX; книга читается потоково (read_only)."""
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as error:
+        raise ImportFileError(f"Не удалось прочитать XLSX: {error}") from error
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(name).strip() if name is not None else "" for name in next(rows, ())]
+        for values in rows:
+            yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+READERS = {"csv": read_csv, "xlsx": read_xlsx}
+
+
+def read_rows(stream, file_format):
+    if file_format not in READERS:
+        raise ImportFileError("Допустимые форматы: " + ", ".join(IMPORT_FORMATS))
+    return READERS[file_format](stream)
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _parse_integer(value):
+    number = parse_integer(value.strip() if isinstance(value, str) else value)
+    if number is None:
+        raise ValueError("Ожидается целое число.")
+    return number
+
+
+def _parse_float(value):
+    try:
+        return float(value.strip().replace(",", ".") if isinstance(value, str) else value)
+    except (TypeError, ValueError):
+        raise ValueError("Ожидается число.") from None
+
+
+def _parse_gender(value):
+    if isinstance(value, str) and value.strip().lower() in GENDER_LABELS:
+        return GENDER_LABELS[value.strip().lower()]
+    number = _parse_integer(value)
+    if number not in ClinicalCase.GenderChoices.values:
+        raise ValueError(f'Значения "{value}" нет среди допустимых вариантов.')
+    return number
+
+
+def _parse_text(value):
+    return str(value).strip()
+
+
+PARSERS = {
+    "integer": _parse_integer,
+    "smallint": _parse_gender,
+    "double precision": _parse_float,
+    "text": _parse_text,
+}
+
+
+class RowNormalizer:
+    """
+    Проверяет строки файла и переводит их в строки промежуточных таблиц.
+    Помнит ключи случаев: поля случая разбираются один раз, строки
+    отклонённого случая отклоняются со ссылкой на его первую строку.
+    """
+
+    def __init__(self, columns, resolver):
+        self.resolver = resolver
+        self.values = [
+            (name, PARSERS[CASE_VALUES[name]]) for name in CASE_VALUES if name in columns
+        ]
+        self.relations = [
+            (name, model, ClinicalCase._meta.get_field(name))
+            for name, model in CASE_RELATIONS.items()
+        ]
+        self.has_source = "source" in columns
+        self.has_structure = bool(columns & set(STRUCTURE_COLUMNS))
+        self.has_complications = COMPLICATIONS in columns
+        self.serializer = ClinicalCaseSerializer()
+        # ключ случая -> (номер первой строки, id локализации или None при ошибке)
+        self.cases = {}
+
+    def _relation(self, model, value, column, errors):
+        if _blank(value):
+            return None
+        try:
+            return self.resolver.resolve(model, value.strip() if isinstance(value, str) else value)
+        except ValueError as error:
+            errors.append((column, str(error)))
+            return None
+
+    def _case(self, row, errors):
+        values = {}
+        for name, parse in self.values:
+            value = row.get(name)
+            if _blank(value):
+                values[name] = DEFAULTS.get(name)
+                continue
+            try:
+                values[name] = parse(value)
+            except ValueError as error:
+                errors.append((name, str(error)))
+        for name, default in DEFAULTS.items():
+            values.setdefault(name, default)
+
+        case = ClinicalCase(**{name: values.get(name) for name in CASE_VALUES})
+        for name, model, field in self.relations:
+            value = row.get(name)
+            if _blank(value) and name in REQUIRED_COLUMNS:
+                errors.append((name, "Обязательное поле."))
+            obj = self._relation(model, value, name, errors)
+            values[f"{name}_id"] = obj.pk if obj is not None else None
+            # Справочники уже в памяти: текст и подписи собираются без запросов
+            field.set_cached_value(case, obj)
+
+        complications = []
+        if self.has_complications and not _blank(row.get(COMPLICATIONS)):
+            for value in str(row[COMPLICATIONS]).split(COMPLICATION_SEPARATOR):
+                complication = self._relation(Complication, value, COMPLICATIONS, errors)
+                if complication is not None and complication.pk not in complications:
+                    complications.append(complication.pk)
+        values["complication_ids"] = complications
+
+        if not errors:
+            case.rendered_text = values["rendered_text"] = case.render_text()
+            for name in SUMMARY_FIELDS:
+                values[name] = getattr(self.serializer, f"get_{name}")(case)
+        return values, case
+
+    def _structure(self, row, errors):
+        if not _blank(row.get("model_structure")):
+            return self._relation(ModelStructure, row["model_structure"], "model_structure", errors)
+        model_name, parameter = row.get("model_name"), row.get("parameter")
+        if _blank(model_name) and _blank(parameter):
+            return None
+        key = {"model_name": model_name or "", "parameter": parameter or ""}
+        return self._relation(ModelStructure, key, "parameter", errors)
+
+    def _result(self, row, errors):
+        values = {}
+        source = self._relation(Source, row.get("source"), "source", errors) if self.has_source else None
+        structure = self._structure(row, errors) if self.has_structure else None
+        values["source_id"] = source.pk if source is not None else None
+        values["model_structure_id"] = structure.pk if structure is not None else None
+        for name in RESULT_VALUES:
+            value = row.get(name)
+            if _blank(value):
+                values[name] = None
+                continue
+            try:
+                values[name] = _parse_float(value)
+            except ValueError as error:
+                errors.append((name, str(error)))
+        if all(_blank(row.get(name)) for name in STRUCTURE_COLUMNS) and any(
+            values.get(name) is not None for name in RESULT_VALUES
+        ):
+            errors.append(("model_structure", "Не указана структура модели результата."))
+        return values
+
+    def normalize(self, row_number, row):
+        """
+        (строка случая или None, строка результата или None, [(столбец, ошибка)]).
+        Строка случая возвращается только для первой строки случая.
+        """
+        case_key = row.get(CASE_KEY)
+        if _blank(case_key):
+            return None, None, [(CASE_KEY, "Обязательное поле.")]
+        case_key = _parse_text(case_key)
+
+        errors = []
+        case_values = None
+        known = self.cases.get(case_key)
+        if known is None:
+            case_values, case = self._case(row, errors)
+            location_id = case.spec_location.location_id if not errors else None
+        elif known[1] is None:
+            errors.append((CASE_KEY, f"Случай не импортирован: ошибка в строке {known[0]}."))
+        result_values = self._result(row, errors)
+
+        if known is None:
+            # Ошибка в части результата отклоняет и первую строку случая
+            known = self.cases[case_key] = (row_number, None if errors else location_id)
+        if errors:
+            return None, None, errors
+
+        if case_values is not None:
+            case_values.update(row_number=row_number, case_key=case_key)
+        if result_values["model_structure_id"] is None and result_values["source_id"] is None:
+            return case_values, None, []
+        result_values.update(row_number=row_number, case_key=case_key)
+        return case_values, result_values, []
+
+
+def _copy_value(value):
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, list):
+        return "{" + ",".join(str(pk) for pk in value) + "}"
+    return value
+
+
+def _copy(cursor, table, columns, rows):
+    # NULL пишется явной меткой: пустая строка остаётся пустой строкой
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in rows:
+        writer.writerow([_copy_value(values.get(name)) for name in columns])
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+        buffer,
+    )
+
+
+def _create_staging(cursor):
+    case_columns = ", ".join(f"{name} {kind}" for name, kind in CASE_STAGING.items())
+    result_columns = ", ".join(f"{name} {kind}" for name, kind in RESULT_STAGING.items())
+    # id случаев выделяются из последовательности таблицы при копировании,
+    # чтобы связать с ними наборы данных без возврата id в Python
+    cursor.execute(
+        f"""
+        CREATE TEMP TABLE import_case_rows (
+            id bigint DEFAULT nextval(pg_get_serial_sequence('{ClinicalCase._meta.db_table}', 'id')),
+            {case_columns}
+        ) ON COMMIT DROP
+        """
+    )
+    cursor.execute(f"CREATE TEMP TABLE import_result_rows ({result_columns}) ON COMMIT DROP")
+
+
+def _merge(cursor):
+    """
+    Переносит промежуточные таблицы в рабочие запросами INSERT ... SELECT.
+    Возвращает число созданных случаев, наборов, результатов и осложнений.
+    """
+    cursor.execute(
+        f"""
+        INSERT INTO {ClinicalCase._meta.db_table} (id, {', '.join(CASE_COLUMNS)}, rendered_text)
+        SELECT id, {', '.join(CASE_COLUMNS)}, rendered_text
+        FROM import_case_rows ORDER BY row_number
+        """
+    )
+    case_count = cursor.rowcount
+
+    # Набор данных — случай и источник. Из повторов структуры модели
+    # в наборе остаётся последняя строка (естественный ключ результата)
+    cursor.execute(
+        f"""
+        CREATE TEMP TABLE import_datasets ON COMMIT DROP AS
+        SELECT case_key, source_id,
+            nextval(pg_get_serial_sequence('{DataSet._meta.db_table}', 'id')) AS id
+        FROM (SELECT DISTINCT case_key, source_id FROM import_result_rows) AS keys
+        """
+    )
+    cursor.execute(
+        f"""
+        INSERT INTO {DataSet._meta.db_table} (id, clinical_case_id, source_id)
+        SELECT d.id, c.id, d.source_id
+        FROM import_datasets AS d JOIN import_case_rows AS c USING (case_key)
+        """
+    )
+    dataset_count = cursor.rowcount
+    cursor.execute(
+        f"""
+        INSERT INTO {Result._meta.db_table}
+            (data_set_id, model_structure_id, {', '.join(RESULT_VALUES)})
+        SELECT DISTINCT ON (d.id, r.model_structure_id)
+            d.id, r.model_structure_id, {', '.join(f'r.{name}' for name in RESULT_VALUES)}
+        FROM import_result_rows AS r
+        JOIN import_datasets AS d
+            ON d.case_key = r.case_key AND d.source_id IS NOT DISTINCT FROM r.source_id
+        WHERE r.model_structure_id IS NOT NULL
+        ORDER BY d.id, r.model_structure_id, r.row_number DESC
+        """
+    )
+    result_count = cursor.rowcount
+    cursor.execute(
+        f"""
+        INSERT INTO {ClinicalCaseComplication._meta.db_table} (clinical_case_id, complication_id)
+        SELECT c.id, complication.id
+        FROM import_case_rows AS c
+        CROSS JOIN LATERAL unnest(c.complication_ids) AS complication(id)
+        """
+    )
+    complication_count = cursor.rowcount
+
+    # Сводки собраны при проверке, счётчик результатов — один GROUP BY
+    cursor.execute(
+        f"""
+        INSERT INTO {ClinicalCaseSummary._meta.db_table}
+            (clinical_case_id, {', '.join(SUMMARY_FIELDS)}, result_count, complication_count)
+        SELECT c.id, {', '.join(f'c.{name}' for name in SUMMARY_FIELDS)},
+            coalesce(r.total, 0), cardinality(c.complication_ids)
+        FROM import_case_rows AS c
+        LEFT JOIN (
+            SELECT case_key, count(DISTINCT (source_id, model_structure_id)) AS total
+            FROM import_result_rows
+            WHERE model_structure_id IS NOT NULL GROUP BY case_key
+        ) AS r USING (case_key)
+        """
+    )
+    # Все результаты созданных наборов данных новые: они добавляются
+    # в накопленную статистику без пересчёта групп. Сигналов нет
+    parameter_statistics.merge_statistics(
+        Result.objects.filter(data_set_id__in=RawSQL("SELECT id FROM import_datasets", ()))
+    )
+    # ON COMMIT DROP не срабатывает, если импорт идёт внутри внешней транзакции
+    cursor.execute("DROP TABLE import_case_rows, import_result_rows, import_datasets")
+    return case_count, dataset_count, result_count, complication_count
+
+
+def import_rows(rows, create_missing=False, chunk_size=CHUNK_SIZE):
+    """
+    Импортирует строки файла (словари по заголовку) в одной транзакции.
+
+    Строки проверяются порциями по chunk_size и копируются в промежуточные
+    таблицы через COPY FROM STDIN; затем случаи, наборы данных, результаты,
+    осложнения и сводки создаются запросами INSERT ... SELECT. Строки
+    с ошибками пропускаются и попадают в отчёт. create_missing дополняет
+    справочники неизвестными значениями (см. natural_keys.AUTO_CREATE_MODELS).
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        raise ImportFileError("Файл пуст.")
+    columns = {str(name).strip() for name in first if name is not None}
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ImportFileError("Нет обязательных столбцов: " + ", ".join(missing))
+
+    normalizer = RowNormalizer(columns, KeyResolver(create_missing=create_missing))
+    report = {
+        "rows": 0,
+        "imported_rows": 0,
+        "cases": 0,
+        "datasets": 0,
+        "results": 0,
+        "complications": 0,
+        "ignored_columns": sorted(columns - KNOWN_COLUMNS),
+        "errors": [],
+    }
+    # Нумерация строк как в табличном редакторе: первая строка — заголовок
+    numbered = enumerate(chain([first], rows), start=2)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        _create_staging(cursor)
+        while True:
+            chunk = list(islice(numbered, chunk_size))
+            if not chunk:
+                break
+            case_rows, result_rows = [], []
+            for row_number, row in chunk:
+                case_values, result_values, errors = normalizer.normalize(row_number, row)
+                if errors:
+                    report["errors"].extend(
+                        {"row": row_number, "column": column, "error": error}
+                        for column, error in errors
+                    )
+                    continue
+                report["imported_rows"] += 1
+                if case_values is not None:
+                    case_rows.append(case_values)
+                if result_values is not None:
+                    result_rows.append(result_values)
+            report["rows"] += len(chunk)
+            if case_rows:
+                _copy(cursor, "import_case_rows", list(CASE_STAGING), case_rows)
+            if result_rows:
+                _copy(cursor, "import_result_rows", list(RESULT_STAGING), result_rows)
+
+        cases, datasets, results, complications = _merge(cursor)
+        report.update(
+            cases=cases, datasets=datasets, results=results, complications=complications
+        )
+    # Запросы в обход ORM не отправляют сигналов: кэш агрегатов
+    # сбрасывается здесь
+    if cases:
+        invalidate_aggregations()
+    return report
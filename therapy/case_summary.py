@@ -0,0 +1,157 @@
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef
+
+from .models import (
+    ClinicalCase,
+    ClinicalCaseComplication,
+    ClinicalCaseSummary,
+    Result,
+)
+from .serializers import ClinicalCaseSerializer, SUMMARY_FIELDS, case_counts
+
+
+# Связи, из которых собираются подписи. Справочники читаются запросом,
+# а не из кэша процесса: сводка пересчитывается в обработчике сигнала,
+# возможно до смены версии справочников
+SUMMARY_RELATED = (
+    "diagnosis",
+    "spec_location__location",
+    "stage",
+    "risk_group",
+    "radiation_therapy_type",
+    "tumor",
+    "node",
+    "metastasis",
+    "histology",
+    "grade",
+)
+
+COUNT_FIELDS = ("result_count", "complication_count")
+
+BATCH_SIZE = 1000
+
+
+def build_summary(case, serializer, result_count, complication_count):
+    """Сводка случая, у которого загружены все справочники и rendered_text."""
+    return ClinicalCaseSummary(
+        clinical_case_id=case.pk,
+        **{name: getattr(serializer, f"get_{name}")(case) for name in SUMMARY_FIELDS},
+        result_count=result_count,
+        complication_count=complication_count,
+    )
+
+
+def _count_map(queryset, case_lookup, cases):
+    # Один GROUP BY на пачку случаев: коррелированный подзапрос на каждый
+    # случай медленен на только что загруженных таблицах без статистики
+    return dict(
+        queryset.filter(**{f"{case_lookup}__in": cases.values("pk")})
+        .order_by()
+        .values(case_lookup)
+        .annotate(total=Count("pk"))
+        .values_list(case_lookup, "total")
+    )
+
+
+def render_summaries(cases):
+    """
+    Несохранённые сводки для случаев (queryset ClinicalCase) и пары
+    (случай, прежний текст) для случаев с устаревшим rendered_text.
+    """
+    serializer = ClinicalCaseSerializer()
+    counts = {
+        "result_count": _count_map(Result.objects.all(), "data_set__clinical_case", cases),
+        "complication_count": _count_map(
+            ClinicalCaseComplication.objects.all(), "clinical_case", cases
+        ),
+    }
+    summaries = []
+    stale = []
+    for case in cases.select_related(*SUMMARY_RELATED):
+        text = case.render_text()
+        if case.rendered_text != text:
+            stale.append((case, case.rendered_text))
+            case.rendered_text = text
+        summaries.append(build_summary(
+            case, serializer, **{name: counts[name].get(case.pk, 0) for name in COUNT_FIELDS}
+        ))
+    return summaries, stale
+
+
+def _save_rendered_text(cases):
+    # Один UPDATE по массивам вместо CASE WHEN на строку (bulk_update);
+    # сигналы не отправляются и пересчёт не запускается повторно
+    if not cases:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {ClinicalCase._meta.db_table} c SET rendered_text = v.text
+            FROM unnest(%s::bigint[], %s::text[]) AS v(id, text)
+            WHERE c.id = v.id
+            """,
+            [[case.pk for case in cases], [case.rendered_text for case in cases]],
+        )
+
+
+def refresh_case_summaries(case_ids):
+    """
+    Пересчитывает сводки указанных случаев (вставка или обновление)
+    и сохранённый текст случаев, если он изменился.
+    """
+    case_ids = sorted({pk for pk in case_ids if pk is not None})
+    for start in range(0, len(case_ids), BATCH_SIZE):
+        summaries, stale = render_summaries(
+            ClinicalCase.objects.filter(pk__in=case_ids[start:start + BATCH_SIZE])
+        )
+        _save_rendered_text([case for case, _ in stale])
+        ClinicalCaseSummary.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=["clinical_case"],
+            update_fields=[*SUMMARY_FIELDS, *COUNT_FIELDS],
+        )
+
+
+def refresh_case_counts(case_ids):
+    """
+    Обновляет только счётчики результатов и осложнений. Строки сводок
+    не создаются: случай мог быть удалён в той же транзакции (каскад).
+    """
+    case_ids = {pk for pk in case_ids if pk is not None}
+    if case_ids:
+        ClinicalCaseSummary.objects.filter(clinical_case_id__in=case_ids).update(
+            **case_counts(OuterRef("clinical_case_id"))
+        )
+
+
+def rebuild_case_summaries():
+    """Полностью перестраивает таблицу сводок."""
+    with transaction.atomic():
+        ClinicalCaseSummary.objects.all().delete()
+        case_ids = ClinicalCase.objects.order_by("pk").values_list("pk", flat=True)
+        refresh_case_summaries(case_ids)
+
+
+def check_case_summaries():
+    """
+    Сравнивает таблицу и сохранённый текст случаев со сводками,
+    собранными заново.
+    Возвращает список расхождений (id случая, поле, ожидалось, в таблице).
+    """
+    actual = {summary.pk: summary for summary in ClinicalCaseSummary.objects.all()}
+    case_ids = list(ClinicalCase.objects.order_by("pk").values_list("pk", flat=True))
+    drift = []
+    for start in range(0, len(case_ids), BATCH_SIZE):
+        cases = ClinicalCase.objects.filter(pk__in=case_ids[start:start + BATCH_SIZE])
+        summaries, stale = render_summaries(cases)
+        for case, previous in stale:
+            drift.append((case.pk, "rendered_text", case.rendered_text, previous))
+        for expected in summaries:
+            current = actual.get(expected.pk)
+            for field in (*SUMMARY_FIELDS, *COUNT_FIELDS):
+                expected_value = getattr(expected, field)
+                actual_value = getattr(current, field) if current is not None else None
+                if expected_value != actual_value:
+                    drift.append((expected.pk, field, expected_value, actual_value))
+    return drift
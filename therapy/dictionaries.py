@@ -0,0 +1,208 @@
+import json
+import threading
+import time
+from functools import lru_cache
+
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .models import (
+    Grade,
+    Histology,
+    Location,
+    Metastasis,
+    ModelName,
+    Node,
+    Parameter,
+    RadiationTherapyType,
+    RiskGroup,
+    SpecLocation,
+    Stage,
+    Tumor,
+    Unit,
+)
+
+
+# Справочники, которые почти не меняются и держатся в памяти процесса.
+# Диагнозы (МКБ) и осложнения сюда не входят: это тысячи строк, которые
+# клиент ищет через typeahead, а не загружает целиком
+DICTIONARY_MODELS = (
+    Stage,
+    RiskGroup,
+    Grade,
+    Histology,
+    Tumor,
+    Node,
+    Metastasis,
+    RadiationTherapyType,
+    Unit,
+    Location,
+    SpecLocation,
+    Parameter,
+    ModelName,
+)
+
+# Версия лежит в общем для процессов кэше (settings.CACHES["versions"]),
+# сами справочники — в памяти каждого процесса
+VERSIONS_CACHE_ALIAS = "versions"
+VERSION_KEY = "dictionaries:version"
+
+# Ключи справочников в сводном ответе — как префиксы их маршрутов
+BUNDLE_KEYS = {
+    Stage: "stage",
+    RiskGroup: "risk-group",
+    Grade: "grade",
+    Histology: "histology",
+    Tumor: "tumor",
+    Node: "node",
+    Metastasis: "metastasis",
+    RadiationTherapyType: "radiation-therapy-type",
+    Unit: "unit",
+    Location: "location",
+    SpecLocation: "spec-location",
+    Parameter: "parameter",
+    ModelName: "model-name",
+}
+
+# Служебные поля не нужны клиенту и не входят в сводку
+BUNDLE_EXCLUDED_FIELDS = ("created_at", "updated_at")
+
+# Связи, которые загружаются вместе со справочником (для __str__)
+DICTIONARY_RELATED = {
+    SpecLocation: ("location",),
+    Parameter: ("unit",),
+}
+
+_lock = threading.Lock()
+_store = {"version": None, "entries": {}, "bundle": None}
+
+
+def dictionary_version():
+    """Глобальная версия справочников из общего кэша."""
+    cache = caches[VERSIONS_CACHE_ALIAS]
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Как и для поколения агрегатов: после очистки кэша версия не повторится
+        version = time.time_ns()
+        if not cache.add(VERSION_KEY, version, timeout=None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def _bump_version():
+    caches[VERSIONS_CACHE_ALIAS].set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_dictionary_version():
+    """
+    Помечает справочники изменёнными; процессы перечитают их при
+    обращении. Версия меняется после фиксации транзакции: иначе процесс
+    мог бы перечитать старые строки и сохранить их под новой версией.
+    """
+    transaction.on_commit(_bump_version)
+
+
+def _entries(model, version):
+    with _lock:
+        if _store["version"] != version:
+            _store["version"] = version
+            _store["entries"] = {}
+            _store["bundle"] = None
+        entries = _store["entries"].get(model)
+    if entries is None:
+        queryset = model.objects.select_related(*DICTIONARY_RELATED.get(model, ()))
+        entries = {obj.pk: obj for obj in queryset}
+        with _lock:
+            if _store["version"] == version:
+                _store["entries"][model] = entries
+    return entries
+
+
+def dictionary_entry(model, pk, version=None):
+    """Объект справочника по id из памяти процесса (None, если его нет)."""
+    if pk is None:
+        return None
+    return _entries(model, version or dictionary_version()).get(pk)
+
+
+def bundle_etag(version):
+    """Сильный ETag сводки справочников для версии."""
+    return f'"dictionaries-{version}"'
+
+
+def _bundle_columns(model):
+    return [
+        field.attname
+        for field in model._meta.concrete_fields
+        if field.name not in BUNDLE_EXCLUDED_FIELDS
+    ]
+
+
+def reference_bundle(version=None):
+    """
+    Все справочники одним JSON-документом (bytes) в компактном виде:
+    для каждого словаря список колонок и строки-массивы в порядке id.
+    Документ собирается из памяти процесса один раз на версию.
+    """
+    version = version or dictionary_version()
+    with _lock:
+        bundle = _store["bundle"] if _store["version"] == version else None
+    if bundle is not None:
+        return bundle
+
+    dictionaries = {}
+    for model in DICTIONARY_MODELS:
+        columns = _bundle_columns(model)
+        entries = _entries(model, version)
+        dictionaries[BUNDLE_KEYS[model]] = {
+            "fields": columns,
+            "rows": [
+                [getattr(entries[pk], column) for column in columns]
+                for pk in sorted(entries)
+            ],
+        }
+    bundle = json.dumps(
+        {"version": str(version), "dictionaries": dictionaries},
+        cls=DjangoJSONEncoder,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    with _lock:
+        if _store["version"] == version:
+            _store["bundle"] = bundle
+    return bundle
+
+
+@lru_cache(maxsize=None)
+def _dictionary_fields(model):
+    return tuple(
+        field
+        for field in model._meta.concrete_fields
+        if field.is_relation and field.related_model in DICTIONARY_MODELS
+    )
+
+
+def attach_dictionaries(instances, field_names=None, version=None):
+    """
+    Подставляет закэшированные справочники в кэш внешних ключей объектов:
+    obj.stage, obj.spec_location и __str__ дальше работают без запросов.
+    field_names ограничивает набор связей, version — уже прочитанная
+    версия справочников (иначе читается из общего кэша). Объекты
+    справочников общие для процесса и должны только читаться.
+    """
+    if version is None:
+        version = dictionary_version()
+    for obj in instances:
+        if obj is None:
+            continue
+        for field in _dictionary_fields(type(obj)):
+            if field_names is not None and field.name not in field_names:
+                continue
+            pk = getattr(obj, field.attname)
+            if pk is None or field.is_cached(obj):
+                continue
+            related = dictionary_entry(field.related_model, pk, version)
+            if related is not None:
+                field.set_cached_value(obj, related)
+    return instances
@@ -0,0 +1,63 @@
+import csv
+import json
+from itertools import islice
+
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+class Echo:
+    """Буфер для csv.writer: записанная строка сразу возвращается."""
+
+    def write(self, value):
+        return value
+
+
+def export_chunk_size():
+    return getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+
+
+def iterate_rows(queryset, serializer):
+    """
+    Сериализует случаи по мере чтения из серверного курсора.
+    prefetch_related выполняется для каждой порции из chunk_size строк,
+    поэтому память ограничена размером порции. Справочники случаев без
+    сводки тоже загружаются на порцию (prepare_instances).
+    """
+    chunk_size = export_chunk_size()
+    objects = queryset.iterator(chunk_size=chunk_size)
+    prepare = getattr(serializer, "prepare_instances", None)
+    while chunk := list(islice(objects, chunk_size)):
+        if prepare is not None:
+            prepare(chunk)
+        for obj in chunk:
+            yield serializer.to_representation(obj)
+
+
+def _dumps(value):
+    return json.dumps(value, cls=JSONEncoder, ensure_ascii=False)
+
+
+def stream_ndjson(rows):
+    for row in rows:
+        yield _dumps(row) + "\n"
+
+
+def _csv_value(value):
+    # Вложенные списки и объекты записываются в ячейку как JSON
+    if isinstance(value, (list, dict)):
+        return _dumps(value)
+    return value
+
+
+def stream_csv(rows, field_names):
+    writer = csv.writer(Echo())
+    yield writer.writerow(field_names)
+    for row in rows:
+        yield writer.writerow([_csv_value(row.get(name)) for name in field_names])
@@ -0,0 +1,223 @@
+import django_filters
+from django.db.models import Exists, OuterRef, Q
+from rest_framework.exceptions import ValidationError
+
+from .models import ClinicalCase, ClinicalCaseComplication, DataSet, Result
+
+
+# Параметр запроса -> поле клинического случая для фильтра __in
+CLINICAL_CASE_FILTERS = {
+    "result": "dataset__result",
+    "dataset": "dataset",
+    "source": "dataset__source",
+    "model_structure": "dataset__result__model_structure",
+    "model_name": "dataset__result__model_structure__model_name",
+    "parameter": "dataset__result__model_structure__parameter",
+    "age": "age",
+    "location": "spec_location__location",
+    "age_min": "age_min",
+    "gender": "gender",
+    "age_max": "age_max",
+    "quantity": "quantity",
+    "diagnosis": "diagnosis",
+    "spec_location": "spec_location",
+    "complication": "clinicalcasecomplication__complication",
+    "stage": "stage",
+    "risk_group": "risk_group",
+    "radiation_therapy_type": "radiation_therapy_type",
+    "tumor": "tumor",
+    "node": "node",
+    "metastasis": "metastasis",
+    "histology": "histology",
+    "grade": "grade",
+    "number_of_fractions": "number_of_fractions",
+    "single_dose": "single_dose",
+    "treatment_duration": "treatment_duration",
+}
+
+
+def split_values(value):
+    """Значение фильтра: строка через запятую или список."""
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return str(value).split(",")
+
+
+# Фильтры по обратным (многозначным) связям: модель связи, путь от неё
+# к клиническому случаю и поля модели для каждого параметра. Параметры
+# одной группы должны выполняться для одной и той же строки связи
+RELATION_FILTERS = (
+    (
+        Result,
+        "data_set__clinical_case",
+        {
+            "result": "pk",
+            "model_structure": "model_structure",
+            "model_name": "model_structure__model_name",
+            "parameter": "model_structure__parameter",
+        },
+    ),
+    (DataSet, "clinical_case", {"dataset": "pk", "source": "source"}),
+    (ClinicalCaseComplication, "clinical_case", {"complication": "complication"}),
+)
+
+
+# Поля, для которых доступны диапазоны __gte/__lte
+RANGE_FIELDS = (
+    "age",
+    "age_min",
+    "age_max",
+    "single_dose",
+    "number_of_fractions",
+    "treatment_duration",
+)
+
+RANGE_OPERATORS = ("gte", "lte")
+NOT_OPERATOR = "not"
+
+# Параметр OR-групп: группы через «;», условия группы через «|»,
+# условие — «фильтр:значения», например or=stage:1,2|age__lte:40;tumor:3
+OR_PARAM = "or"
+
+
+def _relation(name):
+    for model, case_lookup, lookups in RELATION_FILTERS:
+        if name in lookups:
+            return model, case_lookup, lookups[name]
+    return None
+
+
+def _exists(name, values):
+    model, case_lookup, lookup = _relation(name)
+    related = model.objects.filter(**{case_lookup: OuterRef("pk"), f"{lookup}__in": values})
+    return Q(Exists(related))
+
+
+def compile_filters(values):
+    """
+    Собирает Q из очищенных значений фильтров (имя -> значение).
+
+    Фильтры по обратным связям одной модели объединяются в один
+    коррелированный EXISTS, поэтому JOIN не размножает строки случаев.
+    """
+    values = dict(values)
+    condition = Q()
+    for model, case_lookup, lookups in RELATION_FILTERS:
+        conditions = {
+            f"{lookup}__in": values.pop(name)
+            for name, lookup in lookups.items()
+            if name in values
+        }
+        if conditions:
+            related = model.objects.filter(**{case_lookup: OuterRef("pk")}, **conditions)
+            condition &= Q(Exists(related))
+
+    for name, value in values.items():
+        if name in CLINICAL_CASE_FILTERS:
+            condition &= Q(**{f"{CLINICAL_CASE_FILTERS[name]}__in": value})
+            continue
+        field, _, operator = name.rpartition("__")
+        if operator in RANGE_OPERATORS:
+            condition &= Q(**{f"{CLINICAL_CASE_FILTERS[field]}__{operator}": value})
+        elif _relation(field) is not None:
+            condition &= ~_exists(field, value)
+        else:
+            condition &= ~Q(**{f"{CLINICAL_CASE_FILTERS[field]}__in": value})
+    return condition
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
+
+
+class ClinicalCaseFilterSet(django_filters.FilterSet):
+    """
+    Фильтры клинических случаев: значения через запятую (__in), диапазоны
+    __gte/__lte, исключение __not и OR-группы. Все условия компилируются
+    в одно выражение WHERE.
+    """
+
+    class Meta:
+        model = ClinicalCase
+        fields = []
+
+    @classmethod
+    def get_filters(cls):
+        filters = super().get_filters()
+        for name, lookup in CLINICAL_CASE_FILTERS.items():
+            filters[name] = NumberInFilter(field_name=lookup)
+            filters[f"{name}__{NOT_OPERATOR}"] = NumberInFilter(field_name=lookup)
+        for name in RANGE_FIELDS:
+            for operator in RANGE_OPERATORS:
+                filters[f"{name}__{operator}"] = django_filters.NumberFilter(field_name=name)
+        filters[OR_PARAM] = django_filters.CharFilter()
+        return filters
+
+    def parse_or_groups(self, value):
+        groups = []
+        for group in value.split(";"):
+            terms = []
+            for term in group.split("|"):
+                name, _, term_value = term.partition(":")
+                name = name.strip()
+                if name not in self.base_filters or name == OR_PARAM:
+                    raise ValidationError({OR_PARAM: f"Неизвестный фильтр в OR-группе: {name}"})
+                term_filters = type(self)({name: term_value.strip()})
+                if not term_filters.is_valid():
+                    raise ValidationError({OR_PARAM: term_filters.errors})
+                terms.append(term_filters.cleaned_values())
+            groups.append(terms)
+        return groups
+
+    def cleaned_values(self):
+        return {
+            name: value
+            for name, value in self.form.cleaned_data.items()
+            if value not in (None, "", []) and name != OR_PARAM
+        }
+
+    def filter_queryset(self, queryset):
+        condition = compile_filters(self.cleaned_values())
+        or_value = self.form.cleaned_data.get(OR_PARAM)
+        if or_value:
+            for terms in self.parse_or_groups(or_value):
+                group = Q()
+                for term in terms:
+                    group |= compile_filters(term)
+                condition &= group
+        return queryset.filter(condition) if condition else queryset
+
+
+def filter_clinical_cases(queryset, params):
+    """
+    Применяет фильтры клинических случаев из query-параметров или
+    словаря (например, тела запроса агрегации).
+    """
+    data = {}
+    for name in ClinicalCaseFilterSet.base_filters:
+        value = params.get(name)
+        if value in (None, "", []):
+            continue
+        if name == OR_PARAM:
+            # Запятые внутри условий — разделители значений, а не групп:
+            # строка передаётся как есть, список групп склеивается через «;»
+            data[name] = ";".join(value) if isinstance(value, (list, tuple)) else str(value)
+        else:
+            data[name] = ",".join(split_values(value))
+
+    filterset = ClinicalCaseFilterSet(data, queryset=queryset)
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    return filterset.qs
+
+
+def validate_filter_spec(filters):
+    """Проверяет словарь фильтров, пришедший в теле запроса."""
+    if not isinstance(filters, dict):
+        raise ValidationError({"filters": "Ожидается объект с фильтрами."})
+    unknown = set(filters) - set(ClinicalCaseFilterSet.base_filters)
+    if unknown:
+        raise ValidationError(
+            {"filters": "Неизвестные фильтры: " + ", ".join(sorted(unknown))}
+        )
+    return filters
@@ -0,0 +1,95 @@
+from django.db import transaction
+
+from . import parameter_statistics
+from .aggregation import invalidate_aggregations
+from .case_summary import build_summary
+from .models import (
+    ClinicalCase,
+    ClinicalCaseComplication,
+    ClinicalCaseSummary,
+    DataSet,
+    Result,
+)
+from .serializers import ClinicalCaseSerializer
+
+
+BATCH_SIZE = 1000
+
+
+def ingest_cases(items):
+    """
+    Сохраняет проверенные случаи (validated_data IngestClinicalCaseSerializer)
+    с вложенными наборами данных, результатами и осложнениями: по одному
+    bulk_create на таблицу в одной транзакции. Возвращает id созданных
+    объектов в порядке входных данных.
+    """
+    cases, datasets, results, complications = [], [], [], []
+    created = []
+    for item in items:
+        item = dict(item)
+        dataset_items = item.pop("datasets", [])
+        complication_items = item.pop("complications", [])
+
+        case = ClinicalCase(**item)
+        # Справочники уже загружены при проверке, текст собирается без запросов
+        case.rendered_text = case.render_text()
+        cases.append(case)
+
+        case_datasets = []
+        for dataset_item in dataset_items:
+            dataset_item = dict(dataset_item)
+            result_items = dataset_item.pop("results", [])
+            dataset = DataSet(clinical_case=case, **dataset_item)
+            dataset_results = [Result(data_set=dataset, **result) for result in result_items]
+            datasets.append(dataset)
+            results.extend(dataset_results)
+            case_datasets.append((dataset, dataset_results))
+
+        case_complications = [
+            ClinicalCaseComplication(clinical_case=case, complication=complication)
+            for complication in complication_items
+        ]
+        complications.extend(case_complications)
+        created.append((case, case_datasets, case_complications))
+
+    # Внешние ключи на только что созданные строки bulk_create берёт
+    # из связанных объектов, поэтому порядок таблиц — от случая к результату
+    with transaction.atomic():
+        ClinicalCase.objects.bulk_create(cases, batch_size=BATCH_SIZE)
+        DataSet.objects.bulk_create(datasets, batch_size=BATCH_SIZE)
+        Result.objects.bulk_create(results, batch_size=BATCH_SIZE)
+        ClinicalCaseComplication.objects.bulk_create(complications, batch_size=BATCH_SIZE)
+
+        # bulk_create не отправляет сигналы: статистика, сводки и кэш агрегатов
+        # Все результаты созданных случаев новые: они добавляются в группы
+        # статистики без их пересчёта
+        parameter_statistics.merge_statistics(
+            Result.objects.filter(data_set__clinical_case__in=[case.pk for case in cases])
+        )
+        # Сводки строятся из объектов в памяти, без повторного чтения случаев
+        serializer = ClinicalCaseSerializer()
+        ClinicalCaseSummary.objects.bulk_create(
+            (
+                build_summary(
+                    case,
+                    serializer,
+                    result_count=sum(len(dataset_results) for _, dataset_results in case_datasets),
+                    complication_count=len(case_complications),
+                )
+                for case, case_datasets, case_complications in created
+            ),
+            batch_size=BATCH_SIZE,
+        )
+    invalidate_aggregations()
+
+    return [
+        {
+            "id": case.pk,
+            "datasets": [
+                {"id": dataset.pk, "results": [result.pk for result in dataset_results]}
+                for dataset, dataset_results in case_datasets
+            ],
+            "complications": [link.pk for link in case_complications],
+        }
+        for case, case_datasets, case_complications in created
+    ]
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from therapy.query_catalog import explain_query, representative_queries
+
+
+class Command(BaseCommand):
+    help = "Выполняет EXPLAIN ANALYZE для каталога типичных запросов API"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names",
+            nargs="*",
+            help="Названия запросов из каталога (по умолчанию все)",
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="Вывести полный план в формате JSON",
+        )
+
+    def handle(self, *args, **options):
+        queries = representative_queries()
+        if not queries:
+            raise CommandError("Нет данных для построения запросов каталога")
+        unknown = set(options["names"]) - set(queries)
+        if unknown:
+            raise CommandError("Неизвестные запросы: " + ", ".join(sorted(unknown)))
+
+        for name, queryset in queries.items():
+            if options["names"] and name not in options["names"]:
+                continue
+            report = explain_query(queryset)
+            self.stdout.write(
+                f"{name}: выполнение {report['execution_time']:.3f} мс, "
+                f"планирование {report['planning_time']:.3f} мс, "
+                f"стоимость {report['total_cost']:.2f}, "
+                f"индексы: {', '.join(report['indexes']) or '-'}"
+            )
+            if options["plan"]:
+                self.stdout.write(json.dumps(report["plan"], indent=2, ensure_ascii=False))
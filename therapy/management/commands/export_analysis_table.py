@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from therapy.analysis_table import ANALYSIS_FORMATS, write_analysis_table
+
+
+class Command(BaseCommand):
+    help = "Выгружает таблицу «случай × результат» в Parquet или Arrow IPC"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Путь к создаваемому файлу")
+        parser.add_argument(
+            "--format",
+            dest="file_format",
+            choices=sorted(ANALYSIS_FORMATS),
+            default="parquet",
+            help="Формат файла (по умолчанию parquet)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=50000,
+            help="Число строк в одной порции (row group / record batch)",
+        )
+
+    def handle(self, *args, **options):
+        row_count = write_analysis_table(
+            options["path"],
+            file_format=options["file_format"],
+            chunk_size=options["chunk_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Записано строк: {row_count}"))
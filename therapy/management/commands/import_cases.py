@@ -0,0 +1,58 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from therapy.bulk_import import (
+    CHUNK_SIZE,
+    IMPORT_FORMATS,
+    ImportFileError,
+    import_rows,
+    read_rows,
+)
+
+
+class Command(BaseCommand):
+    help = "Импортирует таблицу «случай × результат» из CSV или XLSX"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Путь к файлу")
+        parser.add_argument(
+            "--format",
+            dest="file_format",
+            choices=IMPORT_FORMATS,
+            help="Формат файла (по умолчанию — по расширению)",
+        )
+        parser.add_argument(
+            "--create-missing",
+            action="store_true",
+            help="Дополнять справочники неизвестными значениями",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Число строк, проверяемых и копируемых за раз",
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        file_format = options["file_format"] or path.suffix.lstrip(".").lower()
+        try:
+            with path.open("rb") as stream:
+                report = import_rows(
+                    read_rows(stream, file_format),
+                    create_missing=options["create_missing"],
+                    chunk_size=options["chunk_size"],
+                )
+        except (OSError, ImportFileError) as error:
+            raise CommandError(str(error)) from error
+
+        for error in report["errors"]:
+            self.stderr.write(f"Строка {error['row']}, {error['column']}: {error['error']}")
+        if report["ignored_columns"]:
+            self.stdout.write("Пропущены столбцы: " + ", ".join(report["ignored_columns"]))
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк: {report['rows']}, импортировано: {report['imported_rows']}; "
+            f"случаев: {report['cases']}, наборов данных: {report['datasets']}, "
+            f"результатов: {report['results']}, осложнений: {report['complications']}"
+        ))
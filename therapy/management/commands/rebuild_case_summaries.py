@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from therapy.case_summary import check_case_summaries, rebuild_case_summaries
+
+
+class Command(BaseCommand):
+    help = "Перестраивает сводки клинических случаев или проверяет их на расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только сравнить сводки с исходными данными, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            drift = check_case_summaries()
+            for case_id, field, expected, actual in drift:
+                self.stdout.write(
+                    f"clinical_case={case_id} {field}: ожидалось {expected!r}, в сводке {actual!r}"
+                )
+            if drift:
+                raise CommandError(f"Найдено расхождений: {len(drift)}")
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+            return
+
+        rebuild_case_summaries()
+        self.stdout.write(self.style.SUCCESS("Сводки клинических случаев перестроены"))
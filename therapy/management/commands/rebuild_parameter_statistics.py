@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from therapy.parameter_statistics import check_statistics, rebuild_statistics
+
+
+class Command(BaseCommand):
+    help = "Перестраивает таблицу статистики параметров или проверяет её на расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Только сравнить таблицу с исходными данными, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            drift = check_statistics()
+            for (ms_id, location_id), field, expected, actual in drift:
+                self.stdout.write(
+                    f"model_structure={ms_id} location={location_id} "
+                    f"{field}: ожидалось {expected}, в таблице {actual}"
+                )
+            if drift:
+                raise CommandError(f"Найдено расхождений: {len(drift)}")
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+            return
+
+        rebuild_statistics()
+        self.stdout.write(self.style.SUCCESS("Статистика параметров перестроена"))
@@ -0,0 +1,37 @@
+from django.db.models import F, Max, Window
+from django.core.management.base import BaseCommand
+
+from therapy.bulk_edit import bulk_delete
+from therapy.models import Result
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет повторяющиеся результаты (набор данных, структура модели), "
+        "оставляя последний загруженный; статистика и сводки обновляются"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только перечислить удаляемые результаты",
+        )
+
+    def handle(self, *args, **options):
+        stale = list(
+            Result.objects.filter(data_set__isnull=False)
+            .annotate(latest=Window(Max("id"), partition_by=[F("data_set"), F("model_structure")]))
+            .filter(id__lt=F("latest"))
+            .order_by("id")
+            .values_list("id", "data_set_id", "model_structure_id")
+        )
+        for pk, data_set_id, structure_id in stale:
+            self.stdout.write(
+                f"result={pk} data_set={data_set_id} model_structure={structure_id}"
+            )
+        if options["dry_run"] or not stale:
+            self.stdout.write(f"Повторяющихся результатов: {len(stale)}")
+            return
+        counts = bulk_delete(Result, [pk for pk, _, _ in stale])
+        self.stdout.write(self.style.SUCCESS(f"Удалено результатов: {counts['deleted']}"))
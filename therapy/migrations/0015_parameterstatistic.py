@@ -0,0 +1,89 @@
+# Generated by Django 4.2 on 2026-10-18 05:13
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, Sum
+import django.db.models.deletion
+
+
+LOCATION_LOOKUP = "data_set__clinical_case__spec_location__location"
+
+
+def fill_statistics(apps, schema_editor):
+    # Таблица заполняется по уже загруженным результатам, как
+    # rebuild_parameter_statistics; иначе агрегаты по таблице были бы
+    # пустыми до ручного пересчёта. Исторические модели: код
+    # therapy.parameter_statistics может измениться
+    Result = apps.get_model("therapy", "Result")
+    ParameterStatistic = apps.get_model("therapy", "ParameterStatistic")
+    results = Result.objects.filter(value__isnull=False, **{f"{LOCATION_LOOKUP}__isnull": False})
+
+    def extreme_ids(value_order):
+        rows = (
+            results.order_by("model_structure_id", LOCATION_LOOKUP, value_order, "id")
+            .distinct("model_structure_id", LOCATION_LOOKUP)
+            .values_list("model_structure_id", LOCATION_LOOKUP, "id")
+        )
+        return {(ms_id, location_id): pk for ms_id, location_id, pk in rows}
+
+    minimums = extreme_ids("value")
+    maximums = extreme_ids("-value")
+    groups = (
+        results.values("model_structure_id", LOCATION_LOOKUP)
+        .annotate(
+            count=Count("id"),
+            sum=Sum("value"),
+            sum_of_squares=Sum(F("value") * F("value")),
+            min_value=Min("value"),
+            max_value=Max("value"),
+        )
+        .order_by()
+    )
+    statistics = []
+    for group in groups:
+        key = (group["model_structure_id"], group[LOCATION_LOOKUP])
+        statistics.append(ParameterStatistic(
+            model_structure_id=key[0],
+            location_id=key[1],
+            count=group["count"],
+            sum=group["sum"],
+            sum_of_squares=group["sum_of_squares"],
+            min_value=group["min_value"],
+            max_value=group["max_value"],
+            min_result_id=minimums[key],
+            max_result_id=maximums[key],
+        ))
+    ParameterStatistic.objects.bulk_create(statistics, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('therapy', '0014_rename_сlinical_сase_clinicalcasecomplication_clinical_case'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Количество')),
+                ('sum', models.FloatField(default=0, verbose_name='Сумма')),
+                ('sum_of_squares', models.FloatField(default=0, verbose_name='Сумма квадратов')),
+                ('min_value', models.FloatField(blank=True, null=True, verbose_name='Минимум')),
+                ('max_value', models.FloatField(blank=True, null=True, verbose_name='Максимум')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='therapy.location', verbose_name='Локализация')),
+                ('max_result', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='therapy.result', verbose_name='Результат с максимумом')),
+                ('min_result', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='therapy.result', verbose_name='Результат с минимумом')),
+                ('model_structure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='therapy.modelstructure', verbose_name='Структура модели')),
+            ],
+            options={
+                'verbose_name': 'Статистика параметра',
+                'verbose_name_plural': 'Статистика параметров',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='parameterstatistic',
+            constraint=models.UniqueConstraint(fields=('model_structure', 'location'), name='unique_parameter_statistic'),
+        ),
+        migrations.RunPython(fill_statistics, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 05:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('therapy', '0015_parameterstatistic'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clinicalcase',
+            index=models.Index(fields=['spec_location', 'radiation_therapy_type', 'stage'], name='case_location_rt_stage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dataset',
+            index=models.Index(fields=['clinical_case', 'source'], name='dataset_case_source_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='modelstructure',
+            index=models.Index(fields=['model_name', 'parameter'], name='structure_model_param_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(condition=models.Q(('value__isnull', False)), fields=['data_set'], include=('model_structure', 'value'), name='result_dataset_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='result',
+            index=models.Index(fields=['model_structure', 'data_set'], name='result_structure_dataset_idx'),
+        ),
+    ]
@@ -0,0 +1,112 @@
+# Generated by Django 4.2 on 2026-10-18 05:32
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# Документы поиска: таблица -> [(столбец, вес, конфигурации)].
+# Текст индексируется русской и английской конфигурациями, коды — simple
+TEXT = ("russian", "english")
+SEARCH_DOCUMENTS = {
+    "therapy_diagnosis": [
+        ("code", "A", ("simple",)),
+        ("description", "B", TEXT),
+        ("note", "C", TEXT),
+    ],
+    "therapy_complication": [
+        ("name", "A", TEXT),
+        ("alt_name", "A", TEXT),
+        ("note", "C", TEXT),
+    ],
+    "therapy_clinicalcase": [
+        ("refined_diagnosis", "A", TEXT),
+        ("note", "B", TEXT),
+    ],
+    "therapy_source": [
+        ("name", "A", TEXT),
+        ("full_name", "B", TEXT),
+        ("note", "C", TEXT),
+    ],
+}
+
+
+def trigger_sql(table, columns):
+    document = " ||\n        ".join(
+        f"setweight(to_tsvector('{config}', coalesce(NEW.{column}, '')), '{weight}')"
+        for column, weight, configs in columns
+        for config in configs
+    )
+    return f"""
+    CREATE FUNCTION {table}_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+        {document};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER {table}_search_vector_update
+        BEFORE INSERT OR UPDATE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION {table}_search_vector();
+
+    UPDATE {table} SET search_vector = NULL;
+    """
+
+
+def drop_trigger_sql(table):
+    return f"""
+    DROP TRIGGER IF EXISTS {table}_search_vector_update ON {table};
+    DROP FUNCTION IF EXISTS {table}_search_vector();
+    """
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('therapy', '0016_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinicalcase',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='complication',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='diagnosis',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='clinicalcase',
+            index=django.contrib.postgres.indexes.GinIndex(fastupdate=False, fields=['search_vector'], name='case_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='complication',
+            index=django.contrib.postgres.indexes.GinIndex(fastupdate=False, fields=['search_vector'], name='complication_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=django.contrib.postgres.indexes.GinIndex(fastupdate=False, fields=['search_vector'], name='diagnosis_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='source',
+            index=django.contrib.postgres.indexes.GinIndex(fastupdate=False, fields=['search_vector'], name='source_search_idx'),
+        ),
+    ] + [
+        # Вектор пересчитывается триггером при любой записи, в том числе
+        # через bulk_create и update(), которые не отправляют сигналы
+        migrations.RunSQL(trigger_sql(table, columns), drop_trigger_sql(table))
+        for table, columns in SEARCH_DOCUMENTS.items()
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-18 05:37
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+# Триграммные GIN-индексы для нечёткого автодополнения: имя -> (таблица, столбец)
+TRIGRAM_INDEXES = {
+    "diagnosis_description_trgm_idx": ("therapy_diagnosis", "description"),
+    "speclocation_name_trgm_idx": ("therapy_speclocation", "name"),
+    "histology_name_trgm_idx": ("therapy_histology", "name"),
+    "complication_name_trgm_idx": ("therapy_complication", "name"),
+    "complication_alt_name_trgm_idx": ("therapy_complication", "alt_name"),
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # pg_trgm входит в contrib и может отсутствовать на сервере; тогда
+    # автодополнение работает через ILIKE (см. therapy/typeahead.py)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, (table, column) in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('therapy', '0017_full_text_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='diagnosis',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('code'), name='text_pattern_ops'), name='diagnosis_code_prefix_idx'),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
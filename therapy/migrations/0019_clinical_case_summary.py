@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 05:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('therapy', '0018_typeahead'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClinicalCaseSummary',
+            fields=[
+                ('clinical_case', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='therapy.clinicalcase', verbose_name='Клинический случай')),
+                ('name_location', models.TextField(blank=True, null=True)),
+                ('name_diagnosis', models.TextField(blank=True, null=True)),
+                ('name_stage', models.TextField(blank=True, null=True)),
+                ('name_risk_group', models.TextField(blank=True, null=True)),
+                ('name_radiation_therapy_type', models.TextField(blank=True, null=True)),
+                ('name_tumor', models.TextField(blank=True, null=True)),
+                ('name_node', models.TextField(blank=True, null=True)),
+                ('name_metastasis', models.TextField(blank=True, null=True)),
+                ('name_histology', models.TextField(blank=True, null=True)),
+                ('name_grade', models.TextField(blank=True, null=True)),
+                ('gender_display', models.TextField(blank=True, null=True)),
+                ('clinical_case_text', models.TextField(blank=True, null=True)),
+                ('text_location', models.TextField(blank=True, null=True)),
+                ('text_diagnosis', models.TextField(blank=True, null=True)),
+                ('text_stage', models.TextField(blank=True, null=True)),
+                ('text_risk_group', models.TextField(blank=True, null=True)),
+                ('text_radiation_therapy_type', models.TextField(blank=True, null=True)),
+                ('text_tumor', models.TextField(blank=True, null=True)),
+                ('text_node', models.TextField(blank=True, null=True)),
+                ('text_metastasis', models.TextField(blank=True, null=True)),
+                ('text_histology', models.TextField(blank=True, null=True)),
+                ('text_grade', models.TextField(blank=True, null=True)),
+                ('result_count', models.IntegerField(default=0, verbose_name='Количество результатов')),
+                ('complication_count', models.IntegerField(default=0, verbose_name='Количество осложнений')),
+            ],
+            options={
+                'verbose_name': 'Сводка клинического случая',
+                'verbose_name_plural': 'Сводки клинических случаев',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('therapy', '0019_clinical_case_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinicalcase',
+            name='rendered_text',
+            field=models.TextField(editable=False, null=True, verbose_name='Текст клинического случая'),
+        ),
+    ]
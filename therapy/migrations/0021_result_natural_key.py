@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-18 06:40
+
+from django.db import migrations, models
+
+
+# Сколько повторяющихся ключей перечислять в сообщении
+LISTED_DUPLICATES = 20
+
+
+def check_duplicate_results(apps, schema_editor):
+    # Повторы (набор данных, структура модели) миграция не удаляет:
+    # исторические модели не обновляют статистику и сводки. Их удаляет
+    # команда remove_duplicate_results до применения миграции
+    Result = apps.get_model("therapy", "Result")
+    duplicates = list(
+        Result.objects.filter(data_set__isnull=False)
+        .values("data_set", "model_structure")
+        .annotate(total=models.Count("id"))
+        .filter(total__gt=1)
+        .order_by("data_set", "model_structure")
+        .values_list("data_set", "model_structure")[:LISTED_DUPLICATES + 1]
+    )
+    if duplicates:
+        keys = ", ".join(
+            f"(data_set={data_set}, model_structure={structure})"
+            for data_set, structure in duplicates[:LISTED_DUPLICATES]
+        )
+        if len(duplicates) > LISTED_DUPLICATES:
+            keys += " и другие"
+        raise RuntimeError(
+            f"Есть повторяющиеся результаты: {keys}. Удалите их командой "
+            "manage.py remove_duplicate_results и повторите migrate."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('therapy', '0020_clinical_case_rendered_text'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_results, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='result',
+            constraint=models.UniqueConstraint(fields=('data_set', 'model_structure'), name='result_dataset_structure_uniq'),
+        ),
+    ]
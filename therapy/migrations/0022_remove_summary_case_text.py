@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-18 09:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Текст случая хранится в ClinicalCase.rendered_text; копия в сводке
+    # удаляется. Случаи без сохранённого текста получают его из сводки
+
+    dependencies = [
+        ('therapy', '0021_result_natural_key'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            UPDATE therapy_clinicalcase c SET rendered_text = s.clinical_case_text
+            FROM therapy_clinicalcasesummary s
+            WHERE s.clinical_case_id = c.id AND c.rendered_text IS NULL
+            """,
+            """
+            UPDATE therapy_clinicalcasesummary s SET clinical_case_text = c.rendered_text
+            FROM therapy_clinicalcase c
+            WHERE s.clinical_case_id = c.id
+            """,
+        ),
+        migrations.RemoveField(
+            model_name='clinicalcasesummary',
+            name='clinical_case_text',
+        ),
+    ]
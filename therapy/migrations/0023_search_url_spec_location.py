@@ -0,0 +1,90 @@
+# Generated by Django 4.2 on 2026-10-18 10:05
+
+from django.db import migrations
+
+
+# Векторы поиска дополняются полями, которые искал прежний SearchFilter:
+# ссылкой источника и названием уточнённой локализации осложнения.
+# Документ: [(выражение, вес, конфигурации)], как в 0017_full_text_search
+TEXT = ("russian", "english")
+# Ссылка индексируется целиком (host, путь) и по словам между знаками
+URL_WORDS = r"regexp_replace(NEW.url, '[^[:alnum:]]+', ' ', 'g')"
+SPEC_LOCATION_NAME = (
+    "(SELECT name FROM therapy_speclocation WHERE id = NEW.spec_location_id)"
+)
+
+SOURCE_DOCUMENT = [
+    ("NEW.name", "A", TEXT),
+    ("NEW.full_name", "B", TEXT),
+    ("NEW.note", "C", TEXT),
+]
+COMPLICATION_DOCUMENT = [
+    ("NEW.name", "A", TEXT),
+    ("NEW.alt_name", "A", TEXT),
+    ("NEW.note", "C", TEXT),
+]
+
+
+def function_sql(table, document):
+    vector = " ||\n        ".join(
+        f"setweight(to_tsvector('{config}', coalesce({expression}, '')), '{weight}')"
+        for expression, weight, configs in document
+        for config in configs
+    )
+    return f"""
+    CREATE OR REPLACE FUNCTION {table}_search_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+        {vector};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    UPDATE {table} SET search_vector = NULL;
+    """
+
+
+# Переименование локализации пересчитывает векторы её осложнений
+SPEC_LOCATION_TRIGGER = """
+CREATE FUNCTION therapy_speclocation_complication_search() RETURNS trigger AS $$
+BEGIN
+    UPDATE therapy_complication SET search_vector = NULL
+    WHERE spec_location_id = NEW.id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER therapy_speclocation_complication_search_update
+    AFTER UPDATE OF name ON therapy_speclocation
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION therapy_speclocation_complication_search();
+"""
+
+DROP_SPEC_LOCATION_TRIGGER = """
+DROP TRIGGER IF EXISTS therapy_speclocation_complication_search_update ON therapy_speclocation;
+DROP FUNCTION IF EXISTS therapy_speclocation_complication_search();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('therapy', '0022_remove_summary_case_text'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            function_sql("therapy_source", SOURCE_DOCUMENT + [
+                ("NEW.url", "C", ("simple",)),
+                (URL_WORDS, "C", ("simple",)),
+            ]),
+            function_sql("therapy_source", SOURCE_DOCUMENT),
+        ),
+        migrations.RunSQL(
+            function_sql("therapy_complication", COMPLICATION_DOCUMENT + [
+                (SPEC_LOCATION_NAME, "B", TEXT),
+            ]),
+            function_sql("therapy_complication", COMPLICATION_DOCUMENT),
+        ),
+        migrations.RunSQL(SPEC_LOCATION_TRIGGER, DROP_SPEC_LOCATION_TRIGGER),
+    ]
@@ -1,4 +1,7 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Upper
 from django.core.validators import MinValueValidator
 from django.contrib.auth import get_user_model
 
@@ -121,9 +124,21 @@ class Diagnosis(models.Model):
         verbose_name="Доп. информация",
     )
 
+    # Поддерживается триггером БД (см. миграцию 0017_full_text_search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     class Meta:
         verbose_name = "Диагноз"
         verbose_name_plural = "Диагнозы"
+        indexes = [
+            # fastupdate=False: поиск не читает линейно список отложенных вставок GIN
+            GinIndex(fields=["search_vector"], name="diagnosis_search_idx", fastupdate=False),
+            # Префиксный поиск кода МКБ-10 без учёта регистра (code__istartswith)
+            models.Index(
+                OpClass(Upper("code"), name="text_pattern_ops"),
+                name="diagnosis_code_prefix_idx",
+            ),
+        ]
 
     def __str__(self):
         str_look = f"{self.code} - {self.description}"
@@ -198,9 +213,13 @@ class Complication(models.Model):
         verbose_name="Доп. информация",
     )
 
+    # Поддерживается триггером БД (см. миграцию 0017_full_text_search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     class Meta:
         verbose_name = "Осложнение"
         verbose_name_plural = "Осложнения"
+        indexes = [GinIndex(fields=["search_vector"], name="complication_search_idx", fastupdate=False)]
 
     def __str__(self):
         str_look = f"Осложнение: {self.name}"
@@ -512,11 +531,36 @@ class ClinicalCase(models.Model):
         verbose_name="Доп. информация",
     )
 
+    # Поддерживается триггером БД (см. миграцию 0017_full_text_search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Готовый текст __str__: заполняется при сохранении, при изменении
+    # справочников пересчитывается вместе со сводками (therapy.case_summary)
+    rendered_text = models.TextField(
+        null=True,
+        editable=False,
+        verbose_name="Текст клинического случая",
+    )
+
     class Meta:
         verbose_name = "Клинический случай"
         verbose_name_plural = "Клинические случаи"
+        indexes = [
+            GinIndex(fields=["search_vector"], name="case_search_idx", fastupdate=False),
+            # Типичный фильтр списка: локализация + тип лучевой терапии + стадия
+            models.Index(
+                fields=["spec_location", "radiation_therapy_type", "stage"],
+                name="case_location_rt_stage_idx",
+            ),
+        ]
 
     def __str__(self):
+        if self.rendered_text is not None:
+            return self.rendered_text
+        return self.render_text()
+
+    def render_text(self):
+        """Текст случая из полей и связанных справочников."""
         str_look = ""
 
         if self.quantity is not None:
@@ -741,6 +785,12 @@ class ModelStructure(models.Model):
     class Meta:
         verbose_name = "Структура модели"
         verbose_name_plural = "Структуры моделей"
+        indexes = [
+            models.Index(
+                fields=["model_name", "parameter"],
+                name="structure_model_param_idx",
+            ),
+        ]
 
     def __str__(self):
         str_look = f"Структура модели: {self.model_name}, Параметр: {self.parameter}"
@@ -774,9 +824,13 @@ class Source(models.Model):
         verbose_name="Доп. информация",
     )
 
+    # Поддерживается триггером БД (см. миграцию 0017_full_text_search)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     class Meta:
         verbose_name = "Источник"
         verbose_name_plural = "Источники"
+        indexes = [GinIndex(fields=["search_vector"], name="source_search_idx", fastupdate=False)]
 
     def __str__(self):
         str_look = f"Источник: {self.name}"
@@ -815,6 +869,13 @@ class DataSet(models.Model):
     class Meta:
         verbose_name = "Набор данных"
         verbose_name_plural = "Наборы данных"
+        indexes = [
+            # EXISTS-фильтр по источнику коррелирован по клиническому случаю
+            models.Index(
+                fields=["clinical_case", "source"],
+                name="dataset_case_source_idx",
+            ),
+        ]
 
     def __str__(self):
         str_look = f"Клинический случай: {self.clinical_case}"
@@ -866,9 +927,124 @@ class Result(models.Model):
     class Meta:
         verbose_name = "Результат измерения"
         verbose_name_plural = "Результаты измерений"
+        indexes = [
+            # Агрегация читает только непустые значения по наборам данных:
+            # частичный покрывающий индекс позволяет обойтись index-only scan
+            models.Index(
+                fields=["data_set"],
+                include=["model_structure", "value"],
+                condition=models.Q(value__isnull=False),
+                name="result_dataset_value_idx",
+            ),
+            # EXISTS-фильтры по структуре модели внутри набора данных
+            models.Index(
+                fields=["model_structure", "data_set"],
+                name="result_structure_dataset_idx",
+            ),
+        ]
+        constraints = [
+            # Естественный ключ результата: повторная загрузка обновляет
+            # значение, а не создаёт дубль (therapy.upsert)
+            models.UniqueConstraint(
+                fields=["data_set", "model_structure"],
+                name="result_dataset_structure_uniq",
+            ),
+        ]
 
     def __str__(self):
         str_look = f"{self.model_structure} Результат: {self.value}, Верхняя граница: {self.upper_value}, Нижняя граница: {self.lower_value}"
         if self.note:
             str_look += f", Доп. информация: {self.note}"
         return str_look
+
+
+# Накопленная статистика результатов по структуре модели и локализации
+class ParameterStatistic(models.Model):
+
+    model_structure = models.ForeignKey(
+        ModelStructure,
+        on_delete=models.CASCADE,
+        verbose_name="Структура модели",
+    )
+    location = models.ForeignKey(
+        Location,
+        on_delete=models.CASCADE,
+        verbose_name="Локализация",
+    )
+    count = models.BigIntegerField(default=0, verbose_name="Количество")
+    sum = models.FloatField(default=0, verbose_name="Сумма")
+    sum_of_squares = models.FloatField(default=0, verbose_name="Сумма квадратов")
+    min_value = models.FloatField(blank=True, null=True, verbose_name="Минимум")
+    max_value = models.FloatField(blank=True, null=True, verbose_name="Максимум")
+    min_result = models.ForeignKey(
+        Result,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name="Результат с минимумом",
+        blank=True,
+        null=True,
+    )
+    max_result = models.ForeignKey(
+        Result,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name="Результат с максимумом",
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        verbose_name = "Статистика параметра"
+        verbose_name_plural = "Статистика параметров"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model_structure", "location"],
+                name="unique_parameter_statistic",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.model_structure}, {self.location}: {self.count}"
+
+
+# Read-модель списка случаев: готовые подписи справочников и счётчики.
+# Поддерживается сигналами (therapy.case_summary), перестраивается
+# командой rebuild_case_summaries
+class ClinicalCaseSummary(models.Model):
+    clinical_case = models.OneToOneField(
+        ClinicalCase,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="summary",
+        verbose_name="Клинический случай",
+    )
+    name_location = models.TextField(blank=True, null=True)
+    name_diagnosis = models.TextField(blank=True, null=True)
+    name_stage = models.TextField(blank=True, null=True)
+    name_risk_group = models.TextField(blank=True, null=True)
+    name_radiation_therapy_type = models.TextField(blank=True, null=True)
+    name_tumor = models.TextField(blank=True, null=True)
+    name_node = models.TextField(blank=True, null=True)
+    name_metastasis = models.TextField(blank=True, null=True)
+    name_histology = models.TextField(blank=True, null=True)
+    name_grade = models.TextField(blank=True, null=True)
+    gender_display = models.TextField(blank=True, null=True)
+    text_location = models.TextField(blank=True, null=True)
+    text_diagnosis = models.TextField(blank=True, null=True)
+    text_stage = models.TextField(blank=True, null=True)
+    text_risk_group = models.TextField(blank=True, null=True)
+    text_radiation_therapy_type = models.TextField(blank=True, null=True)
+    text_tumor = models.TextField(blank=True, null=True)
+    text_node = models.TextField(blank=True, null=True)
+    text_metastasis = models.TextField(blank=True, null=True)
+    text_histology = models.TextField(blank=True, null=True)
+    text_grade = models.TextField(blank=True, null=True)
+    result_count = models.IntegerField(default=0, verbose_name="Количество результатов")
+    complication_count = models.IntegerField(default=0, verbose_name="Количество осложнений")
+
+    class Meta:
+        verbose_name = "Сводка клинического случая"
+        verbose_name_plural = "Сводки клинических случаев"
+
+    def __str__(self):
+        return f"Сводка случая {self.clinical_case_id}"
@@ -0,0 +1,217 @@
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+
+from .dictionaries import DICTIONARY_MODELS, DICTIONARY_RELATED, bump_dictionary_version
+from .models import (
+    Complication,
+    Diagnosis,
+    Grade,
+    Histology,
+    Location,
+    Metastasis,
+    ModelName,
+    ModelStructure,
+    Node,
+    RadiationTherapyType,
+    Result,
+    RiskGroup,
+    SpecLocation,
+    Stage,
+    Tumor,
+    Unit,
+)
+
+
+# Естественные ключи: значение связи можно передать вместо id.
+# Ключ из одного поля передаётся строкой ("C61", "T2", "Gy"), составной —
+# объектом по первым частям путей ({"model_name": "LKB", "parameter": "TD50"})
+NATURAL_KEYS = {
+    Diagnosis: ("code",),
+    Location: ("name",),
+    SpecLocation: ("name",),
+    RadiationTherapyType: ("name",),
+    Stage: ("name",),
+    RiskGroup: ("name",),
+    Histology: ("name",),
+    Grade: ("name",),
+    Tumor: ("short_name",),
+    Node: ("short_name",),
+    Metastasis: ("short_name",),
+    Unit: ("name",),
+    ModelName: ("name",),
+    Complication: ("name",),
+    ModelStructure: ("model_name__name", "parameter__name"),
+}
+
+# Справочники, которые можно дополнять неизвестными значениями
+# (?create_missing=1): кроме ключа у них нет обязательных полей
+AUTO_CREATE_MODELS = (
+    Stage,
+    RiskGroup,
+    Histology,
+    Grade,
+    Tumor,
+    Node,
+    Metastasis,
+    Unit,
+    ModelName,
+    Complication,
+)
+
+# Поля уникального ограничения, по которому строки вставляются или
+# обновляются (therapy.upsert): естественные ключи из одного уникального
+# поля и (набор данных, структура модели) у результатов. Имена Stage
+# и RiskGroup не уникальны, поэтому upsert для них нет
+UPSERT_KEYS = {
+    **{
+        model: lookups
+        for model, lookups in NATURAL_KEYS.items()
+        if len(lookups) == 1 and model._meta.get_field(lookups[0]).unique
+    },
+    Result: ("data_set", "model_structure"),
+}
+
+# Ключ совпал с несколькими строками (у Stage и RiskGroup имя не уникально)
+AMBIGUOUS = object()
+
+
+def natural_key(model, value):
+    """
+    Естественный ключ (кортеж) из значения связи или None, если значение —
+    id. Строка из одних цифр считается id.
+    """
+    lookups = NATURAL_KEYS.get(model)
+    if lookups is None:
+        return None
+    if len(lookups) == 1:
+        if isinstance(value, str) and not value.strip().isdigit():
+            return (value.strip(),)
+        return None
+    if isinstance(value, dict):
+        return tuple(str(value.get(lookup.split("__")[0], "")).strip() for lookup in lookups)
+    return None
+
+
+def natural_key_filter(model, keys):
+    """Q на строки с любым из ключей."""
+    lookups = NATURAL_KEYS[model]
+    if len(lookups) == 1:
+        return Q(**{f"{lookups[0]}__in": [key[0] for key in keys]})
+    return reduce(or_, (Q(**dict(zip(lookups, key))) for key in keys), Q(pk__in=[]))
+
+
+def key_of(model, obj):
+    key = []
+    for lookup in NATURAL_KEYS[model]:
+        value = obj
+        for part in lookup.split("__"):
+            value = getattr(value, part) if value is not None else None
+        key.append(value)
+    return tuple(key)
+
+
+def select_key_related(model, queryset):
+    """Связи, по которым считается составной ключ, загружаются тем же запросом."""
+    related = {lookup.rpartition("__")[0] for lookup in NATURAL_KEYS.get(model, ())}
+    related.discard("")
+    return queryset.select_related(*related) if related else queryset
+
+
+def index_by_key(model, objects):
+    """{ключ: объект} для загруженных объектов; неоднозначные ключи — AMBIGUOUS."""
+    index = {}
+    for obj in objects:
+        key = key_of(model, obj)
+        index[key] = AMBIGUOUS if key in index else obj
+    return index
+
+
+def create_missing_entries(model, keys):
+    """
+    Создаёт одним INSERT недостающие записи справочника с ключами keys
+    и возвращает их {ключ: объект}. Конфликты с параллельной вставкой
+    игнорируются, созданные строки перечитываются.
+    """
+    if model not in AUTO_CREATE_MODELS or not keys:
+        return {}
+    (field,) = NATURAL_KEYS[model]
+    model.objects.bulk_create(
+        [model(**{field: key[0]}) for key in keys], ignore_conflicts=True
+    )
+    if model in DICTIONARY_MODELS:
+        # bulk_create не отправляет сигналы
+        bump_dictionary_version()
+    return index_by_key(model, model.objects.filter(natural_key_filter(model, keys)))
+
+
+class KeyResolver:
+    """
+    Значение связи (id или естественный ключ) -> объект. Справочник
+    читается целиком одним запросом при первом обращении (со связями
+    для __str__), дальше значения разрешаются из памяти. С create_missing
+    неизвестные ключи справочников из AUTO_CREATE_MODELS дописываются.
+    """
+
+    def __init__(self, create_missing=False):
+        self.create_missing = create_missing
+        self._objects = {}
+        self._keys = {}
+        self._resolved = {}
+
+    def _load(self, model):
+        queryset = select_key_related(
+            model, model.objects.select_related(*DICTIONARY_RELATED.get(model, ()))
+        )
+        objects = {obj.pk: obj for obj in queryset}
+        self._objects[model] = objects
+        self._keys[model] = index_by_key(model, objects.values()) if model in NATURAL_KEYS else {}
+
+    def resolve(self, model, value):
+        """Объект для значения; ValueError, если не найден или неоднозначен."""
+        memo = (model, tuple(value.items()) if isinstance(value, dict) else value)
+        if memo not in self._resolved:
+            try:
+                self._resolved[memo] = self._lookup(model, value)
+            except ValueError as error:
+                self._resolved[memo] = error
+        resolved = self._resolved[memo]
+        if isinstance(resolved, ValueError):
+            raise resolved
+        return resolved
+
+    def _lookup(self, model, value):
+        if model not in self._objects:
+            self._load(model)
+        key = natural_key(model, value)
+        if key is None:
+            obj = self._objects[model].get(parse_integer(value))
+            if obj is None:
+                raise ValueError(f'Недопустимый первичный ключ "{value}" - объект не существует.')
+            return obj
+        obj = self._keys[model].get(key)
+        if obj is None and self.create_missing and model in AUTO_CREATE_MODELS:
+            obj = create_missing_entries(model, {key}).get(key)
+            if obj is not None and obj is not AMBIGUOUS:
+                self._keys[model][key] = self._objects[model][obj.pk] = obj
+        if obj is None:
+            raise ValueError(f'Значение "{value}" не найдено.')
+        if obj is AMBIGUOUS:
+            raise ValueError(f'Значению "{value}" соответствует несколько объектов.')
+        return obj
+
+
+def parse_integer(value):
+    """
+    Целое из значения запроса или ячейки таблицы либо None, если это
+    не целое число. Числа из XLSX приходят как float.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
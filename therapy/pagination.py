@@ -0,0 +1,173 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничная выдача по ключу (поле сортировки, id).
+
+    Включается только если в запросе передан page_size или cursor,
+    иначе список отдаётся целиком, как и раньше. Курсор непрозрачный:
+    в нём закодированы сортировка и ключ последней строки страницы,
+    поэтому время выдачи страницы не зависит от её номера.
+    """
+
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    ordering_query_param = "ordering"
+    default_page_size = 100
+    max_page_size = 1000
+    invalid_cursor_message = "Некорректный курсор."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            self.page_size_query_param not in request.query_params
+            and self.cursor_query_param not in request.query_params
+        ):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request, view, queryset.model)
+        if cursor is not None:
+            ordering = cursor["o"]
+        else:
+            ordering = self.get_ordering(request, view)
+        self.ordering = ordering
+
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+
+        if cursor is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(field, descending, cursor["v"], cursor["id"])
+            )
+        queryset = queryset.order_by(*self.get_order_by(field, descending))
+
+        rows = list(queryset[: self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        value = request.query_params.get(self.page_size_query_param)
+        if value is None:
+            return self.default_page_size
+        try:
+            page_size = int(value)
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: "Ожидается целое число."})
+        if page_size <= 0:
+            raise ValidationError(
+                {self.page_size_query_param: "Ожидается положительное число."}
+            )
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, view):
+        allowed = getattr(view, "keyset_ordering_fields", ("id",))
+        ordering = request.query_params.get(self.ordering_query_param, "id")
+        if ordering.lstrip("-") not in allowed:
+            raise ValidationError(
+                {
+                    self.ordering_query_param: "Допустимые поля сортировки: "
+                    + ", ".join(allowed)
+                }
+            )
+        return ordering
+
+    def get_order_by(self, field, descending):
+        if field == "id":
+            return ["-id" if descending else "id"]
+        # NULL всегда в конце, id разрешает равенство значений
+        if descending:
+            return [F(field).desc(nulls_last=True), "id"]
+        return [F(field).asc(nulls_last=True), "id"]
+
+    def get_keyset_filter(self, field, descending, value, pk):
+        if field == "id":
+            return Q(pk__lt=pk) if descending else Q(pk__gt=pk)
+        if value is None:
+            return Q(**{f"{field}__isnull": True}, pk__gt=pk)
+        lookup = "lt" if descending else "gt"
+        return (
+            Q(**{f"{field}__{lookup}": value})
+            | Q(**{field: value}, pk__gt=pk)
+            | Q(**{f"{field}__isnull": True})
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        field = self.ordering.lstrip("-")
+        cursor = self.encode_cursor(
+            {"o": self.ordering, "v": getattr(last, field), "id": last.pk}
+        )
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def encode_cursor(self, cursor):
+        raw = json.dumps(cursor, separators=(",", ":")).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+    def decode_cursor(self, request, view, model=None):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padding = "=" * (-len(encoded) % 4)
+            cursor = json.loads(base64.urlsafe_b64decode(encoded + padding))
+        except (binascii.Error, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        allowed = getattr(view, "keyset_ordering_fields", ("id",))
+        if (
+            not isinstance(cursor, dict)
+            or set(cursor) != {"o", "v", "id"}
+            or not isinstance(cursor["id"], int)
+            or not isinstance(cursor["o"], str)
+            or cursor["o"].lstrip("-") not in allowed
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        if model is not None:
+            # Значения из курсора попадают в запрос: тип и диапазон должны
+            # подходить полю, иначе ошибка базы вместо 404
+            self.check_cursor_value(model._meta.pk, cursor["id"])
+            if cursor["v"] is not None:
+                self.check_cursor_value(
+                    model._meta.get_field(cursor["o"].lstrip("-")), cursor["v"]
+                )
+        return cursor
+
+    def check_cursor_value(self, field, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            converted = field.to_python(value)
+            field.run_validators(converted)
+        except DjangoValidationError:
+            raise NotFound(self.invalid_cursor_message)
+        if converted != value:
+            raise NotFound(self.invalid_cursor_message)
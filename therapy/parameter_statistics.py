@@ -0,0 +1,242 @@
+import math
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+
+from .models import DataSet, ParameterStatistic, Result
+
+
+# Путь от результата к локализации клинического случая
+LOCATION_LOOKUP = "data_set__clinical_case__spec_location__location"
+
+COMPARED_FIELDS = ("count", "sum", "sum_of_squares", "min_value", "max_value")
+
+
+def result_location(data_set_id):
+    """Локализация случая, к которому относится набор данных, или None."""
+    if data_set_id is None:
+        return None
+    return (
+        DataSet.objects.filter(pk=data_set_id)
+        .values_list("clinical_case__spec_location__location", flat=True)
+        .first()
+    )
+
+
+def _extreme_ids(results, descending):
+    value_order = "-value" if descending else "value"
+    rows = (
+        results.order_by("model_structure_id", LOCATION_LOOKUP, value_order, "id")
+        .distinct("model_structure_id", LOCATION_LOOKUP)
+        .values_list("model_structure_id", LOCATION_LOOKUP, "id")
+    )
+    return {(ms_id, location_id): pk for ms_id, location_id, pk in rows}
+
+
+def compute_statistics(results=None):
+    """
+    Считает статистику по (структура модели, локализация) из исходных
+    результатов. Возвращает несохранённые объекты ParameterStatistic.
+    """
+    if results is None:
+        results = Result.objects.all()
+    results = results.filter(value__isnull=False, data_set__clinical_case__isnull=False)
+
+    groups = (
+        results.values("model_structure_id", LOCATION_LOOKUP)
+        .annotate(
+            count=Count("id"),
+            sum=Sum("value"),
+            sum_of_squares=Sum(F("value") * F("value")),
+            min_value=Min("value"),
+            max_value=Max("value"),
+        )
+        .order_by()
+    )
+    minimums = _extreme_ids(results, descending=False)
+    maximums = _extreme_ids(results, descending=True)
+
+    statistics = []
+    for group in groups:
+        key = (group["model_structure_id"], group[LOCATION_LOOKUP])
+        statistics.append(ParameterStatistic(
+            model_structure_id=key[0],
+            location_id=key[1],
+            count=group["count"],
+            sum=group["sum"],
+            sum_of_squares=group["sum_of_squares"],
+            min_value=group["min_value"],
+            max_value=group["max_value"],
+            min_result_id=minimums[key],
+            max_result_id=maximums[key],
+        ))
+    return statistics
+
+
+def refresh_statistics(groups):
+    """Пересчитывает из исходных данных указанные группы (ms_id, location_id)."""
+    groups = {group for group in groups if None not in group}
+    if not groups:
+        return
+    model_structure_ids = {ms_id for ms_id, _ in groups}
+    location_ids = {location_id for _, location_id in groups}
+    group_filter = Q()
+    for ms_id, location_id in groups:
+        group_filter |= Q(model_structure_id=ms_id, location_id=location_id)
+
+    with transaction.atomic():
+        ParameterStatistic.objects.filter(group_filter).delete()
+        statistics = compute_statistics(
+            Result.objects.filter(
+                model_structure_id__in=model_structure_ids,
+                **{f"{LOCATION_LOOKUP}__in": location_ids},
+            )
+        )
+        ParameterStatistic.objects.bulk_create(
+            stat
+            for stat in statistics
+            if (stat.model_structure_id, stat.location_id) in groups
+        )
+
+
+def merge_statistics(results):
+    """
+    Добавляет в накопленную статистику новые, ещё не учтённые результаты
+    (queryset Result): один GROUP BY по ним и один INSERT ... ON CONFLICT
+    DO UPDATE. Существующие группы не пересчитываются из исходных данных.
+    """
+    results = results.filter(value__isnull=False, **{f"{LOCATION_LOOKUP}__isnull": False})
+    try:
+        sql, params = (
+            results.order_by()
+            .values_list("id", "model_structure_id", LOCATION_LOOKUP, "value")
+            .query.sql_with_params()
+        )
+    except EmptyResultSet:
+        return
+    table = ParameterStatistic._meta.db_table
+    # min(ARRAY[значение, id]) за один проход даёт минимум и id результата
+    # с ним (при равенстве — меньший id); для максимума id берётся со знаком
+    # минус, чтобы при равенстве тоже победил меньший
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} AS s (
+                model_structure_id, location_id, count, sum, sum_of_squares,
+                min_value, max_value, min_result_id, max_result_id
+            )
+            SELECT model_structure_id, location_id, count, sum, sum_of_squares,
+                lowest[1], highest[1], lowest[2]::bigint, (-highest[2])::bigint
+            FROM (
+                SELECT model_structure_id, location_id, count(*) AS count,
+                    sum(value) AS sum, sum(value * value) AS sum_of_squares,
+                    min(ARRAY[value, id::float8]) AS lowest,
+                    max(ARRAY[value, -id::float8]) AS highest
+                FROM ({sql}) AS rows (id, model_structure_id, location_id, value)
+                GROUP BY model_structure_id, location_id
+            ) AS groups
+            ON CONFLICT (model_structure_id, location_id) DO UPDATE SET
+                count = s.count + EXCLUDED.count,
+                sum = s.sum + EXCLUDED.sum,
+                sum_of_squares = s.sum_of_squares + EXCLUDED.sum_of_squares,
+                min_value = LEAST(s.min_value, EXCLUDED.min_value),
+                min_result_id = CASE
+                    WHEN s.min_value IS NULL OR EXCLUDED.min_value < s.min_value
+                    THEN EXCLUDED.min_result_id ELSE s.min_result_id END,
+                max_value = GREATEST(s.max_value, EXCLUDED.max_value),
+                max_result_id = CASE
+                    WHEN s.max_value IS NULL OR EXCLUDED.max_value > s.max_value
+                    THEN EXCLUDED.max_result_id ELSE s.max_result_id END
+            """,
+            params,
+        )
+
+
+def rebuild_statistics():
+    """Полностью перестраивает таблицу статистики."""
+    with transaction.atomic():
+        ParameterStatistic.objects.all().delete()
+        ParameterStatistic.objects.bulk_create(compute_statistics(), batch_size=1000)
+
+
+def _differs(expected, actual):
+    if expected is None or actual is None:
+        return expected != actual
+    return not math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-9)
+
+
+def check_statistics():
+    """
+    Сравнивает таблицу с пересчётом из исходных данных.
+    Возвращает список расхождений (группа, поле, ожидалось, в таблице).
+    """
+    expected = {
+        (stat.model_structure_id, stat.location_id): stat
+        for stat in compute_statistics()
+    }
+    actual = {
+        (stat.model_structure_id, stat.location_id): stat
+        for stat in ParameterStatistic.objects.all()
+    }
+    drift = []
+    for key in expected.keys() | actual.keys():
+        for field in COMPARED_FIELDS:
+            expected_value = getattr(expected[key], field) if key in expected else None
+            actual_value = getattr(actual[key], field) if key in actual else None
+            if _differs(expected_value, actual_value):
+                drift.append((key, field, expected_value, actual_value))
+    return drift
+
+
+def add_result(model_structure_id, location_id, value, result_id):
+    """Учитывает новый результат в накопленной статистике."""
+    if location_id is None or value is None:
+        return
+    with transaction.atomic():
+        statistic, _ = ParameterStatistic.objects.get_or_create(
+            model_structure_id=model_structure_id, location_id=location_id
+        )
+        group = ParameterStatistic.objects.filter(pk=statistic.pk)
+        group.update(
+            count=F("count") + 1,
+            sum=F("sum") + value,
+            sum_of_squares=F("sum_of_squares") + value * value,
+        )
+        group.filter(Q(min_value__isnull=True) | Q(min_value__gt=value)).update(
+            min_value=value, min_result_id=result_id
+        )
+        group.filter(Q(max_value__isnull=True) | Q(max_value__lt=value)).update(
+            max_value=value, max_result_id=result_id
+        )
+
+
+def remove_result(model_structure_id, location_id, value, result_id):
+    """Исключает удалённый результат из накопленной статистики."""
+    if location_id is None or value is None:
+        return
+    group = ParameterStatistic.objects.filter(
+        model_structure_id=model_structure_id, location_id=location_id
+    )
+    statistic = group.first()
+    if statistic is None:
+        return
+    # Минимум и максимум нельзя «вычесть», такую группу пересчитываем
+    if statistic.count <= 1 or value in (statistic.min_value, statistic.max_value):
+        refresh_statistics({(model_structure_id, location_id)})
+        return
+    group.update(
+        count=F("count") - 1,
+        sum=F("sum") - value,
+        sum_of_squares=F("sum_of_squares") - value * value,
+    )
+
+
+def result_groups(results):
+    """Группы (ms_id, location_id), в которые входят результаты."""
+    return {
+        (ms_id, location_id)
+        for ms_id, location_id in results.values_list(
+            "model_structure_id", LOCATION_LOOKUP
+        ).distinct()
+    }
@@ -0,0 +1,81 @@
+import json
+
+from .aggregation import cohort_results, group_aggregates
+from .filters import filter_clinical_cases
+from .models import ClinicalCase, ModelStructure, Result
+
+
+def _sample_case():
+    return (
+        ClinicalCase.objects.exclude(spec_location=None)
+        .order_by("id")
+        .values("id", "spec_location", "spec_location__location", "radiation_therapy_type", "stage")
+        .first()
+    )
+
+
+def representative_queries():
+    """
+    Каталог запросов, повторяющих формы запросов API. Значения фильтров
+    берутся из первого клинического случая, чтобы запросы не были пустыми.
+    Возвращает {название: QuerySet}.
+    """
+    case = _sample_case()
+    structure = ModelStructure.objects.order_by("id").values("id", "model_name", "parameter").first()
+    if case is None or structure is None:
+        return {}
+
+    location_cases = filter_clinical_cases(
+        ClinicalCase.objects.all(), {"location": case["spec_location__location"]}
+    )
+    return {
+        # Список случаев: локализация + тип лучевой терапии + стадия
+        "case_list_filter": filter_clinical_cases(
+            ClinicalCase.objects.all(),
+            {
+                "spec_location": case["spec_location"],
+                "radiation_therapy_type": case["radiation_therapy_type"],
+                "stage": case["stage"],
+            },
+        ).order_by("id"),
+        # Список случаев: EXISTS по модели и параметру результата
+        "case_relation_filter": filter_clinical_cases(
+            ClinicalCase.objects.all(),
+            {"model_name": structure["model_name"], "parameter": structure["parameter"]},
+        ).order_by("id"),
+        # Агрегация по когорте локализации
+        "aggregate_groups": group_aggregates(cohort_results(location_cases.values("id"))),
+        # Результаты набора данных (ResultViewSet с фильтром data_set)
+        "results_by_dataset": Result.objects.select_related(
+            "model_structure__parameter__unit", "model_structure__model_name", "data_set__source"
+        ).filter(data_set__clinical_case=case["id"]),
+        # Поиск структуры модели по модели и параметру
+        "model_structure_lookup": ModelStructure.objects.filter(
+            model_name=structure["model_name"], parameter=structure["parameter"]
+        ),
+    }
+
+
+def _plan_indexes(plan):
+    indexes = set()
+    if "Index Name" in plan:
+        indexes.add(plan["Index Name"])
+    for child in plan.get("Plans", ()):
+        indexes |= _plan_indexes(child)
+    return indexes
+
+
+def explain_query(queryset):
+    """
+    EXPLAIN ANALYZE запроса. Возвращает время планирования и выполнения (мс),
+    оценку стоимости, использованные индексы и план в формате JSON.
+    """
+    explained = json.loads(queryset.explain(analyze=True, buffers=True, format="json"))[0]
+    plan = explained["Plan"]
+    return {
+        "planning_time": explained["Planning Time"],
+        "execution_time": explained["Execution Time"],
+        "total_cost": plan["Total Cost"],
+        "indexes": sorted(_plan_indexes(plan)),
+        "plan": explained,
+    }
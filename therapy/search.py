@@ -0,0 +1,66 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from rest_framework import filters
+from rest_framework.settings import api_settings
+
+
+# Конфигурации, которыми построены векторы (см. миграцию 0017_full_text_search)
+SEARCH_CONFIGS = ("russian", "english", "simple")
+
+
+def _split_prefix(terms):
+    """
+    Отделяет последнее слово запроса для поиска по префиксу (ввод ещё
+    не закончен). Фразы в кавычках, исключения (-слово) и OR остаются
+    точными. Возвращает (остаток запроса, части слова или []).
+    """
+    head, _, last = terms.rpartition(" ")
+    if terms.count('"') % 2 or last.startswith(("-", '"')) or last.endswith('"'):
+        return terms, []
+    if "or" in (last.lower(), head.rpartition(" ")[2].lower()):
+        return terms, []
+    # В синтаксис to_tsquery попадают только буквы и цифры
+    return head.strip(), re.findall(r"[^\W_]+", last)
+
+
+def search_query(terms):
+    """
+    Запрос в синтаксисе websearch со стеммингом для русского и
+    английского; последнее слово ищется и как префикс (term:*).
+    """
+    head, prefix_words = _split_prefix(terms)
+    prefix = " & ".join(f"{word}:*" for word in prefix_words)
+    query = None
+    for config in SEARCH_CONFIGS:
+        part = None
+        if head:
+            part = SearchQuery(head, config=config, search_type="websearch")
+        if prefix:
+            prefix_part = SearchQuery(prefix, config=config, search_type="raw")
+            part = prefix_part if part is None else part & prefix_part
+        if part is None:
+            part = SearchQuery(terms, config=config, search_type="websearch")
+        query = part if query is None else query | part
+    return query
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    ?search= по полю search_vector (tsvector с GIN-индексом) вместо ILIKE.
+    Результаты упорядочены по релевантности, если не задан ?ordering=;
+    поэтому бэкенд должен стоять после OrderingFilter.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = request.query_params.get(self.search_param, "").strip()
+        if not terms:
+            return queryset
+        query = search_query(terms)
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F("search_vector"), query)
+        )
+        if api_settings.ORDERING_PARAM not in request.query_params:
+            queryset = queryset.order_by("-search_rank", *queryset.query.order_by, "pk")
+        return queryset
@@ -1,4 +1,29 @@
+from collections import defaultdict
+
+from django.db.models import (
+    Count,
+    F,
+    IntegerField,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Value,
+    prefetch_related_objects,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.manager import BaseManager
+from django.utils.functional import cached_property
 from rest_framework import serializers
+from .dictionaries import DICTIONARY_RELATED, attach_dictionaries, dictionary_version
+from .natural_keys import (
+    AMBIGUOUS,
+    create_missing_entries,
+    index_by_key,
+    natural_key,
+    natural_key_filter,
+    select_key_related,
+)
 from .models import (
     RadiationTherapyType,
     Location,
@@ -24,7 +49,116 @@ from .models import (
 )
 
 
-    
+def context_dictionary_version(context):
+    """
+    Версия справочников, прочитанная из общего кэша один раз на ответ:
+    context корневого сериализатора общий для вложенных и для строк
+    списка, поэтому версия хранится в нём под "dictionary_version".
+    """
+    if "dictionary_version" not in context:
+        context["dictionary_version"] = dictionary_version()
+    return context["dictionary_version"]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField, который принимает id или естественный ключ
+    справочника (therapy.natural_keys). При проверке списка объекты
+    берутся из context["related_objects"] (см. load_related_objects),
+    а не запрашиваются на каждое значение.
+    """
+
+    default_error_messages = {
+        "ambiguous": 'Значению "{value}" соответствует несколько объектов.',
+    }
+
+    def to_internal_value(self, data):
+        model = self.queryset.model
+        key = natural_key(model, data)
+        objects = self.context.get("related_objects", {}).get(model)
+        if objects is None:
+            if key is None:
+                return super().to_internal_value(data)
+            queryset = select_key_related(model, self.get_queryset())
+            objects = index_by_key(model, queryset.filter(natural_key_filter(model, [key]))[:2])
+        if key is None:
+            key = _as_pk(data)
+            if key is None:
+                self.fail("incorrect_type", data_type=type(data).__name__)
+        obj = objects.get(key)
+        if obj is None:
+            self.fail("does_not_exist", pk_value=data)
+        if obj is AMBIGUOUS:
+            self.fail("ambiguous", value=data)
+        return obj
+
+
+def _as_pk(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _collect_related_values(serializer, items, ids, keys, querysets):
+    for name, field in serializer.fields.items():
+        if field.read_only:
+            continue
+        values = [item[name] for item in items if isinstance(item, dict) and name in item]
+        if isinstance(field, serializers.ManyRelatedField):
+            field = field.child_relation
+            values = [value for many in values if isinstance(many, list) for value in many]
+        if isinstance(field, BulkPrimaryKeyRelatedField):
+            model = field.queryset.model
+            querysets.setdefault(model, field.queryset)
+            for value in values:
+                key = natural_key(model, value)
+                if key is not None:
+                    keys[model].add(key)
+                elif _as_pk(value) is not None:
+                    ids[model].add(_as_pk(value))
+        elif isinstance(field, serializers.ListSerializer):
+            nested = [value for many in values if isinstance(many, list) for value in many]
+            _collect_related_values(field.child, nested, ids, keys, querysets)
+
+
+def load_related_objects(serializer_class, items, create_missing=False):
+    """
+    Объекты, на которые ссылаются элементы списка (включая вложенные
+    сериализаторы), по id и по естественным ключам: один запрос на модель,
+    результат — {модель: {id или ключ: объект}}. Связи, нужные для __str__
+    справочника, загружаются тем же запросом. create_missing создаёт
+    неизвестные записи справочников из AUTO_CREATE_MODELS.
+    """
+    ids = defaultdict(set)
+    keys = defaultdict(set)
+    querysets = {}
+    if isinstance(items, list):
+        _collect_related_values(serializer_class(), items, ids, keys, querysets)
+
+    related_objects = {}
+    for model, queryset in querysets.items():
+        if not ids[model] and not keys[model]:
+            continue
+        queryset = select_key_related(
+            model, queryset.select_related(*DICTIONARY_RELATED.get(model, ()))
+        )
+        condition = Q(pk__in=ids[model])
+        if keys[model]:
+            condition |= natural_key_filter(model, keys[model])
+        objects = list(queryset.filter(condition))
+        found = {obj.pk: obj for obj in objects}
+        if keys[model]:
+            by_key = index_by_key(model, objects)
+            found.update(by_key)
+            if create_missing:
+                found.update(create_missing_entries(model, keys[model] - by_key.keys()))
+        related_objects[model] = found
+    return related_objects
+
+
 class RadiationTherapyTypeSerializer(serializers.ModelSerializer):
     class Meta:
         model = RadiationTherapyType
@@ -37,12 +171,17 @@ class LocationSerializer(serializers.ModelSerializer):
 
 
 class SpecLocationSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
     name_location = serializers.SerializerMethodField()
 
     class Meta:
         model = SpecLocation
         fields = ("id", "name", "location", "note","name_location")
     
+    def to_representation(self, instance):
+        attach_dictionaries([instance], version=context_dictionary_version(self.context))
+        return super().to_representation(instance)
+
     def get_name_location(self, obj):
         location = obj.location
         result = f"{obj.location.name}"
@@ -67,6 +206,7 @@ class RiskGroupSerializer(serializers.ModelSerializer):
 
 
 class ComplicationSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
     
     name_location = serializers.SerializerMethodField()
 
@@ -74,6 +214,10 @@ class ComplicationSerializer(serializers.ModelSerializer):
         model = Complication
         fields = ("id", "name", "alt_name", "spec_location", "name_location", "note")
 
+    def to_representation(self, instance):
+        attach_dictionaries([instance], version=context_dictionary_version(self.context))
+        return super().to_representation(instance)
+
     def get_name_location(self, obj):
         location = obj.spec_location
         result = f"{obj.spec_location.name}"
@@ -118,12 +262,17 @@ class UnitSerializer(serializers.ModelSerializer):
 
 
 class ParameterSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
     name_unit = serializers.SerializerMethodField()
 
     class Meta:
         model = Parameter
         fields = ("id", "name", "full_name", "unit", "note","name_unit")
 
+    def to_representation(self, instance):
+        attach_dictionaries([instance], version=context_dictionary_version(self.context))
+        return super().to_representation(instance)
+
     def get_name_unit(self, obj):
         unit = obj.unit
         if unit is not None: 
@@ -141,12 +290,17 @@ class ModelNameSerializer(serializers.ModelSerializer):
 
 
 class ModelStructureSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
     name_model_name= serializers.SerializerMethodField()
     name_parameter= serializers.SerializerMethodField()
     name_unit= serializers.SerializerMethodField()
     class Meta:
         model = ModelStructure
         fields = ("id", "model_name", "parameter", "note","name_model_name","name_parameter","name_unit")
+
+    def to_representation(self, instance):
+        attach_dictionaries([instance.parameter], version=context_dictionary_version(self.context))
+        return super().to_representation(instance)
     
     def get_name_model_name(self, obj):
             model_name = obj.model_name
@@ -168,6 +322,7 @@ class ModelStructureSerializer(serializers.ModelSerializer):
         return result
 
 class ResultSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
     name_model_structure= serializers.SerializerMethodField()
     name_parameter = serializers.SerializerMethodField()
     name_unit = serializers.SerializerMethodField()
@@ -178,6 +333,13 @@ class ResultSerializer(serializers.ModelSerializer):
                   "lower_value", "note","name_model_structure",
                   "name_parameter","name_unit","data_set","name_data_set",)
 
+    def to_representation(self, instance):
+        attach_dictionaries(
+            [instance.model_structure.parameter],
+            version=context_dictionary_version(self.context),
+        )
+        return super().to_representation(instance)
+
     def get_name_data_set(self, obj):
         if obj.data_set and obj.data_set.source:
             return f"{obj.data_set.source.name}"
@@ -225,7 +387,7 @@ class DataSetSerializer(serializers.ModelSerializer):
         fields = ("id",  "clinical_case","name_clinical_case", "source", "note","name_source","url_source",)
         
     def get_name_clinical_case(self, obj):
-            clinical_case = obj.clinical_case
+            # Готовый текст случая (ClinicalCase.rendered_text)
             result = f"{obj.clinical_case}"
             return result
     
@@ -237,6 +399,7 @@ class DataSetSerializer(serializers.ModelSerializer):
 
 
 class ClinicalCaseComplicationSerializer (serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
     name_complication = serializers.SerializerMethodField()
     
 
@@ -251,41 +414,121 @@ class ClinicalCaseComplicationSerializer (serializers.ModelSerializer):
 
 
 
+
+# Поля случая, которые хранятся готовыми в ClinicalCaseSummary
+SUMMARY_FIELDS = (
+    "name_location",
+    "name_diagnosis",
+    "name_stage",
+    "name_risk_group",
+    "name_radiation_therapy_type",
+    "name_tumor",
+    "name_node",
+    "name_metastasis",
+    "name_histology",
+    "name_grade",
+    "gender_display",
+    "text_location",
+    "text_diagnosis",
+    "text_stage",
+    "text_risk_group",
+    "text_radiation_therapy_type",
+    "text_tumor",
+    "text_node",
+    "text_metastasis",
+    "text_histology",
+    "text_grade",
+)
+
+
+def _case_count(queryset, case_lookup, case_ref):
+    counts = (
+        queryset.filter(**{case_lookup: case_ref})
+        .order_by()
+        .values(case_lookup)
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def case_counts(case_ref):
+    """Подзапросы счётчиков результатов и осложнений случая case_ref."""
+    return {
+        "result_count": _case_count(Result.objects.all(), "data_set__clinical_case", case_ref),
+        "complication_count": _case_count(
+            ClinicalCaseComplication.objects.all(), "clinical_case", case_ref
+        ),
+    }
+
+
+def cached_summary(case):
+    """Сводка, загруженная вместе со случаем (select_related), или None."""
+    return ClinicalCase.summary.related.get_cached_value(case, default=None)
+
+
+class SummaryField(serializers.SerializerMethodField):
+    """
+    Значение из сводки случая; если сводка не загружена или ещё
+    не построена, поле вычисляется методом get_<поле>.
+    """
+
+    def to_representation(self, value):
+        summary = cached_summary(value)
+        if summary is not None:
+            return getattr(summary, self.field_name)
+        return super().to_representation(value)
+
+
+class ClinicalCaseListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        instances = list(data.all() if isinstance(data, BaseManager) else data)
+        self.child.prepare_instances(instances)
+        return super().to_representation(instances)
+
            
 class ClinicalCaseSerializer(serializers.ModelSerializer):
-    name_location = serializers.SerializerMethodField()
-    name_diagnosis = serializers.SerializerMethodField()
+    # При проверке списка связи берутся из context["related_objects"]
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
+    name_location = SummaryField()
+    name_diagnosis = SummaryField()
     datasets_result = serializers.SerializerMethodField()
     complications = serializers.SerializerMethodField()
    
-    name_stage = serializers.SerializerMethodField()
-    name_risk_group = serializers.SerializerMethodField()
-    name_radiation_therapy_type = serializers.SerializerMethodField()
-    name_tumor = serializers.SerializerMethodField()
-    name_node = serializers.SerializerMethodField()
-    name_metastasis = serializers.SerializerMethodField()
-    name_histology = serializers.SerializerMethodField()
-    name_grade = serializers.SerializerMethodField()
+    name_stage = SummaryField()
+    name_risk_group = SummaryField()
+    name_radiation_therapy_type = SummaryField()
+    name_tumor = SummaryField()
+    name_node = SummaryField()
+    name_metastasis = SummaryField()
+    name_histology = SummaryField()
+    name_grade = SummaryField()
     datasets_source_name = serializers.SerializerMethodField()
     datasets_source_url = serializers.SerializerMethodField()
-    gender_display = serializers.SerializerMethodField()
-    clinical_case_text= serializers.SerializerMethodField()
+    gender_display = SummaryField()
+    # Текст хранится в самом случае (rendered_text), а не в сводке
+    clinical_case_text = serializers.SerializerMethodField()
     
-    text_location = serializers.SerializerMethodField()
-    text_diagnosis = serializers.SerializerMethodField()
+    text_location = SummaryField()
+    text_diagnosis = SummaryField()
     
-    text_stage = serializers.SerializerMethodField()
-    text_risk_group = serializers.SerializerMethodField()
-    text_radiation_therapy_type = serializers.SerializerMethodField()
-    text_tumor = serializers.SerializerMethodField()
-    text_node = serializers.SerializerMethodField()
-    text_metastasis = serializers.SerializerMethodField()
-    text_histology = serializers.SerializerMethodField()
-    text_grade = serializers.SerializerMethodField()
+    text_stage = SummaryField()
+    text_risk_group = SummaryField()
+    text_radiation_therapy_type = SummaryField()
+    text_tumor = SummaryField()
+    text_node = SummaryField()
+    text_metastasis = SummaryField()
+    text_histology = SummaryField()
+    text_grade = SummaryField()
+    result_count = SummaryField()
+    complication_count = SummaryField()
     
     
     class Meta:
         model = ClinicalCase
+        list_serializer_class = ClinicalCaseListSerializer
         fields = (
             "id", "age", "age_min","age_max","quantity","gender","diagnosis", "refined_diagnosis", "spec_location",
             "stage", "risk_group", "radiation_therapy_type",
@@ -295,21 +538,223 @@ class ClinicalCaseSerializer(serializers.ModelSerializer):
             "name_stage", "name_risk_group", "name_radiation_therapy_type", 
             "name_tumor", "name_node", "name_metastasis", "name_histology", 
             "name_grade", "gender_display","clinical_case_text","text_location", "text_diagnosis",  "text_stage", "text_risk_group", "text_radiation_therapy_type", "text_tumor", "text_node", "text_metastasis", "text_histology", "text_grade"
-            ,"datasets_source_name","datasets_source_url","datasets_result","complications"
+            ,"datasets_source_name","datasets_source_url","datasets_result","complications",
+            "result_count", "complication_count"
+            )
+
+    # Поля, которые требуют загрузки связанных наборов данных (?expand=)
+    expandable_fields = (
+        "datasets_source_name",
+        "datasets_source_url",
+        "datasets_result",
+        "complications",
+    )
+
+    # Связи (select_related), нужные для вычисления поля. Подписи
+    # и счётчики читаются из готовой сводки случая
+    related_fields = {
+        name: ("summary",) for name in (*SUMMARY_FIELDS, "result_count", "complication_count")
+    }
+
+    # Справочники, нужные для вычисления поля, если сводки ещё нет
+    dictionary_fields = {
+        "name_location": ("spec_location",),
+        "text_location": ("spec_location",),
+        "name_diagnosis": ("diagnosis",),
+        "text_diagnosis": ("diagnosis",),
+        "name_stage": ("stage",),
+        "text_stage": ("stage",),
+        "name_risk_group": ("risk_group",),
+        "text_risk_group": ("risk_group",),
+        "name_radiation_therapy_type": ("radiation_therapy_type",),
+        "text_radiation_therapy_type": ("radiation_therapy_type",),
+        "name_tumor": ("tumor",),
+        "text_tumor": ("tumor",),
+        "name_node": ("node",),
+        "text_node": ("node",),
+        "name_metastasis": ("metastasis",),
+        "text_metastasis": ("metastasis",),
+        "name_histology": ("histology",),
+        "text_histology": ("histology",),
+        "name_grade": ("grade",),
+        "text_grade": ("grade",),
+        "clinical_case_text": (
+            "diagnosis",
+            "spec_location",
+            "stage",
+            "risk_group",
+            "radiation_therapy_type",
+            "tumor",
+            "node",
+            "metastasis",
+            "histology",
+            "grade",
+        ),
+    }
+
+    # Наборы (prefetch_related), нужные для вычисления поля
+    prefetch_fields = {
+        "datasets_source_name": ("dataset_set",),
+        "datasets_source_url": ("dataset_set",),
+        "datasets_result": ("dataset_set", "dataset_set__result_set"),
+        "complications": ("clinicalcasecomplication_set",),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.get_requested_fields(self.context.get("request"))
+        if requested is not None:
+            for field_name in set(self.fields) - requested:
+                self.fields.pop(field_name)
+
+    @classmethod
+    def get_requested_fields(cls, request):
+        """
+        Набор полей из ?fields= и ?expand= или None, если нужны все поля.
+
+        fields ограничивает обычные поля, expand перечисляет, какие из
+        expandable_fields загружать. Без обоих параметров ответ полный.
+        """
+        if request is None or request.method != "GET":
+            return None
+        fields_param = request.query_params.get("fields")
+        expand_param = request.query_params.get("expand")
+        if fields_param is None and expand_param is None:
+            return None
+
+        all_fields = set(cls.Meta.fields)
+        expandable = set(cls.expandable_fields)
+        fields = {name.strip() for name in (fields_param or "").split(",") if name.strip()}
+        expand = {name.strip() for name in (expand_param or "").split(",") if name.strip()}
+
+        errors = {}
+        if fields - all_fields:
+            errors["fields"] = "Неизвестные поля: " + ", ".join(sorted(fields - all_fields))
+        if expand - expandable:
+            errors["expand"] = "Неизвестные связи: " + ", ".join(sorted(expand - expandable))
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        if fields_param is None:
+            fields = all_fields - expandable
+        return fields | expand | {"id"}
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None):
+        # Связанные данные загружаются фиксированным числом запросов
+        # и только для запрошенных полей
+        if fields is None:
+            fields = cls.Meta.fields
+
+        select_related = []
+        prefetch_lookups = []
+        for field_name in fields:
+            for lookup in cls.related_fields.get(field_name, ()):
+                if lookup not in select_related:
+                    select_related.append(lookup)
+            for lookup in cls.prefetch_fields.get(field_name, ()):
+                if lookup not in prefetch_lookups:
+                    prefetch_lookups.append(lookup)
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        # Счётчики случаев без сводки. COALESCE не вычисляет подзапрос,
+        # если значение есть в сводке
+        counts = case_counts(OuterRef("pk"))
+        queryset = queryset.annotate(**{
+            f"counted_{name}": Coalesce(F(f"summary__{name}"), counts[name])
+            for name in counts
+            if name in fields
+        })
+        # Порядок важен: вложенный prefetch идёт после родительского
+        prefetches = {
+            "dataset_set": lambda: Prefetch(
+                "dataset_set",
+                queryset=DataSet.objects.select_related("source").order_by("id"),
+            ),
+            "dataset_set__result_set": lambda: Prefetch(
+                "dataset_set__result_set",
+                queryset=Result.objects.select_related(
+                    "model_structure__parameter",
+                    "model_structure__model_name",
+                ).order_by("id"),
+            ),
+            "clinicalcasecomplication_set": lambda: Prefetch(
+                "clinicalcasecomplication_set",
+                queryset=ClinicalCaseComplication.objects.select_related(
+                    "complication"
+                ).order_by("id"),
+            ),
+        }
+        return queryset.prefetch_related(
+            *(make() for lookup, make in prefetches.items() if lookup in prefetch_lookups)
+        )
+
+    @cached_property
+    def requested_dictionaries(self):
+        return {
+            lookup
+            for field_name in self.fields
+            for lookup in self.dictionary_fields.get(field_name, ())
+        }
+
+    def prepare_instances(self, instances):
+        """
+        Справочники для случаев без сводки: из памяти процесса, диагнозы
+        (их нет в кэше справочников) — одним запросом на все случаи.
+        """
+        missing = [obj for obj in instances if self._needs_dictionaries(obj)]
+        if not missing:
+            return
+        attach_dictionaries(
+            missing, self.requested_dictionaries, context_dictionary_version(self.context)
+        )
+        if "diagnosis" in self.requested_dictionaries:
+            prefetch_related_objects(missing, "diagnosis")
+
+    def _needs_dictionaries(self, obj):
+        # Текст случая собирается из справочников, только если он ещё
+        # не сохранён в rendered_text
+        return cached_summary(obj) is None or (
+            obj.rendered_text is None and "clinical_case_text" in self.fields
+        )
+
+    def to_representation(self, instance):
+        if self._needs_dictionaries(instance):
+            attach_dictionaries(
+                [instance], self.requested_dictionaries, context_dictionary_version(self.context)
             )
+        return super().to_representation(instance)
+
+    def get_result_count(self, obj):
+        count = getattr(obj, "counted_result_count", None)
+        if count is not None:
+            return count
+        return Result.objects.filter(data_set__clinical_case=obj).count()
+
+    def get_complication_count(self, obj):
+        count = getattr(obj, "counted_complication_count", None)
+        if count is not None:
+            return count
+        return obj.clinicalcasecomplication_set.count()
 
     def get_complications(self, obj):
-        complications = ClinicalCaseComplication.objects.filter(clinical_case=obj).select_related("complication")
-        return ClinicalCaseComplicationSerializer(complications, many=True).data
+        complications = obj.clinicalcasecomplication_set.all()
+        return ClinicalCaseComplicationSerializer(
+            complications, many=True, context=self.context
+        ).data
     
     
     def get_datasets_result(self, obj):
-        all_results = Result.objects.filter(data_set__clinical_case=obj).select_related(
-            "model_structure__parameter__unit",
-            "model_structure__model_name",
-            "data_set__source"
+        all_results = sorted(
+            (
+                result
+                for dataset in obj.dataset_set.all()
+                for result in dataset.result_set.all()
+            ),
+            key=lambda result: result.id,
         )
-        return ResultSerializer(all_results, many=True).data
+        return ResultSerializer(all_results, many=True, context=self.context).data
     
     def get_name_location(self, obj):
         return obj.spec_location.name if obj.spec_location else None
@@ -392,4 +837,57 @@ class ClinicalCaseSerializer(serializers.ModelSerializer):
         ]
 
 
- 
\ No newline at end of file
+ 
+
+
+# Вложенная загрузка случаев (ClinicalCaseViewSet.ingest)
+
+class IngestResultSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+
+    class Meta:
+        model = Result
+        fields = ("model_structure", "value", "upper_value", "lower_value", "note")
+
+
+class IngestDataSetSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+    results = IngestResultSerializer(many=True, required=False)
+
+    class Meta:
+        model = DataSet
+        fields = ("source", "note", "results")
+
+    def validate_results(self, results):
+        # Естественный ключ результата — (набор данных, структура модели)
+        structures = [result["model_structure"].pk for result in results]
+        if len(structures) != len(set(structures)):
+            raise serializers.ValidationError("Структура модели повторяется в наборе данных.")
+        return results
+
+
+class IngestClinicalCaseSerializer(serializers.ModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+    datasets = IngestDataSetSerializer(many=True, required=False)
+    complications = BulkPrimaryKeyRelatedField(
+        queryset=Complication.objects.all(), many=True, required=False
+    )
+
+    class Meta:
+        model = ClinicalCase
+        fields = (
+            "age", "age_min", "age_max", "quantity", "gender", "diagnosis",
+            "refined_diagnosis", "spec_location", "stage", "risk_group",
+            "radiation_therapy_type", "number_of_fractions", "single_dose",
+            "treatment_duration", "histology", "grade", "tumor", "node",
+            "metastasis", "note", "datasets", "complications",
+        )
+
+
+# Массовое изменение и удаление (BulkEditMixin)
+
+class BulkEditSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False
+    )
+    values = serializers.DictField(required=False, allow_empty=False)
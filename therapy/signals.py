@@ -0,0 +1,246 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+
+from . import parameter_statistics
+from .aggregation import invalidate_aggregations
+from .case_summary import refresh_case_counts, refresh_case_summaries
+from .dictionaries import DICTIONARY_MODELS, bump_dictionary_version
+from .models import (
+    ClinicalCase,
+    ClinicalCaseComplication,
+    DataSet,
+    Diagnosis,
+    Grade,
+    Histology,
+    Location,
+    Metastasis,
+    ModelName,
+    ModelStructure,
+    Node,
+    Parameter,
+    RadiationTherapyType,
+    Result,
+    RiskGroup,
+    SpecLocation,
+    Stage,
+    Tumor,
+    Unit,
+)
+
+
+# Модели, изменение которых меняет состав когорт или результат агрегации
+AGGREGATION_DEPENDENCIES = (
+    ClinicalCase,
+    ClinicalCaseComplication,
+    DataSet,
+    Result,
+    ModelStructure,
+    ModelName,
+    Parameter,
+    Unit,
+    SpecLocation,
+)
+
+
+def invalidate_aggregation_cache(sender, **kwargs):
+    invalidate_aggregations()
+
+
+for model in AGGREGATION_DEPENDENCIES:
+    post_save.connect(invalidate_aggregation_cache, sender=model)
+    post_delete.connect(invalidate_aggregation_cache, sender=model)
+
+
+# Накопленная статистика параметров (ParameterStatistic)
+
+def _statistic_key(result):
+    return (
+        result.model_structure_id,
+        parameter_statistics.result_location(result.data_set_id),
+    )
+
+
+def result_pre_save(sender, instance, **kwargs):
+    instance._previous_statistic_group = None
+    if instance.pk is None:
+        return
+    previous = (
+        Result.objects.filter(pk=instance.pk)
+        .values("model_structure_id", "data_set_id")
+        .first()
+    )
+    if previous is not None:
+        instance._previous_statistic_group = (
+            previous["model_structure_id"],
+            parameter_statistics.result_location(previous["data_set_id"]),
+        )
+
+
+def result_post_save(sender, instance, created, **kwargs):
+    previous_group = getattr(instance, "_previous_statistic_group", None)
+    if created or previous_group is None:
+        model_structure_id, location_id = _statistic_key(instance)
+        parameter_statistics.add_result(
+            model_structure_id, location_id, instance.value, instance.pk
+        )
+    else:
+        # Изменение значения или переход в другую группу: пересчёт обеих групп
+        parameter_statistics.refresh_statistics({previous_group, _statistic_key(instance)})
+
+
+def result_pre_delete(sender, instance, **kwargs):
+    instance._previous_statistic_group = _statistic_key(instance)
+
+
+def result_post_delete(sender, instance, **kwargs):
+    model_structure_id, location_id = instance._previous_statistic_group
+    parameter_statistics.remove_result(
+        model_structure_id, location_id, instance.value, instance.pk
+    )
+
+
+# Перенос случая, набора данных или уточнённой локализации меняет
+# локализацию уже учтённых результатов
+STATISTIC_MOVES = {
+    ClinicalCase: ("spec_location_id", "data_set__clinical_case"),
+    DataSet: ("clinical_case_id", "data_set"),
+    SpecLocation: ("location_id", "data_set__clinical_case__spec_location"),
+}
+
+
+def moved_pre_save(sender, instance, **kwargs):
+    instance._previous_statistic_groups = set()
+    if instance.pk is None:
+        return
+    field, result_lookup = STATISTIC_MOVES[sender]
+    previous = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+    if previous != getattr(instance, field):
+        instance._previous_statistic_groups = parameter_statistics.result_groups(
+            Result.objects.filter(**{result_lookup: instance.pk})
+        )
+
+
+def moved_post_save(sender, instance, **kwargs):
+    previous_groups = getattr(instance, "_previous_statistic_groups", set())
+    if not previous_groups:
+        return
+    _, result_lookup = STATISTIC_MOVES[sender]
+    current_groups = parameter_statistics.result_groups(
+        Result.objects.filter(**{result_lookup: instance.pk})
+    )
+    parameter_statistics.refresh_statistics(previous_groups | current_groups)
+
+
+pre_save.connect(result_pre_save, sender=Result)
+post_save.connect(result_post_save, sender=Result)
+pre_delete.connect(result_pre_delete, sender=Result)
+post_delete.connect(result_post_delete, sender=Result)
+
+for model in STATISTIC_MOVES:
+    pre_save.connect(moved_pre_save, sender=model)
+    post_save.connect(moved_post_save, sender=model)
+
+
+# Кэш справочников в памяти процессов (therapy.dictionaries)
+
+def invalidate_dictionaries(sender, **kwargs):
+    bump_dictionary_version()
+
+
+for model in DICTIONARY_MODELS:
+    post_save.connect(invalidate_dictionaries, sender=model)
+    post_delete.connect(invalidate_dictionaries, sender=model)
+
+
+# Сводки клинических случаев (therapy.case_summary)
+
+def case_pre_save(sender, instance, **kwargs):
+    instance.rendered_text = instance.render_text()
+
+
+def case_post_save(sender, instance, **kwargs):
+    # Также сохраняет текст, если save() вызван с update_fields без него
+    refresh_case_summaries([instance.pk])
+
+
+pre_save.connect(case_pre_save, sender=ClinicalCase)
+post_save.connect(case_post_save, sender=ClinicalCase)
+
+
+# Путь от строки к клиническому случаю, счётчики которого она меняет
+SUMMARY_COUNTED = {
+    Result: "data_set__clinical_case",
+    DataSet: "clinical_case",
+    ClinicalCaseComplication: "clinical_case",
+}
+
+
+def _counted_cases(sender, pk):
+    lookup = SUMMARY_COUNTED[sender]
+    return set(sender.objects.filter(pk=pk).values_list(lookup, flat=True))
+
+
+def counted_pre_save(sender, instance, **kwargs):
+    instance._summary_cases = set()
+    if instance.pk is not None:
+        instance._summary_cases = _counted_cases(sender, instance.pk)
+
+
+def counted_post_save(sender, instance, **kwargs):
+    previous = getattr(instance, "_summary_cases", set())
+    refresh_case_counts(previous | _counted_cases(sender, instance.pk))
+
+
+def counted_pre_delete(sender, instance, **kwargs):
+    instance._summary_cases = _counted_cases(sender, instance.pk)
+
+
+def counted_post_delete(sender, instance, **kwargs):
+    refresh_case_counts(instance._summary_cases)
+
+
+for model in SUMMARY_COUNTED:
+    pre_save.connect(counted_pre_save, sender=model)
+    post_save.connect(counted_post_save, sender=model)
+    pre_delete.connect(counted_pre_delete, sender=model)
+    post_delete.connect(counted_post_delete, sender=model)
+
+
+# Справочники, подписи которых хранятся в сводке: путь от случая
+SUMMARY_DICTIONARIES = {
+    Diagnosis: "diagnosis",
+    SpecLocation: "spec_location",
+    Location: "spec_location__location",
+    Stage: "stage",
+    RiskGroup: "risk_group",
+    RadiationTherapyType: "radiation_therapy_type",
+    Tumor: "tumor",
+    Node: "node",
+    Metastasis: "metastasis",
+    Histology: "histology",
+    Grade: "grade",
+}
+
+
+def _referencing_cases(sender, pk):
+    lookup = SUMMARY_DICTIONARIES[sender]
+    return ClinicalCase.objects.filter(**{lookup: pk}).values_list("pk", flat=True)
+
+
+def dictionary_post_save(sender, instance, created, **kwargs):
+    if not created:
+        refresh_case_summaries(_referencing_cases(sender, instance.pk))
+
+
+def dictionary_pre_delete(sender, instance, **kwargs):
+    # При SET_NULL случаи остаются, но ссылку уже не найти после удаления
+    instance._summary_cases = set(_referencing_cases(sender, instance.pk))
+
+
+def dictionary_post_delete(sender, instance, **kwargs):
+    refresh_case_summaries(instance._summary_cases)
+
+
+for model in SUMMARY_DICTIONARIES:
+    post_save.connect(dictionary_post_save, sender=model)
+    pre_delete.connect(dictionary_pre_delete, sender=model)
+    post_delete.connect(dictionary_post_delete, sender=model)
@@ -0,0 +1,230 @@
+import numpy as np
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from rest_framework.exceptions import ValidationError
+
+from .aggregation import GROUP_FIELDS, group_key
+from .filters import split_values
+from .models import ModelStructure
+
+
+# Статистики, доступные через параметр stats=
+AVAILABLE_STATS = ("median", "iqr", "std", "ci95", "weighted_mean", "bounds")
+
+# Столбцы, выгружаемые одним запросом: структура модели, значение,
+# границы и вес (число пациентов клинического случая)
+COLUMNS = (
+    "model_structure_id",
+    "value",
+    "lower_value",
+    "upper_value",
+    "data_set__clinical_case__quantity",
+)
+
+# Квантиль нормального распределения для двустороннего 95% интервала
+Z_95 = 1.959963984540054
+
+
+def parse_stats(value):
+    """Список статистик из параметра stats (строка через запятую, список или all)."""
+    if value in (None, "", []):
+        return []
+    names = {name.strip() for name in split_values(value) if name.strip()}
+    if "all" in names:
+        return list(AVAILABLE_STATS)
+    unknown = names - set(AVAILABLE_STATS)
+    if unknown:
+        raise ValidationError(
+            {"stats": "Неизвестные статистики: " + ", ".join(sorted(unknown))}
+        )
+    return [name for name in AVAILABLE_STATS if name in names]
+
+
+# Строка COPY ... (FORMAT binary), когда все столбцы приведены к float8
+# без NULL: число полей (int16), затем у каждого поля длина (int32) и
+# значение (float8, big-endian). Ширина постоянна, строки читаются
+# в numpy без объектов Python на строку
+ROW_DTYPE = np.dtype(
+    [("field_count", ">i2")]
+    + [item for index in range(len(COLUMNS))
+       for item in ((f"length_{index}", ">i4"), (f"column_{index}", ">f8"))]
+)
+COPY_SIGNATURE = b"PGCOPY\n\377\r\n\0"
+COPY_HEADER_SIZE = len(COPY_SIGNATURE) + 8
+COPY_TRAILER = b"\xff\xff"
+COPY_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+class _ColumnReader:
+    """Приёмник потока COPY: разбирает целые строки порциями в массивы."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.header_read = False
+        self.chunks = [[] for _ in COLUMNS]
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= COPY_CHUNK_BYTES:
+            self.parse()
+
+    def parse(self):
+        if not self.header_read:
+            if len(self.buffer) < COPY_HEADER_SIZE:
+                return
+            if not self.buffer.startswith(COPY_SIGNATURE):
+                raise ValueError("Неожиданный формат потока COPY.")
+            extension = int.from_bytes(self.buffer[COPY_HEADER_SIZE - 4:COPY_HEADER_SIZE], "big")
+            del self.buffer[:COPY_HEADER_SIZE + extension]
+            self.header_read = True
+        rows = len(self.buffer) // ROW_DTYPE.itemsize
+        if not rows:
+            return
+        size = rows * ROW_DTYPE.itemsize
+        table = np.frombuffer(bytes(self.buffer[:size]), dtype=ROW_DTYPE)
+        del self.buffer[:size]
+        for index, chunk in enumerate(self.chunks):
+            chunk.append(table[f"column_{index}"].astype(np.float64))
+
+    def columns(self):
+        self.parse()
+        if bytes(self.buffer) != COPY_TRAILER:
+            raise ValueError("Неожиданный конец потока COPY.")
+        return [
+            np.concatenate(chunk) if chunk else np.empty(0) for chunk in self.chunks
+        ]
+
+
+def load_columns(results):
+    """
+    Выгружает столбцы результатов потоком COPY в двоичном формате без
+    создания объектов и возвращает их как непрерывные массивы float64
+    (NULL -> NaN).
+    """
+    try:
+        sql, params = results.order_by().values_list(*COLUMNS).query.sql_with_params()
+    except EmptyResultSet:
+        # Например, когорта из пустого списка id
+        return [np.empty(0) for _ in COLUMNS]
+    names = [f"column_{index}" for index in range(len(COLUMNS))]
+    select = ", ".join(f"COALESCE({name}::float8, 'NaN')" for name in names)
+    with connection.cursor() as cursor:
+        query = cursor.mogrify(sql, params).decode()
+        reader = _ColumnReader()
+        cursor.copy_expert(
+            f"COPY (SELECT {select} FROM ({query}) AS rows ({', '.join(names)})) "
+            "TO STDOUT (FORMAT binary)",
+            reader,
+        )
+    return reader.columns()
+
+
+def _structure_groups(structure_ids):
+    # Несколько структур модели могут попасть в одну группу (модель, параметр, единица)
+    rows = ModelStructure.objects.filter(id__in=structure_ids.tolist()).values_list(
+        "id", "model_name__name", "parameter__name", "parameter__unit__name"
+    )
+    key_by_structure = {
+        pk: group_key(dict(zip(GROUP_FIELDS, names))) for pk, *names in rows
+    }
+    keys = {}
+    codes = np.array(
+        [keys.setdefault(key_by_structure[pk], len(keys)) for pk in structure_ids.tolist()],
+        dtype=np.int64,
+    )
+    return list(keys), codes
+
+
+def _quantile(values, starts, counts, q):
+    # Линейная интерполяция между порядковыми статистиками (как numpy.quantile)
+    position = starts + (counts - 1) * q
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, starts + counts - 1)
+    fraction = position - lower
+    return values[lower] + (values[upper] - values[lower]) * fraction
+
+
+def _group_mean(group, values, size):
+    present = ~np.isnan(values)
+    counts = np.bincount(group[present], minlength=size)
+    sums = np.bincount(group[present], weights=values[present], minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def _number(value):
+    return round(float(value), 2) if np.isfinite(value) else None
+
+
+def compute_group_statistics(results, stats):
+    """
+    Считает запрошенные статистики по группам (модель, параметр, единица)
+    векторно, без циклов по результатам. Возвращает {группа: {статистика: значение}}.
+    """
+    if not stats:
+        return {}
+    structure, value, lower, upper, quantity = load_columns(results)
+    present = ~np.isnan(value)
+    structure, value, lower, upper, quantity = (
+        column[present] for column in (structure, value, lower, upper, quantity)
+    )
+    if not value.size:
+        return {}
+
+    structure_ids, structure_index = np.unique(structure.astype(np.int64), return_inverse=True)
+    keys, structure_codes = _structure_groups(structure_ids)
+    group = structure_codes[structure_index]
+    size = len(keys)
+
+    # Сортировка по группе и значению: группы идут непрерывными отрезками
+    order = np.lexsort((value, group))
+    group, value, lower, upper, quantity = (
+        column[order] for column in (group, value, lower, upper, quantity)
+    )
+    counts = np.bincount(group, minlength=size)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    mean = np.bincount(group, weights=value, minlength=size) / counts
+
+    columns = {}
+    if "median" in stats:
+        columns["median"] = _quantile(value, starts, counts, 0.5)
+    if "iqr" in stats:
+        q1 = _quantile(value, starts, counts, 0.25)
+        q3 = _quantile(value, starts, counts, 0.75)
+        columns.update(q1=q1, q3=q3, iqr=q3 - q1)
+    if "std" in stats or "ci95" in stats:
+        squares = np.bincount(group, weights=(value - mean[group]) ** 2, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(squares / (counts - 1))
+        if "std" in stats:
+            columns["std"] = std
+        if "ci95" in stats:
+            margin = Z_95 * std / np.sqrt(counts)
+            columns.update(ci95_lower=mean - margin, ci95_upper=mean + margin)
+    if "weighted_mean" in stats:
+        # Вес — число пациентов случая; случаи без количества не учитываются
+        weight = np.where(np.isfinite(quantity) & (quantity > 0), quantity, 0.0)
+        weight_sums = np.bincount(group, weights=weight, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            columns["weighted_mean"] = (
+                np.bincount(group, weights=value * weight, minlength=size) / weight_sums
+            )
+    if "bounds" in stats:
+        columns["lower_mean"] = _group_mean(group, lower, size)
+        columns["upper_mean"] = _group_mean(group, upper, size)
+
+    statistics = {}
+    for index, key in enumerate(keys):
+        row = {name: _number(column[index]) for name, column in columns.items()}
+        if "ci95" in stats:
+            row["ci95"] = [row.pop("ci95_lower"), row.pop("ci95_upper")]
+        statistics[key] = row
+    return statistics
+
+
+def attach_statistics(aggregated, results, stats):
+    """Дополняет агрегаты запрошенными статистиками."""
+    by_group = compute_group_statistics(results, stats)
+    for item in aggregated:
+        item.update(by_group.get((item["model"], item["parameter"], item["unit"]), {}))
+    return aggregated
@@ -1,14 +1,26 @@
+import io
+import json
+import os
 import time
 import unittest
-from django.test import TestCase
+
+import numpy as np
+from django.test import TestCase, TransactionTestCase, tag
 from django.urls import reverse
 from django.db import connection, reset_queries
 from rest_framework.test import APIClient
+from therapy.case_summary import rebuild_case_summaries
+from therapy.filters import filter_clinical_cases
+from therapy.pagination import KeysetPagination
+from therapy.query_catalog import explain_query, representative_queries
+from therapy.search import search_query
+from therapy.stats_engine import load_columns
 from users.models import GeneralUser as User
 from therapy.models import (
     ClinicalCase, SpecLocation, Location, Diagnosis, Complication,
     DataSet, Result, ModelStructure, ModelName, Parameter, Unit,
-    RadiationTherapyType, Stage, RiskGroup, Histology, Grade, Tumor, Node, Metastasis,ClinicalCaseComplication 
+    RadiationTherapyType, Stage, RiskGroup, Histology, Grade, Tumor, Node, Metastasis,ClinicalCaseComplication,
+    Source,
 )
 from django.conf import settings
 from django.db import connection
@@ -16,6 +28,16 @@ from django.db import connection
 settings.DEBUG = True
 connection.force_debug_cursor = True
 
+# Индексы миграции 0016_query_indexes
+QUERY_INDEXES = (
+    'case_location_rt_stage_idx',
+    'dataset_case_source_idx',
+    'structure_model_param_idx',
+    'result_dataset_value_idx',
+    'result_structure_dataset_idx',
+)
+
+
 class PerformanceTestCase(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -73,25 +95,26 @@ class PerformanceTestCase(TestCase):
         datasets = []
         results = []
         
-        # Для каждого случая создаем по 3 результата
+        # Для каждого случая создаем по 3 результата: структура модели
+        # в наборе данных уникальна, поэтому набор на результат
         for case in ClinicalCase.objects.all():
-            dataset = DataSet(
-                clinical_case=case,
-                source=None
-            )
-            datasets.append(dataset)
+            for _ in range(3):
+                dataset = DataSet(
+                    clinical_case=case,
+                    source=None
+                )
+                datasets.append(dataset)
         
         DataSet.objects.bulk_create(datasets, batch_size=500)
         
         # Создаем результаты измерений
         for dataset in DataSet.objects.all():
-            for _ in range(3):
-                result = Result(
-                    data_set=dataset,
-                    model_structure=cls.model_struct,
-                    value=10.0 + dataset.id % 10
-                )
-                results.append(result)
+            result = Result(
+                data_set=dataset,
+                model_structure=cls.model_struct,
+                value=10.0 + dataset.id % 10
+            )
+            results.append(result)
         
         Result.objects.bulk_create(results, batch_size=1000)
         
@@ -145,6 +168,155 @@ class PerformanceTestCase(TestCase):
         self.assertLess(len(connection.queries), 15)
         self.assertLess(execution_time, 1.0)
 
+    def test_relation_filter_plan_cost(self):
+        """Оценка плана не растёт при добавлении фильтров по обратным связям"""
+        relation_filters = [
+            ('model_name', self.model_name.id),
+            ('parameter', self.parameter.id),
+            ('model_structure', self.model_struct.id),
+            ('complication', self.complication.id),
+        ]
+        costs = []
+        for count in range(1, len(relation_filters) + 1):
+            params = dict(relation_filters[:count])
+            queryset = filter_clinical_cases(ClinicalCase.objects.all(), params)
+            plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+            costs.append(plan['Total Cost'])
+            # Строки случаев не размножаются: в ответе каждый случай один раз
+            self.assertEqual(queryset.count(), 1000)
+            self.assertNotIn('DISTINCT', str(queryset.query))
+
+        print(f"\n[EXISTS-фильтры] Стоимость плана: {costs}")
+        # Три фильтра по Result сводятся к одному EXISTS
+        self.assertLess(costs[2], costs[0] * 1.5)
+        self.assertLess(costs[-1], costs[0] * 3)
+
+    def test_query_index_benchmark(self):
+        """Бенчмарк каталога запросов с составными/частичными индексами и без них"""
+        # Разнообразное распределение: фильтры каталога становятся селективными
+        spec_locations = [
+            SpecLocation.objects.create(
+                location=Location.objects.create(name=f'Location {i}'), name=f'Spec {i}'
+            )
+            for i in range(20)
+        ]
+        stages = [Stage.objects.create(name=f'Stage {i}') for i in range(5)]
+        rt_types = [RadiationTherapyType.objects.create(name=f'RT {i}') for i in range(4)]
+        structures = [
+            ModelStructure.objects.create(
+                model_name=ModelName.objects.create(name=f'Model {i}'),
+                parameter=Parameter.objects.create(name=f'Parameter {i}', unit=self.unit),
+            )
+            for i in range(30)
+        ]
+        cases = ClinicalCase.objects.bulk_create([
+            ClinicalCase(
+                spec_location=spec_locations[i % 20],
+                stage=stages[i % 5],
+                radiation_therapy_type=rt_types[i % 4],
+                age=30 + i % 50,
+            )
+            for i in range(30000)
+        ], batch_size=5000)
+        datasets = DataSet.objects.bulk_create(
+            [DataSet(clinical_case=case) for case in cases], batch_size=5000
+        )
+        Result.objects.bulk_create([
+            Result(
+                data_set=dataset,
+                model_structure=structures[(i + shift) % 30],
+                value=None if i % 7 == 0 else float(i % 100),
+            )
+            for i, dataset in enumerate(datasets)
+            for shift in (0, 11)
+        ], batch_size=5000)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        def run_catalog():
+            # Лучшее из трёх прогонов сглаживает разброс времени выполнения
+            reports = {}
+            for _ in range(3):
+                for name, queryset in representative_queries().items():
+                    report = explain_query(queryset)
+                    best = reports.get(name)
+                    if best is None or report['execution_time'] < best['execution_time']:
+                        reports[name] = report
+            return reports
+
+        indexed = run_catalog()
+        with connection.cursor() as cursor:
+            for index_name in QUERY_INDEXES:
+                cursor.execute(f'DROP INDEX {index_name}')
+        plain = run_catalog()
+
+        for name in indexed:
+            print(f"\n[Индексы] {name}: {plain[name]['execution_time']:.3f} мс -> "
+                  f"{indexed[name]['execution_time']:.3f} мс, "
+                  f"стоимость {plain[name]['total_cost']:.1f} -> {indexed[name]['total_cost']:.1f}, "
+                  f"индексы: {indexed[name]['indexes']}")
+
+        used = set().union(*(report['indexes'] for report in indexed.values()))
+        self.assertTrue(used & set(QUERY_INDEXES))
+        for name in indexed:
+            self.assertLessEqual(indexed[name]['total_cost'], plain[name]['total_cost'] * 1.05)
+
+    def test_full_text_search_performance(self):
+        """Тест полнотекстового поиска: GIN-индекс вместо последовательного ILIKE"""
+        words = ['облучение', 'фракционирование', 'токсичность', 'radiotherapy', 'dose', 'volume']
+        Source.objects.bulk_create([
+            Source(
+                name=f'Источник {i}',
+                full_name=f'{words[i % 6]} {words[(i * 7) % 6]} study {i}',
+                note='Ретроспективное исследование ректальной токсичности' if i % 5000 == 0 else None,
+            )
+            for i in range(50000)
+        ], batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE therapy_source')
+
+        url = reverse('source-list')
+        reset_queries()
+        start_time = time.perf_counter()
+        response = self.client.get(url, {'search': 'ретроспективные исследования'})
+        execution_time = time.perf_counter() - start_time
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 10)
+        plan = Source.objects.filter(search_vector=search_query('ретроспективные')).explain()
+        print(f"\n[Полнотекстовый поиск] Время: {execution_time:.4f}с, "
+              f"Запросов: {len(connection.queries)}")
+
+        self.assertIn('source_search_idx', plan)
+        self.assertLess(execution_time, 0.05)
+
+    def test_typeahead_performance(self):
+        """Тест автодополнения кодов МКБ-10: префиксный индекс и компактный ответ"""
+        Diagnosis.objects.bulk_create([
+            Diagnosis(code=f'{letter}{number:02d}.{digit}', description=f'Диагноз {letter}{number}')
+            for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+            for number in range(100)
+            for digit in range(10)
+        ], batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE therapy_diagnosis')
+
+        url = reverse('typeahead-detail', args=['diagnosis'])
+        self.client.get(url, {'q': 'C6'})
+        start_time = time.perf_counter()
+        response = self.client.get(url, {'q': 'C6'})
+        execution_time = time.perf_counter() - start_time
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0][1], 'C60.0 Диагноз C60')
+        self.assertEqual(len(response.data), 10)
+        plan = Diagnosis.objects.filter(code__istartswith='C6').order_by('code')[:10].explain()
+        print(f"\n[Автодополнение] Время: {execution_time:.4f}с")
+
+        self.assertIn('diagnosis_code_prefix_idx', plan)
+        self.assertLess(execution_time, 0.01)
+
     def test_aggregation_performance(self):
         """Тест производительности агрегации данных"""
         url = reverse('aggregate-metrics-list')
@@ -171,6 +343,183 @@ class PerformanceTestCase(TestCase):
         self.assertLess(len(connection.queries), 10)
         self.assertLess(execution_time, 1.5)
 
+    def test_aggregation_stats_performance(self):
+        """Тест производительности расширенных статистик (NumPy)"""
+        url = reverse('aggregate-metrics-list')
+        case_ids = list(ClinicalCase.objects.values_list('id', flat=True))
+
+        reset_queries()
+        start_time = time.perf_counter()
+
+        response = self.client.post(url, {
+            "clinical_case_ids": case_ids,
+            "stats": "all",
+        }, format='json')
+
+        execution_time = time.perf_counter() - start_time
+
+        self.assertEqual(response.status_code, 200)
+        print(f"\n[Статистики] Время: {execution_time:.4f}с, "
+              f"Запросов: {len(connection.queries)}")
+
+        # Выгрузка столбцов и структуры моделей — два дополнительных запроса
+        self.assertLess(len(connection.queries), 12)
+        self.assertLess(execution_time, 1.5)
+
+    def test_export_streaming_performance(self):
+        """Тест потоковой выгрузки: первая строка приходит до чтения всей когорты"""
+        url = reverse('clinical-case-export')
+
+        start_time = time.perf_counter()
+        with self.settings(EXPORT_CHUNK_SIZE=100):
+            response = self.client.get(url)
+            content = iter(response.streaming_content)
+            first_line = next(content)
+            first_byte_time = time.perf_counter() - start_time
+            line_count = 1 + sum(1 for _ in content)
+        execution_time = time.perf_counter() - start_time
+
+        print(f"\n[Экспорт] Первая строка: {first_byte_time:.4f}с, "
+              f"Всего: {execution_time:.4f}с, Строк: {line_count}")
+
+        self.assertTrue(first_line.startswith(b'{"id"'))
+        self.assertEqual(line_count, ClinicalCase.objects.count())
+        self.assertLess(first_byte_time, execution_time / 2)
+
+    def test_case_summary_list_performance(self):
+        """Подписи списка читаются из сводки одним JOIN без справочников"""
+        url = reverse('clinical-case-list')
+        params = {'fields': 'name_stage,text_location,text_diagnosis,clinical_case_text,result_count'}
+        rebuild_case_summaries()
+
+        reset_queries()
+        start_time = time.perf_counter()
+        response = self.client.get(url, params)
+        execution_time = time.perf_counter() - start_time
+        queries = [query['sql'] for query in connection.queries]
+
+        print(f"\n[Сводка] Время: {execution_time:.4f}с, Запросов: {len(queries)}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"therapy_clinicalcasesummary"', queries[0])
+        self.assertNotIn('"therapy_stage"', queries[0])
+        self.assertNotIn('"therapy_diagnosis"', queries[0])
+        case = response.data[0]
+        self.assertEqual(case['result_count'], 3)
+
+    def test_nested_ingest_throughput(self):
+        """Вложенная загрузка: число запросов не зависит от числа случаев"""
+        url = reverse('clinical-case-ingest')
+        count = 5000
+        payload = [
+            {
+                "spec_location": self.spec_loc.id,
+                "diagnosis": self.diagnosis.id,
+                "radiation_therapy_type": self.rt_type.id,
+                "stage": self.stage.id,
+                "tumor": self.tumor.id,
+                "age": 40 + i % 40,
+                "datasets": [
+                    {"results": [{"model_structure": self.model_struct.id, "value": 10.0 + i % 7 + j}]}
+                    for j in range(3)
+                ],
+                "complications": [self.complication.id],
+            }
+            for i in range(count)
+        ]
+
+        reset_queries()
+        start_time = time.perf_counter()
+        response = self.client.post(url, payload, format='json')
+        execution_time = time.perf_counter() - start_time
+        query_count = len(connection.queries)
+
+        print(f"\n[Загрузка] {count} случаев: {execution_time:.4f}с, "
+              f"{count / execution_time:.0f} случаев/с, Запросов: {query_count}")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created']), count)
+        self.assertEqual(
+            Result.objects.filter(data_set__clinical_case_id=response.data['created'][-1]['id']).count(), 3
+        )
+        self.assertLess(query_count, 100)
+
+    def test_csv_import_throughput(self):
+        """Импорт CSV через COPY: пропускная способность в строках в секунду"""
+        url = reverse('clinical-case-import')
+        cases, results_per_case = 10000, 5
+        # Разные параметры: структура модели в наборе данных уникальна
+        parameters = ["Dose"] + [f"Dose {j}" for j in range(1, results_per_case)]
+        for name in parameters[1:]:
+            ModelStructure.objects.create(
+                model_name=self.model_name, parameter=Parameter.objects.create(name=name)
+            )
+        lines = ["case,age,spec_location,diagnosis,radiation_therapy_type,stage,tumor,"
+                 "model_name,parameter,value,complications"]
+        for i in range(cases):
+            for j, parameter in enumerate(parameters):
+                lines.append(f"c{i},{40 + i % 40},Test Spec Location,C00,EBRT,Stage I,T1,"
+                             f"NTCP Model,{parameter},{10.0 + j},Test Complication")
+        upload = io.BytesIO("\n".join(lines).encode("utf-8"))
+        upload.name = "cases.csv"
+        rows = cases * results_per_case
+
+        reset_queries()
+        start_time = time.perf_counter()
+        response = self.client.post(url, {"file": upload}, format="multipart")
+        execution_time = time.perf_counter() - start_time
+        query_count = len(connection.queries)
+
+        print(f"\n[Импорт CSV] {rows} строк ({cases} случаев): {execution_time:.4f}с, "
+              f"{rows / execution_time:.0f} строк/с, Запросов: {query_count}")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["errors"], [])
+        self.assertEqual((response.data["cases"], response.data["results"]), (cases, rows))
+        # Запросы — на справочник и на порцию строк, а не на строку
+        self.assertLess(query_count, 100)
+
+    def test_bulk_edit_throughput(self):
+        """Массовое изменение и удаление случаев источника: запросы не на строку"""
+        count = 20000
+        source = Source.objects.create(name='Retracted Source')
+        cases = ClinicalCase.objects.bulk_create(
+            ClinicalCase(
+                spec_location=self.spec_loc,
+                radiation_therapy_type=self.rt_type,
+                age=40 + i % 40,
+            ) for i in range(count)
+        )
+        DataSet.objects.bulk_create(DataSet(clinical_case=case, source=source) for case in cases)
+        rebuild_case_summaries()
+        new_type = RadiationTherapyType.objects.create(name='Corrected RT')
+        url = f"{reverse('clinical-case-bulk')}?source={source.id}"
+
+        reset_queries()
+        start_time = time.perf_counter()
+        response = self.client.patch(url, {"values": {"radiation_therapy_type": new_type.id}}, format='json')
+        update_time = time.perf_counter() - start_time
+        update_queries = len(connection.queries)
+
+        reset_queries()
+        start_time = time.perf_counter()
+        deleted = self.client.delete(url, format='json')
+        delete_time = time.perf_counter() - start_time
+        delete_queries = len(connection.queries)
+
+        print(f"\n[Массовое изменение] {count} случаев: {update_time:.4f}с, Запросов: {update_queries}"
+              f"\n[Массовое удаление] {count} случаев: {delete_time:.4f}с, Запросов: {delete_queries}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"updated": count})
+        self.assertEqual(deleted.status_code, 200)
+        self.assertEqual((deleted.data["deleted"], deleted.data["datasets"]), (count, count))
+        self.assertFalse(ClinicalCase.objects.filter(radiation_therapy_type=new_type).exists())
+        # Пересчёт сводок идёт пачками, остальное — по запросу на таблицу
+        self.assertLess(update_queries, 200)
+        self.assertLess(delete_queries, 30)
+
     def test_bulk_create_performance(self):
         """Тест производительности массового создания объектов"""
         url = reverse('clinical-case-list')
@@ -208,6 +557,42 @@ class PerformanceTestCase(TestCase):
         self.assertLess(elapsed, 5.0)  
 
 
+    def test_bulk_list_create_performance(self):
+        """Проверка списка: запросы на таблицу справочника, а не на элемент"""
+        url = reverse('clinical-case-list')
+        count = 2000
+        payload = [
+            {
+                "spec_location": self.spec_loc.id,
+                "diagnosis": self.diagnosis.id,
+                "age": 40 + i % 40,
+                "stage": self.stage.id,
+                "risk_group": self.risk_group.id,
+                "radiation_therapy_type": self.rt_type.id,
+                "histology": self.histology.id,
+                "grade": self.grade.id,
+                "tumor": self.tumor.id,
+                "node": self.node.id,
+                "metastasis": self.metastasis.id,
+            }
+            for i in range(count)
+        ]
+
+        reset_queries()
+        start = time.perf_counter()
+        response = self.client.post(url, payload, format='json')
+        elapsed = time.perf_counter() - start
+        queries = [query['sql'] for query in connection.queries]
+        # Запросы проверки и подготовки — SELECT до первой вставки
+        first_insert = next(index for index, sql in enumerate(queries) if sql.startswith('INSERT'))
+        validation_queries = sum(1 for sql in queries[:first_insert] if sql.startswith('SELECT'))
+
+        print(f"\n[Создание списком] {count} случаев: {elapsed:.4f}s, "
+              f"Запросов проверки: {validation_queries}, Всего: {len(queries)}")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['created_ids']), count)
+        self.assertLessEqual(validation_queries, 10)
+
     def test_query_scalability(self):
         """Тест масштабируемости при увеличении объема данных"""
         url = reverse('clinical-case-list')
@@ -242,6 +627,41 @@ class PerformanceTestCase(TestCase):
                 time_per_record = execution_time / count
                 self.assertLess(time_per_record, 0.01)
 
+    def test_keyset_page_scalability(self):
+        """Время выдачи страницы не зависит от размера таблицы"""
+        url = reverse('clinical-case-list')
+
+        # Курсор указывает в середину исходных 1000 случаев
+        middle_id = ClinicalCase.objects.order_by('id').values_list('id', flat=True)[500]
+        cursor = KeysetPagination().encode_cursor({"o": "id", "v": middle_id, "id": middle_id})
+
+        def page_time():
+            reset_queries()
+            start_time = time.perf_counter()
+            response = self.client.get(url, {'page_size': 50, 'cursor': cursor})
+            execution_time = time.perf_counter() - start_time
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), 50)
+            return execution_time, len(connection.queries)
+
+        small_time, small_queries = page_time()
+
+        ClinicalCase.objects.bulk_create([
+            ClinicalCase(
+                spec_location=self.spec_loc,
+                radiation_therapy_type=self.rt_type,
+                age=40 + i % 30,
+            ) for i in range(9000)
+        ], batch_size=1000)
+
+        large_time, large_queries = page_time()
+
+        print(f"\n[Keyset] 1000 записей: {small_time:.4f}с, "
+              f"10000 записей: {large_time:.4f}с")
+
+        self.assertEqual(small_queries, large_queries)
+        self.assertLess(large_time, small_time * 3 + 0.05)
+
     def test_index_usage_performance(self):
         """Тест эффективности использования индексов"""
         url = reverse('clinical-case-list')
@@ -364,5 +784,61 @@ class PerformanceTestCase(TestCase):
         
         tracemalloc.stop()
 
+
+@tag("slow")
+@unittest.skipUnless(
+    os.environ.get("THERAPY_SLOW_TESTS"), "долгий тест: задайте THERAPY_SLOW_TESTS=1"
+)
+class ColumnLoadPerformanceTest(TransactionTestCase):
+    """
+    Миллион строк фиксируется и после теста удаляется TRUNCATE (flush).
+    Откат транзакции оставил бы таблицы раздутыми, и планировщик
+    по их размеру выбирал бы медленные планы в следующих тестах.
+    Запускается только с THERAPY_SLOW_TESTS=1.
+    """
+
+    def test_load_columns_throughput(self):
+        """Выгрузка столбцов для статистик: COPY в двоичном формате в NumPy"""
+        count = 1_000_000
+        case = ClinicalCase.objects.create(
+            spec_location=SpecLocation.objects.create(
+                location=Location.objects.create(name='Test Location'), name='Test Spec Location'
+            ),
+            radiation_therapy_type=RadiationTherapyType.objects.create(name='EBRT'),
+        )
+        structure = ModelStructure.objects.create(
+            model_name=ModelName.objects.create(name='NTCP Model'),
+            parameter=Parameter.objects.create(name='Dose'),
+        )
+        # Каждому результату — свой набор данных (ключ набор + структура уникален)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {DataSet._meta.db_table} (clinical_case_id) "
+                "SELECT %s FROM generate_series(1, %s)",
+                [case.id, count],
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO {Result._meta.db_table} (data_set_id, model_structure_id, value, lower_value)
+                SELECT d.id, %s, random() * 100, CASE WHEN d.id %% 2 = 0 THEN random() END
+                FROM {DataSet._meta.db_table} d
+                WHERE d.clinical_case_id = %s
+                """,
+                [structure.id, case.id],
+            )
+        results = Result.objects.filter(data_set__clinical_case=case)
+
+        start_time = time.perf_counter()
+        columns = load_columns(results)
+        execution_time = time.perf_counter() - start_time
+
+        print(f"\n[Столбцы статистик] {count} строк: {execution_time:.4f}с, "
+              f"{count / execution_time:.0f} строк/с")
+
+        self.assertEqual(len(columns[0]), count)
+        self.assertEqual(int(np.isnan(columns[2]).sum()), count - count // 2)
+        self.assertLess(execution_time, 5)
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -1,5 +1,15 @@
+import importlib
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
 from django.test import TestCase
 from django.core.exceptions import ValidationError  
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+
+from therapy import parameter_statistics, stats_engine
 
 from therapy.models import (
     RadiationTherapyType,
@@ -22,7 +32,9 @@ from therapy.models import (
     Tumor, 
     Node, 
     Metastasis,
-    ClinicalCaseComplication 
+    ClinicalCaseComplication,
+    ParameterStatistic,
+    ClinicalCaseSummary,
 )
 
 class RadiationTherapyTypeTest(TestCase):
@@ -745,4 +757,301 @@ class ResultModelTest(TestCase):
     def test_verbose_names(self):
         meta = Result._meta
         self.assertEqual(meta.verbose_name, "Результат измерения")
-        self.assertEqual(meta.verbose_name_plural, "Результаты измерений")
\ No newline at end of file
+        self.assertEqual(meta.verbose_name_plural, "Результаты измерений")
+
+class ParameterStatisticTest(TestCase):
+    def setUp(self):
+        self.location = Location.objects.create(name="Предстательная железа")
+        self.other_location = Location.objects.create(name="Прямая кишка")
+        self.spec_location = SpecLocation.objects.create(name="Простата", location=self.location)
+        self.other_spec_location = SpecLocation.objects.create(name="Rectum", location=self.other_location)
+        rt_type = RadiationTherapyType.objects.create(name="Фотонная")
+        self.case = ClinicalCase.objects.create(
+            spec_location=self.spec_location, radiation_therapy_type=rt_type
+        )
+        self.dataset = DataSet.objects.create(clinical_case=self.case)
+        parameter = Parameter.objects.create(name="TD50")
+        self.structure = ModelStructure.objects.create(
+            model_name=ModelName.objects.create(name="LKB"), parameter=parameter
+        )
+        # Одна структура модели в наборе данных — результат на набор
+        self.results = [
+            Result.objects.create(
+                model_structure=self.structure,
+                data_set=DataSet.objects.create(clinical_case=self.case),
+                value=value,
+            )
+            for value in (2.0, 4.0, 6.0)
+        ]
+
+    def statistic(self, location=None):
+        return ParameterStatistic.objects.get(
+            model_structure=self.structure, location=location or self.location
+        )
+
+    def test_incremental_create(self):
+        statistic = self.statistic()
+        self.assertEqual(statistic.count, 3)
+        self.assertEqual(statistic.sum, 12.0)
+        self.assertEqual(statistic.sum_of_squares, 56.0)
+        self.assertEqual(statistic.min_value, 2.0)
+        self.assertEqual(statistic.max_value, 6.0)
+        self.assertEqual(statistic.min_result_id, self.results[0].id)
+        self.assertEqual(statistic.max_result_id, self.results[2].id)
+
+    def test_null_value_ignored(self):
+        Result.objects.create(model_structure=self.structure, data_set=self.dataset, value=None)
+        self.assertEqual(self.statistic().count, 3)
+
+    def test_delete_and_update(self):
+        self.results[1].delete()
+        self.assertEqual(self.statistic().count, 2)
+        self.assertEqual(self.statistic().sum, 8.0)
+
+        self.results[0].delete()
+        statistic = self.statistic()
+        self.assertEqual(statistic.min_value, 6.0)
+        self.assertEqual(statistic.min_result_id, self.results[2].id)
+
+        self.results[2].value = 10.0
+        self.results[2].save()
+        self.assertEqual(self.statistic().max_value, 10.0)
+        self.assertEqual(self.statistic().sum, 10.0)
+
+        self.results[2].delete()
+        self.assertFalse(ParameterStatistic.objects.exists())
+
+    def test_case_moved_to_other_location(self):
+        self.case.spec_location = self.other_spec_location
+        self.case.save()
+        self.assertFalse(ParameterStatistic.objects.filter(location=self.location).exists())
+        self.assertEqual(self.statistic(self.other_location).count, 3)
+
+    def test_case_delete(self):
+        self.case.delete()
+        self.assertFalse(ParameterStatistic.objects.exists())
+
+    def test_merge_new_results(self):
+        other_case = ClinicalCase.objects.create(
+            spec_location=self.other_spec_location,
+            radiation_therapy_type=self.case.radiation_therapy_type,
+        )
+        # bulk_create не отправляет сигналы: статистика ещё не знает о строках
+        created = Result.objects.bulk_create([
+            Result(model_structure=self.structure, data_set=DataSet.objects.create(clinical_case=case),
+                   value=value)
+            for case, value in [
+                (self.case, 1.0), (self.case, 9.0), (self.case, 1.0), (self.case, None),
+                (other_case, 5.0),
+            ]
+        ])
+        with self.assertNumQueries(1):
+            parameter_statistics.merge_statistics(
+                Result.objects.filter(pk__in=[result.pk for result in created])
+            )
+        self.assertEqual(parameter_statistics.check_statistics(), [])
+        statistic = self.statistic()
+        self.assertEqual(statistic.count, 6)
+        # При равных значениях — результат с меньшим id, как при пересчёте
+        self.assertEqual(statistic.min_result_id, created[0].id)
+        self.assertEqual(statistic.max_result_id, created[1].id)
+        self.assertEqual(self.statistic(self.other_location).min_result_id, created[4].id)
+
+        parameter_statistics.merge_statistics(Result.objects.none())
+        self.assertEqual(self.statistic().count, 6)
+
+    def test_duplicate_results(self):
+        # Повторы, оставшиеся от данных до ограничения уникальности.
+        # ALTER TABLE невозможен при отложенных проверках внешних ключей
+        connection.check_constraints()
+        with connection.schema_editor() as editor:
+            editor.remove_constraint(
+                Result, next(c for c in Result._meta.constraints if c.name == "result_dataset_structure_uniq")
+            )
+        duplicate = Result.objects.create(
+            model_structure=self.structure, data_set=self.results[0].data_set, value=8.0
+        )
+        migration = importlib.import_module("therapy.migrations.0021_result_natural_key")
+        with self.assertRaisesMessage(
+            RuntimeError, f"(data_set={self.results[0].data_set_id}, model_structure={self.structure.id})"
+        ):
+            migration.check_duplicate_results(apps, None)
+
+        stdout = StringIO()
+        call_command("remove_duplicate_results", "--dry-run", stdout=stdout)
+        self.assertIn(f"result={self.results[0].id} ", stdout.getvalue())
+        self.assertTrue(Result.objects.filter(pk=self.results[0].pk).exists())
+
+        call_command("remove_duplicate_results", stdout=StringIO())
+        self.assertFalse(Result.objects.filter(pk=self.results[0].pk).exists())
+        self.assertTrue(Result.objects.filter(pk=duplicate.pk).exists())
+        # Остался последний загруженный результат, статистика пересчитана
+        self.assertEqual(parameter_statistics.check_statistics(), [])
+        self.assertEqual(self.statistic().count, 3)
+        migration.check_duplicate_results(apps, None)
+
+    def test_rebuild_command(self):
+        Result.objects.bulk_create([
+            Result(model_structure=self.structure, data_set=self.dataset, value=1.0)
+        ])
+        with self.assertRaises(CommandError):
+            call_command("rebuild_parameter_statistics", "--check", stdout=StringIO())
+
+        call_command("rebuild_parameter_statistics", stdout=StringIO())
+        self.assertEqual(self.statistic().count, 4)
+        self.assertEqual(self.statistic().min_value, 1.0)
+        call_command("rebuild_parameter_statistics", "--check", stdout=StringIO())
+
+
+class ClinicalCaseSummaryTest(TestCase):
+    def setUp(self):
+        location = Location.objects.create(name="Предстательная железа", short_name="ПЖ")
+        self.spec_location = SpecLocation.objects.create(name="Простата", location=location)
+        self.stage = Stage.objects.create(name="II")
+        self.diagnosis = Diagnosis.objects.create(code="C61", description="Рак предстательной железы")
+        self.case = ClinicalCase.objects.create(
+            spec_location=self.spec_location,
+            radiation_therapy_type=RadiationTherapyType.objects.create(name="Фотонная"),
+            stage=self.stage,
+            diagnosis=self.diagnosis,
+        )
+        self.dataset = DataSet.objects.create(clinical_case=self.case)
+        self.structure = ModelStructure.objects.create(
+            model_name=ModelName.objects.create(name="LKB"),
+            parameter=Parameter.objects.create(name="TD50"),
+        )
+
+    def summary(self):
+        return ClinicalCaseSummary.objects.get(clinical_case=self.case)
+
+    def test_rendered_on_save(self):
+        summary = self.summary()
+        self.assertEqual(summary.name_stage, "II")
+        self.assertEqual(summary.name_diagnosis, "C61")
+        self.assertEqual(summary.text_location, str(self.spec_location))
+        # Текст случая хранится только в самом случае
+        self.assertFalse(hasattr(summary, "clinical_case_text"))
+
+        self.case.age = 60
+        self.case.save()
+        self.assertIn("Возраст: 60", ClinicalCase.objects.get(pk=self.case.pk).rendered_text)
+
+    def test_dictionary_change(self):
+        self.stage.name = "III"
+        self.stage.save()
+        self.assertEqual(self.summary().name_stage, "III")
+
+        self.diagnosis.code = "C61.0"
+        self.diagnosis.save()
+        self.assertEqual(self.summary().name_diagnosis, "C61.0")
+
+        # SET_NULL обновляет случаи без сигналов, сводка следует за ними
+        self.stage.delete()
+        self.assertIsNone(self.summary().name_stage)
+
+    def test_rendered_text(self):
+        case = ClinicalCase.objects.get(pk=self.case.pk)
+        with self.assertNumQueries(0):
+            text = str(case)
+        self.assertEqual(text, case.render_text())
+        self.assertIn("Стадия: II", text)
+
+        # Изменение справочника пересчитывает текст затронутых случаев
+        self.stage.name = "III"
+        self.stage.save()
+        case.refresh_from_db()
+        self.assertIn("Стадия: III", case.rendered_text)
+
+        # save(update_fields=...) без rendered_text всё равно обновляет текст
+        case.age = 70
+        case.save(update_fields=["age"])
+        case.refresh_from_db()
+        self.assertIn("Возраст: 70", case.rendered_text)
+
+    def test_counts(self):
+        result = Result.objects.create(model_structure=self.structure, data_set=self.dataset, value=1.0)
+        Result.objects.create(
+            model_structure=self.structure,
+            data_set=DataSet.objects.create(clinical_case=self.case),
+            value=2.0,
+        )
+        ClinicalCaseComplication.objects.create(
+            clinical_case=self.case,
+            complication=Complication.objects.create(name="Цистит", spec_location=self.spec_location),
+        )
+        self.assertEqual(self.summary().result_count, 2)
+        self.assertEqual(self.summary().complication_count, 1)
+
+        result.delete()
+        self.assertEqual(self.summary().result_count, 1)
+        DataSet.objects.exclude(pk=self.dataset.pk).delete()
+        self.assertEqual(self.summary().result_count, 0)
+
+    def test_case_delete(self):
+        Result.objects.create(model_structure=self.structure, data_set=self.dataset, value=1.0)
+        self.case.delete()
+        self.assertFalse(ClinicalCaseSummary.objects.exists())
+        # Каскад не должен оставить сводку без случая (FK проверяются при COMMIT)
+        connection.check_constraints()
+
+    def test_rebuild_command(self):
+        Result.objects.bulk_create([
+            Result(model_structure=self.structure, data_set=self.dataset, value=1.0)
+        ])
+        with self.assertRaises(CommandError):
+            call_command("rebuild_case_summaries", "--check", stdout=StringIO())
+
+        ClinicalCase.objects.filter(pk=self.case.pk).update(rendered_text=None)
+        call_command("rebuild_case_summaries", stdout=StringIO())
+        self.assertEqual(self.summary().result_count, 1)
+        self.assertIsNotNone(ClinicalCase.objects.get(pk=self.case.pk).rendered_text)
+        call_command("rebuild_case_summaries", "--check", stdout=StringIO())
+
+
+class StatsEngineColumnsTest(TestCase):
+    def test_load_columns_matches_orm(self):
+        spec_location = SpecLocation.objects.create(
+            name="Простата", location=Location.objects.create(name="Предстательная железа")
+        )
+        rt_type = RadiationTherapyType.objects.create(name="Фотонная")
+        structures = [
+            ModelStructure.objects.create(
+                model_name=ModelName.objects.create(name=f"M{index}"),
+                parameter=Parameter.objects.create(name=f"P{index}"),
+            )
+            for index in range(3)
+        ]
+        for index in range(20):
+            case = ClinicalCase.objects.create(
+                spec_location=spec_location, radiation_therapy_type=rt_type, quantity=index + 1
+            )
+            dataset = DataSet.objects.create(clinical_case=case)
+            for number, structure in enumerate(structures):
+                Result.objects.create(
+                    data_set=dataset,
+                    model_structure=structure,
+                    value=index * 1.5 + number,
+                    lower_value=index if number else None,
+                    upper_value=None if index % 2 else index + 0.25,
+                )
+
+        results = Result.objects.order_by("id")
+        expected = list(results.values_list(*stats_engine.COLUMNS))
+        # Маленькие порции: строки потока режутся на границах порций
+        with mock.patch.object(stats_engine, "COPY_CHUNK_BYTES", 100):
+            columns = stats_engine.load_columns(results)
+
+        self.assertEqual(len(columns[0]), len(expected))
+        actual = sorted(zip(*(column.tolist() for column in columns)))
+        expected = sorted(
+            tuple(float("nan") if value is None else float(value) for value in row)
+            for row in expected
+        )
+        for actual_row, expected_row in zip(actual, expected):
+            self.assertEqual(
+                [None if value != value else value for value in actual_row],
+                [None if value != value else value for value in expected_row],
+            )
+
+        empty = stats_engine.load_columns(Result.objects.none())
+        self.assertEqual([column.size for column in empty], [0] * len(stats_engine.COLUMNS))
@@ -672,7 +672,7 @@ class ClinicalCaseSerializerTest(APITestCase):
             'text_radiation_therapy_type', 'text_tumor', 'text_node',
             'text_metastasis', 'text_histology', 'text_grade',
             'datasets_source_name', 'datasets_source_url', 'datasets_result',
-            'complications'
+            'complications', 'result_count', 'complication_count'
         }
         self.assertEqual(set(data.keys()), expected_fields)
     
@@ -692,6 +692,13 @@ class ClinicalCaseSerializerTest(APITestCase):
         data = self.serializer.data
         self.assertEqual(data['text_location'], str(self.spec_location))
     
+    def test_clinical_case_text_field(self):
+        # Текст берётся из сохранённого rendered_text случая
+        ClinicalCase.objects.filter(pk=self.instance.pk).update(rendered_text="Сохранённый текст")
+        case = ClinicalCase.objects.select_related("summary").get(pk=self.instance.pk)
+        data = ClinicalCaseSerializer(case).data
+        self.assertEqual(data['clinical_case_text'], "Сохранённый текст")
+
     def test_valid_deserialization(self):
         serializer = ClinicalCaseSerializer(data=self.valid_data)
         self.assertTrue(serializer.is_valid(), serializer.errors)
@@ -1,7 +1,27 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from users.models import GeneralUser as User
+from therapy import aggregation, dictionaries
+from therapy.typeahead import trigram_available
+from therapy.case_summary import check_case_summaries
+from therapy.pagination import KeysetPagination
+from therapy.parameter_statistics import check_statistics
 
 from therapy.models import (
     RadiationTherapyType,
@@ -24,7 +44,9 @@ from therapy.models import (
     Tumor, 
     Node, 
     Metastasis,
-    ClinicalCaseComplication 
+    ClinicalCaseComplication,
+    ClinicalCaseSummary,
+    ParameterStatistic,
 )
 
 
@@ -121,6 +143,77 @@ class DiagnosisViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
+    def _search(self, terms, **params):
+        response = self.client.get(self.url, {'search': terms, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['code'] for item in response.data]
+
+    def test_full_text_search(self):
+        Diagnosis.objects.bulk_create([
+            Diagnosis(code='C61', description='Злокачественное новообразование предстательной железы'),
+            Diagnosis(code='C20', description='Rectal cancer', note='Опухоль прямой кишки'),
+            Diagnosis(code='C50', description='Breast cancers', note='См. также новообразования'),
+        ])
+        # Стемминг: другая словоформа того же слова
+        self.assertEqual(self._search('предстательная'), ['C61'])
+        self.assertEqual(self._search('cancer'), ['C20', 'C50'])
+        self.assertEqual(self._search('c61'), ['C61'])
+        self.assertEqual(self._search('кишки -rectal'), [])
+        # Совпадение в описании весомее совпадения в примечании
+        self.assertEqual(self._search('новообразований'), ['C61', 'C50'])
+        self.assertEqual(self._search('новообразований', ordering='code'), ['C50', 'C61'])
+
+    def test_search_vector_follows_updates(self):
+        self.diagnosis.description = 'Лимфома'
+        self.diagnosis.save()
+        self.assertEqual(self._search('лимфомы'), ['C00'])
+        Diagnosis.objects.filter(pk=self.diagnosis.pk).update(description='Меланома')
+        self.assertEqual(self._search('лимфомы'), [])
+        self.assertEqual(self._search('меланомы'), ['C00'])
+
+    def test_prefix_search(self):
+        Diagnosis.objects.bulk_create([
+            Diagnosis(code='C61', description='Злокачественное новообразование предстательной железы'),
+            Diagnosis(code='C20', description='Rectal cancer'),
+        ])
+        # Последнее слово — префикс: запрос находит ещё не дописанное слово
+        self.assertEqual(self._search('предстат'), ['C61'])
+        self.assertEqual(self._search('rectal canc'), ['C20'])
+        self.assertEqual(self._search('злокачественное желез'), ['C61'])
+        # Фразы и исключения остаются точными
+        self.assertEqual(self._search('"rectal canc"'), [])
+        self.assertEqual(self._search('cancer -rect'), ['C20'])
+        self.assertEqual(self._search('rect OR предстат'), [])
+
+
+class SearchDocumentTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+
+    def _search(self, url_name, terms):
+        response = self.client.get(reverse(url_name), {'search': terms})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [item['id'] for item in response.data]
+
+    def test_source_url(self):
+        source = Source.objects.create(name='RTOG 0126', url='https://doi.org/10.1200/JCO.2017.75.7441')
+        Source.objects.create(name='Другой источник', url='https://example.com/trial')
+        self.assertEqual(self._search('source-list', 'doi.org'), [source.id])
+        self.assertEqual(self._search('source-list', 'JCO'), [source.id])
+
+    def test_complication_spec_location(self):
+        location = Location.objects.create(name='Таз', short_name='T')
+        spec_location = SpecLocation.objects.create(location=location, name='Прямая кишка')
+        complication = Complication.objects.create(name='Проктит', spec_location=spec_location)
+        Complication.objects.create(name='Цистит')
+        self.assertEqual(self._search('complication-list', 'кишки'), [complication.id])
+        # Переименование локализации пересчитывает векторы её осложнений
+        spec_location.name = 'Rectum'
+        spec_location.save()
+        self.assertEqual(self._search('complication-list', 'кишки'), [])
+        self.assertEqual(self._search('complication-list', 'rectum'), [complication.id])
+
 class ClinicalCaseViewSetTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpass')
@@ -210,6 +303,685 @@ class ClinicalCaseViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
+    def test_full_text_search(self):
+        ClinicalCase.objects.filter(pk=self.case1.pk).update(note='Лучевой проктит после облучения')
+        ClinicalCase.objects.filter(pk=self.case2.pk).update(refined_diagnosis='Adenocarcinoma, Gleason 7')
+        self.assertEqual(self._ids({'search': 'проктиты'}), [self.case1.id])
+        self.assertEqual(self._ids({'search': 'adenocarcinomas gleason'}), [self.case2.id])
+        self.assertEqual(self._ids({'search': 'проктит', 'gender': 2}), [])
+
+    def _ids(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(case['id'] for case in response.data)
+
+    def test_range_filters(self):
+        self.assertEqual(self._ids({'age__gte': 40, 'age__lte': 50}), [self.case1.id])
+        self.assertEqual(self._ids({'age__gte': 40, 'number_of_fractions__lte': 25}), [self.case2.id])
+        self.assertEqual(self._ids({'single_dose__gte': 1.5}), [self.case1.id])
+
+    def test_negation_filters(self):
+        stage_id = self.case1.stage_id
+        # Случай без стадии тоже не равен исключаемой стадии
+        self.assertEqual(self._ids({'stage__not': stage_id}), [self.case2.id])
+        self.assertEqual(self._ids({'age__not': '45,46'}), [self.case2.id])
+        complication_id = Complication.objects.first().id
+        self.assertEqual(self._ids({'complication__not': complication_id}), [self.case2.id])
+
+    def test_or_groups(self):
+        stage_id = self.case1.stage_id
+        both = [self.case1.id, self.case2.id]
+        self.assertEqual(self._ids({'or': f'stage:{stage_id}|age__gte:50'}), both)
+        self.assertEqual(self._ids({'or': f'stage:{stage_id}|age__gte:60'}), [self.case1.id])
+        self.assertEqual(
+            self._ids({'or': f'stage:{stage_id}|age__gte:50;number_of_fractions__lte:25'}),
+            [self.case2.id],
+        )
+        # Несколько значений в условии группы: запятая не делит группы
+        self.assertEqual(self._ids({'or': f'stage:0,{stage_id}|age__gte:60'}), [self.case1.id])
+        self.assertEqual(
+            self._ids({'or': f'stage:0,{stage_id}|age__gte:50;number_of_fractions__lte:25'}),
+            [self.case2.id],
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {
+                'fields': 'age', 'gender': 1, 'age__gte': 40, 'or': f'stage:{stage_id}|age__gte:50',
+            })
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertEqual(queries.captured_queries[0]['sql'].count('WHERE'), 1)
+
+    def test_invalid_filter_values(self):
+        self.assertEqual(self.client.get(self.url, {'age__gte': 'old'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'or': 'password:1'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'or': 'age__gte:old'}).status_code, 400)
+
+    def test_relation_filters_without_duplicates(self):
+        source = Source.objects.create(name='Source')
+        unit = Unit.objects.create(name='Gy')
+        lkb = ModelName.objects.create(name='LKB')
+        td50 = Parameter.objects.create(name='TD50', unit=unit)
+        m = Parameter.objects.create(name='m')
+        dataset = DataSet.objects.create(clinical_case=self.case1, source=source)
+        DataSet.objects.create(clinical_case=self.case1, source=source)
+        for parameter in (td50, m):
+            structure = ModelStructure.objects.create(model_name=lkb, parameter=parameter)
+            Result.objects.create(data_set=dataset, model_structure=structure, value=1.0)
+
+        response = self.client.get(self.url, {
+            'model_name': lkb.id, 'source': source.id, 'complication': Complication.objects.first().id,
+        })
+        self.assertEqual([case['id'] for case in response.data], [self.case1.id])
+
+        # model_name и parameter относятся к одному и тому же результату
+        other_model = ModelName.objects.create(name='Logit')
+        structure = ModelStructure.objects.create(model_name=other_model, parameter=m)
+        other_dataset = DataSet.objects.create(clinical_case=self.case2, source=source)
+        Result.objects.create(data_set=other_dataset, model_structure=structure, value=2.0)
+        Result.objects.create(
+            data_set=other_dataset,
+            model_structure=ModelStructure.objects.get(model_name=lkb, parameter=td50),
+            value=3.0,
+        )
+        response = self.client.get(self.url, {'model_name': other_model.id, 'parameter': td50.id})
+        self.assertEqual(response.data, [])
+        response = self.client.get(self.url, {'model_name': lkb.id, 'parameter': td50.id})
+        self.assertEqual(sorted(case['id'] for case in response.data), [self.case1.id, self.case2.id])
+
+    def _add_cases_with_results(self, count):
+        # Версия справочников меняется после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_cases_with_results(count)
+
+    def _create_cases_with_results(self, count):
+        source = Source.objects.create(name='Bulk Source')
+        unit = Unit.objects.create(name=f'Gy{count}')
+        parameter = Parameter.objects.create(name='Dose', unit=unit)
+        model_name = ModelName.objects.create(name=f'LKB{count}')
+        model_structure = ModelStructure.objects.create(model_name=model_name, parameter=parameter)
+        complication = Complication.objects.first()
+        for i in range(count):
+            case = ClinicalCase.objects.create(
+                spec_location=self.case1.spec_location,
+                diagnosis=self.case1.diagnosis,
+                stage=self.case1.stage,
+                tumor=self.case1.tumor,
+                radiation_therapy_type=self.case1.radiation_therapy_type,
+                age=60 + i,
+            )
+            dataset = DataSet.objects.create(clinical_case=case, source=source)
+            Result.objects.create(data_set=dataset, model_structure=model_structure, value=i)
+            ClinicalCaseComplication.objects.create(clinical_case=case, complication=complication)
+
+    def test_list_query_count_does_not_grow(self):
+        self._add_cases_with_results(2)
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 4)
+
+        self._add_cases_with_results(20)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 24)
+
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        case = next(c for c in response.data if c['datasets_result'])
+        self.assertEqual(case['datasets_result'][0]['name_parameter'], 'Dose')
+        self.assertEqual(case['datasets_source_name'], ['Bulk Source'])
+        self.assertEqual(case['complications'][0]['name_complication'], 'Test Complication')
+
+    def test_list_without_summaries_query_count_does_not_grow(self):
+        # Случаи без сводки: диагнозы и счётчики загружаются не построчно
+        params = {'fields': 'name_diagnosis,text_diagnosis,result_count,complication_count'}
+        counts = []
+        for size in (2, 20):
+            self._add_cases_with_results(size)
+            ClinicalCaseSummary.objects.all().delete()
+            self.client.get(self.url, params)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url, params)
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        case = next(c for c in response.data if c['result_count'])
+        self.assertEqual((case['result_count'], case['complication_count']), (1, 1))
+        self.assertEqual(case['name_diagnosis'], 'C00')
+        self.assertEqual(case['text_diagnosis'], str(self.case1.diagnosis))
+
+    def test_dictionary_version_read_once_per_response(self):
+        # Версия справочников читается из общего кэша один раз на ответ,
+        # а не в каждой строке и вложенном результате
+        self._add_cases_with_results(5)
+        ClinicalCaseSummary.objects.all().delete()
+        with mock.patch(
+            'therapy.serializers.dictionary_version',
+            wraps=dictionaries.dictionary_version,
+        ) as version:
+            response = self.client.get(self.url, {'expand': 'datasets_result'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(version.call_count, 1)
+        case = next(c for c in response.data if c['datasets_result'])
+        self.assertEqual(case['datasets_result'][0]['name_parameter'], 'Dose')
+
+    def test_sparse_fields(self):
+        # Первый запрос загружает справочник стадий в память процесса
+        self.client.get(self.url, {'fields': 'name_stage,age'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'fields': 'name_stage,age'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data[0].keys()), {'id', 'name_stage', 'age'})
+        self.assertEqual(len(queries.captured_queries), 1)
+
+    def test_bulk_list_create(self):
+        item = {
+            'spec_location': self.case1.spec_location_id,
+            'radiation_therapy_type': self.case1.radiation_therapy_type_id,
+            'diagnosis': self.case1.diagnosis_id,
+            'stage': self.case1.stage_id,
+            'tumor': self.case1.tumor_id,
+            'grade': self.case1.grade_id,
+        }
+        counts = []
+        for size in (2, 30):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, [dict(item, age=i) for i in range(size)], format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data['created_ids']), size)
+            counts.append(len(queries.captured_queries))
+        # Связи проверяются одним запросом на таблицу, а не на элемент
+        self.assertEqual(counts[0], counts[1])
+        case = ClinicalCase.objects.get(pk=response.data['created_ids'][-1])
+        self.assertEqual(case.age, 29)
+        self.assertIn('Стадия: Test Stage', case.rendered_text)
+
+        response = self.client.post(self.url, [item, dict(item, stage=999999)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('stage', response.data[1])
+
+    def test_dictionary_labels_from_memory(self):
+        params = {'fields': 'name_stage,text_location,name_tumor,clinical_case_text'}
+        self.client.get(self.url, params)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        # Один запрос случаев с JOIN диагноза, справочники — из памяти
+        self.assertEqual(len(queries.captured_queries), 1)
+        case = next(c for c in response.data if c['id'] == self.case1.id)
+        self.assertEqual(case['name_stage'], 'Test Stage')
+        self.assertEqual(case['text_location'], 'Test Spec Location (Test Location (TL))')
+        self.assertIn('Стадия: Test Stage', case['clinical_case_text'])
+
+        # Сохранение справочника меняет версию, процесс перечитывает его
+        stage = self.case1.stage
+        stage.name = 'Stage II'
+        stage.save()
+        response = self.client.get(self.url, params)
+        case = next(c for c in response.data if c['id'] == self.case1.id)
+        self.assertEqual(case['name_stage'], 'Stage II')
+
+    def test_expand_relations(self):
+        response = self.client.get(self.url, {'expand': 'complications'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        keys = set(response.data[0].keys())
+        self.assertIn('complications', keys)
+        self.assertIn('clinical_case_text', keys)
+        self.assertNotIn('datasets_result', keys)
+        self.assertNotIn('datasets_source_name', keys)
+
+    def test_fields_with_expand(self):
+        response = self.client.get(self.url, {'fields': 'name_grade', 'expand': 'datasets_result'})
+        self.assertEqual(set(response.data[0].keys()), {'id', 'name_grade', 'datasets_result'})
+
+    def test_unknown_fields_rejected(self):
+        response = self.client.get(self.url, {'fields': 'password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'expand': 'name_stage'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_keyset_pagination(self):
+        response = self.client.get(self.url, {'page_size': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c['id'] for c in response.data['results']], [self.case1.id])
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([c['id'] for c in response.data['results']], [self.case2.id])
+        self.assertIsNone(response.data['next'])
+
+    def test_keyset_pagination_ordering_and_filters(self):
+        response = self.client.get(self.url, {'page_size': 1, 'ordering': '-age', 'gender': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['age'], 55)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'][0]['age'], 45)
+        self.assertIsNone(response.data['next'])
+
+    def test_keyset_pagination_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Значение курсора неподходящего типа или вне диапазона поля
+        for cursor in (
+            {'o': 'age', 'v': 'abc', 'id': self.case1.id},
+            {'o': 'age', 'v': [1], 'id': self.case1.id},
+            {'o': 'age', 'v': 1.5, 'id': self.case1.id},
+            {'o': 'age', 'v': 2 ** 40, 'id': self.case1.id},
+            {'o': 'single_dose', 'v': True, 'id': self.case1.id},
+            {'o': 'id', 'v': None, 'id': 2 ** 70},
+        ):
+            response = self.client.get(self.url, {'cursor': KeysetPagination().encode_cursor(cursor)})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, cursor)
+
+        cursor = KeysetPagination().encode_cursor({'o': 'single_dose', 'v': 2, 'id': self.case1.id})
+        response = self.client.get(self.url, {'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_keyset_pagination_invalid_ordering(self):
+        response = self.client.get(self.url, {'page_size': 1, 'ordering': 'note'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def _export(self, params):
+        response = self.client.get(reverse('clinical-case-export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_explain_queries_command(self):
+        self._add_cases_with_results(2)
+        stdout = io.StringIO()
+        call_command('explain_queries', stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(
+            [line.split(':')[0] for line in lines],
+            ['case_list_filter', 'case_relation_filter', 'aggregate_groups',
+             'results_by_dataset', 'model_structure_lookup'],
+        )
+
+        stdout = io.StringIO()
+        call_command('explain_queries', 'case_list_filter', '--plan', stdout=stdout)
+        self.assertIn('"Execution Time"', stdout.getvalue())
+
+    def test_export_ndjson(self):
+        self._add_cases_with_results(3)
+        with override_settings(EXPORT_CHUNK_SIZE=2):
+            response, content = self._export({'gender': 1})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        expected = json.loads(json.dumps(self.client.get(self.url, {'gender': 1}).data))
+        self.assertEqual(rows, sorted(expected, key=lambda row: row['id']))
+
+    def test_export_csv(self):
+        response, content = self._export({
+            'export_format': 'csv', 'fields': 'age,name_stage', 'expand': 'complications',
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(set(rows[0]), {'id', 'age', 'name_stage', 'complications'})
+        self.assertEqual(rows[0]['age'], '45')
+        complications = json.loads(rows[0]['complications'])
+        self.assertEqual(complications[0]['name_complication'], 'Test Complication')
+
+    def test_export_applies_search(self):
+        self._add_cases_with_results(2)
+        ClinicalCase.objects.filter(age=61).update(note='Рецидив после облучения')
+        response, content = self._export({'search': 'рецидивы'})
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['age'] for row in rows], [61])
+
+    def test_export_invalid_format(self):
+        response = self.client.get(reverse('clinical-case-export'), {'export_format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+    def test_analysis_table_parquet(self):
+        self._add_cases_with_results(3)
+        response = self.client.get(reverse('clinical-case-analysis-table'), {'age': '60,61'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        table = pq.read_table(io.BytesIO(b''.join(response.streaming_content)))
+
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(table.column('age').to_pylist(), [60, 61])
+        self.assertEqual(table.column('value').to_pylist(), [0.0, 1.0])
+        self.assertTrue(pa.types.is_dictionary(table.schema.field('stage').type))
+        self.assertEqual(table.column('stage').to_pylist(), ['Test Stage', 'Test Stage'])
+        self.assertEqual(table.column('parameter').to_pylist(), ['Dose', 'Dose'])
+        self.assertEqual(table.column('risk_group').to_pylist(), [None, None])
+
+    def test_analysis_table_nullable_labels(self):
+        self._add_cases_with_results(3)
+        # Стадия без названия и стадия с повторяющимся названием
+        ClinicalCase.objects.filter(age=60).update(stage=Stage.objects.create(name=None))
+        ClinicalCase.objects.filter(age=61).update(stage=Stage.objects.create(name='Test Stage'))
+        response = self.client.get(reverse('clinical-case-analysis-table'), {'age': '60,61,62'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        table = pq.read_table(io.BytesIO(b''.join(response.streaming_content)))
+
+        self.assertEqual(table.column('age').to_pylist(), [60, 61, 62])
+        self.assertEqual(table.column('stage').to_pylist(), [None, 'Test Stage', 'Test Stage'])
+        stage = table.column('stage').combine_chunks()
+        self.assertEqual(stage.dictionary.to_pylist(), ['Test Stage'])
+
+    def test_analysis_table_command_arrow(self):
+        self._add_cases_with_results(5)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'table.arrow')
+            call_command(
+                'export_analysis_table', path, '--format', 'arrow', '--chunk-size', '2',
+                stdout=io.StringIO(),
+            )
+            with pa.memory_map(path) as source:
+                reader = pa.ipc.open_file(source)
+                self.assertEqual(reader.num_record_batches, 3)
+                table = reader.read_all()
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(table.column('gender').to_pylist(), ['Неизвестно'] * 5)
+        self.assertEqual(table.column('node').to_pylist(), [None] * 5)
+
+
+class ClinicalCaseIngestTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.location = Location.objects.create(name='Простата', short_name='ПЖ')
+        self.spec_location = SpecLocation.objects.create(location=self.location, name='Предстательная железа')
+        self.rt_type = RadiationTherapyType.objects.create(name='Фотонная')
+        self.stage = Stage.objects.create(name='II')
+        self.source = Source.objects.create(name='Публикация')
+        self.complication = Complication.objects.create(name='Цистит', spec_location=self.spec_location)
+        self.structure = ModelStructure.objects.create(
+            model_name=ModelName.objects.create(name='LKB'),
+            parameter=Parameter.objects.create(name='TD50'),
+        )
+        self.url = reverse('clinical-case-ingest')
+
+    def payload(self, count):
+        return [
+            {
+                'age': 60 + i,
+                'spec_location': self.spec_location.id,
+                'radiation_therapy_type': self.rt_type.id,
+                'stage': self.stage.id,
+                'datasets': [
+                    {
+                        'source': self.source.id,
+                        'results': [{'model_structure': self.structure.id, 'value': 70.0 + i}],
+                    },
+                    {'results': [{'model_structure': self.structure.id, 'value': 80.0 + i}]},
+                ],
+                'complications': [self.complication.id],
+            }
+            for i in range(count)
+        ]
+
+    def test_nested_ingest(self):
+        response = self.client.post(self.url, self.payload(2), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = response.data['created']
+        self.assertEqual(len(created), 2)
+
+        case = ClinicalCase.objects.get(pk=created[1]['id'])
+        self.assertEqual(case.age, 61)
+        self.assertIn('Стадия: II', case.rendered_text)
+        dataset_id = created[1]['datasets'][0]['id']
+        self.assertEqual(DataSet.objects.get(pk=dataset_id).clinical_case_id, case.id)
+        self.assertEqual(
+            sorted(Result.objects.filter(data_set_id=dataset_id).values_list('id', flat=True)),
+            created[1]['datasets'][0]['results'],
+        )
+        self.assertEqual(
+            ClinicalCaseComplication.objects.get(pk=created[1]['complications'][0]).clinical_case_id,
+            case.id,
+        )
+
+        # Сигналы не отправлялись, но производные данные обновлены
+        summary = ClinicalCaseSummary.objects.get(clinical_case=case)
+        self.assertEqual((summary.result_count, summary.complication_count), (2, 1))
+        statistic = ParameterStatistic.objects.get(model_structure=self.structure, location=self.location)
+        self.assertEqual(statistic.count, 4)
+        self.assertEqual(statistic.max_value, 81.0)
+
+        # Повторная загрузка добавляется к накопленной статистике группы
+        response = self.client.post(self.url, self.payload(2), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        statistic.refresh_from_db()
+        self.assertEqual(statistic.count, 8)
+        self.assertEqual(check_statistics(), [])
+
+    def test_query_count_does_not_grow(self):
+        counts = []
+        for size in (2, 20):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, self.payload(size), format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def natural_payload(self, **case):
+        return [dict({
+            'spec_location': 'Предстательная железа',
+            'radiation_therapy_type': 'Фотонная',
+            'stage': 'II',
+            'datasets': [{'results': [
+                {'model_structure': {'model_name': 'LKB', 'parameter': 'TD50'}, 'value': 70.0},
+            ]}],
+            'complications': ['Цистит'],
+        }, **case)]
+
+    def test_natural_keys(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, self.natural_payload() * 10, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # Каждый справочник — один запрос, независимо от числа случаев
+        lookups = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len([sql for sql in lookups if '"therapy_stage"' in sql.split('WHERE')[0]]), 1)
+        case = ClinicalCase.objects.get(pk=response.data['created'][0]['id'])
+        self.assertEqual(case.stage, self.stage)
+        self.assertEqual(case.spec_location, self.spec_location)
+        result = Result.objects.get(data_set__clinical_case=case)
+        self.assertEqual(result.model_structure, self.structure)
+        self.assertEqual(case.clinicalcasecomplication_set.get().complication, self.complication)
+
+        # id в виде строки по-прежнему означает id
+        response = self.client.post(self.url, self.natural_payload(stage=str(self.stage.id)), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_natural_key_errors_and_create_missing(self):
+        response = self.client.post(self.url, self.natural_payload(tumor='T2'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tumor', response.data[0])
+
+        Stage.objects.create(name='II')
+        response = self.client.post(self.url, self.natural_payload(), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('несколько', str(response.data[0]['stage'][0]))
+
+        # Неизвестные записи справочников создаются, если это разрешено;
+        # при ошибке проверки они откатываются вместе с остальным
+        payload = self.natural_payload(stage='IIB', tumor='T2') + self.natural_payload(spec_location='Нет такой')
+        response = self.client.post(self.url + '?create_missing=1', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Tumor.objects.filter(short_name='T2').exists())
+
+        response = self.client.post(self.url + '?create_missing=1', payload[:1], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        case = ClinicalCase.objects.get(pk=response.data['created'][0]['id'])
+        self.assertEqual((case.stage.name, case.tumor.short_name), ('IIB', 'T2'))
+
+    def test_natural_keys_in_single_create(self):
+        dataset = DataSet.objects.create(clinical_case=ClinicalCase.objects.create(
+            spec_location=self.spec_location, radiation_therapy_type=self.rt_type,
+        ))
+        response = self.client.post(reverse('result-list'), {
+            'data_set': dataset.id,
+            'model_structure': {'model_name': 'LKB', 'parameter': 'TD50'},
+            'value': 1.5,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['model_structure'], self.structure.id)
+
+        response = self.client.post(reverse('clinical-case-list'), {
+            'spec_location': 'Предстательная железа',
+            'radiation_therapy_type': 'Фотонная',
+            'stage': 'II',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['stage'], self.stage.id)
+
+    def test_invalid_payload_creates_nothing(self):
+        payload = self.payload(2)
+        payload[1]['stage'] = 999999
+        payload[1]['datasets'][0]['results'][0]['model_structure'] = 'x'
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('stage', response.data[1])
+        self.assertIn('model_structure', response.data[1]['datasets'][0]['results'][0])
+        self.assertFalse(ClinicalCase.objects.exists())
+
+        response = self.client.post(self.url, {'age': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Структура модели не повторяется внутри набора данных
+        payload = self.payload(1)
+        payload[0]['datasets'][0]['results'] *= 2
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('results', response.data[0]['datasets'][0])
+
+
+
+class ClinicalCaseImportTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.location = Location.objects.create(name='Простата', short_name='ПЖ')
+        self.spec_location = SpecLocation.objects.create(location=self.location, name='Предстательная железа')
+        self.rt_type = RadiationTherapyType.objects.create(name='Фотонная')
+        self.stage = Stage.objects.create(name='II')
+        self.source = Source.objects.create(name='Публикация')
+        self.complication = Complication.objects.create(name='Цистит', spec_location=self.spec_location)
+        self.structure = ModelStructure.objects.create(
+            model_name=ModelName.objects.create(name='LKB'),
+            parameter=Parameter.objects.create(name='TD50'),
+        )
+        self.url = reverse('clinical-case-import')
+
+    header = [
+        'case', 'age', 'gender', 'spec_location', 'radiation_therapy_type', 'stage',
+        'source', 'model_name', 'parameter', 'value', 'complications', 'comment',
+    ]
+
+    def rows(self):
+        return [
+            ['a', '61', 'Мужской', 'Предстательная железа', 'Фотонная', 'II',
+             self.source.id, 'LKB', 'TD50', '70,5', 'Цистит', 'x'],
+            ['a', '', '', '', '', '', '', 'LKB', 'TD50', '72', '', ''],
+            ['b', '70', '', self.spec_location.id, self.rt_type.id, '', '', '', '', '', '', ''],
+            ['c', 'старый', '', 'Предстательная железа', 'Фотонная', 'IV', '', 'LKB', 'TD5', '1', '', ''],
+        ]
+
+    def csv_file(self, rows, name='cases.csv'):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.header)
+        writer.writerows(rows)
+        upload = io.BytesIO(buffer.getvalue().encode('utf-8'))
+        upload.name = name
+        return upload
+
+    def test_csv_import(self):
+        rows = self.rows() + [
+            ['c', '', '', '', '', '', '', 'LKB', 'TD50', '2', '', ''],
+            # Повтор (случай, источник, структура): остаётся последнее значение
+            ['a', '', '', '', '', '', self.source.id, 'LKB', 'TD50', '71', '', ''],
+        ]
+        response = self.client.post(self.url, {'file': self.csv_file(rows)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        report = response.data
+        self.assertEqual((report['rows'], report['imported_rows']), (6, 4))
+        self.assertEqual(
+            (report['cases'], report['datasets'], report['results'], report['complications']),
+            (2, 2, 2, 1),
+        )
+        self.assertEqual(report['ignored_columns'], ['comment'])
+        # Ошибки по строкам и столбцам (заголовок — строка 1); строки
+        # отклонённого случая ссылаются на его первую строку
+        errors = {(error['row'], error['column']) for error in report['errors']}
+        self.assertEqual(errors, {(5, 'age'), (5, 'stage'), (5, 'parameter'), (6, 'case')})
+        self.assertIn('строке 5', report['errors'][-1]['error'])
+
+        # Поля случая берутся из первой строки
+        case = ClinicalCase.objects.get(age=61)
+        self.assertEqual((case.gender, case.stage, case.quantity), (1, self.stage, 1))
+        self.assertIn('Стадия: II', case.rendered_text)
+        results = Result.objects.filter(data_set__clinical_case=case).order_by('value')
+        self.assertEqual([result.value for result in results], [71.0, 72.0])
+        self.assertEqual([result.data_set.source for result in results], [self.source, None])
+        self.assertEqual(case.clinicalcasecomplication_set.get().complication, self.complication)
+        self.assertFalse(DataSet.objects.filter(clinical_case__age=70).exists())
+
+        # Производные данные обновлены без сигналов
+        summary = ClinicalCaseSummary.objects.get(clinical_case=case)
+        self.assertEqual((summary.result_count, summary.complication_count), (2, 1))
+        self.assertEqual(check_case_summaries(), [])
+        statistic = ParameterStatistic.objects.get(model_structure=self.structure, location=self.location)
+        self.assertEqual((statistic.count, statistic.max_value), (2, 72.0))
+
+        # Повторный импорт добавляется к накопленной статистике группы
+        response = self.client.post(self.url, {'file': self.csv_file(rows)}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        statistic.refresh_from_db()
+        self.assertEqual((statistic.count, statistic.max_value), (4, 72.0))
+        self.assertEqual(check_statistics(), [])
+
+    def test_xlsx_import_and_command(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(self.header)
+        sheet.append(['a', 61, None, 'Предстательная железа', 'Фотонная', 'IIB',
+                      self.source.id, 'LKB', 'TD50', 70.5, None, None])
+        upload = io.BytesIO()
+        workbook.save(upload)
+        upload.seek(0)
+        upload.name = 'cases.xlsx'
+
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['errors'][0]['column'], 'stage')
+
+        upload.seek(0)
+        response = self.client.post(
+            self.url + '?create_missing=1', {'file': upload}, format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ClinicalCase.objects.get().stage.name, 'IIB')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cases.csv')
+            with open(path, 'wb') as file:
+                file.write(self.csv_file(self.rows()).getvalue())
+            output = io.StringIO()
+            call_command('import_cases', path, stdout=output, stderr=io.StringIO())
+        self.assertIn('случаев: 2', output.getvalue())
+        self.assertEqual(ClinicalCase.objects.count(), 3)
+
+    def test_invalid_file(self):
+        upload = io.BytesIO(b'age\n1\n')
+        upload.name = 'cases.csv'
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('case', str(response.data['file']))
+
+        upload = io.BytesIO(b'case')
+        upload.name = 'cases.txt'
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('file_format', response.data)
+        self.assertFalse(ClinicalCase.objects.exists())
+
 class ResultViewSetTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpass')
@@ -285,6 +1057,12 @@ class DataSetViewSetTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
+    def test_case_text_single_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertIn('Диагноз: C00', response.data[0]['name_clinical_case'])
+
 class AggregatedMetricsViewTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpass')
@@ -329,7 +1107,9 @@ class AggregatedMetricsViewTest(APITestCase):
         
         dataset1 = DataSet.objects.create(clinical_case=self.case1, source=source)
         Result.objects.create(data_set=dataset1, model_structure=model_structure, value=10.0)
-        Result.objects.create(data_set=dataset1, model_structure=model_structure, value=20.0)
+        # Повторное измерение той же структуры — отдельный набор данных
+        repeated = DataSet.objects.create(clinical_case=self.case1, source=source)
+        Result.objects.create(data_set=repeated, model_structure=model_structure, value=20.0)
         
         dataset2 = DataSet.objects.create(clinical_case=self.case2, source=source)
         Result.objects.create(data_set=dataset2, model_structure=model_structure, value=15.0)
@@ -371,3 +1151,603 @@ class AggregatedMetricsViewTest(APITestCase):
         self.assertEqual(param_data['max_meta']['treatment_duration'], 45)
         self.assertEqual(param_data['max_meta']['clinical_case_id'], self.case1.id)
 
+
+    def test_aggregation_groups_and_exclusions(self):
+        unit = Unit.objects.create(name='%')
+        parameter = Parameter.objects.create(name='NTCP', unit=unit)
+        model_structure = ModelStructure.objects.create(
+            model_name=ModelName.objects.get(name='NTCP Model'), parameter=parameter
+        )
+        dataset = DataSet.objects.filter(clinical_case=self.case2).first()
+        Result.objects.create(data_set=dataset, model_structure=model_structure, value=5.0)
+        Result.objects.create(
+            data_set=DataSet.objects.create(clinical_case=self.case2),
+            model_structure=model_structure,
+            value=None,
+        )
+
+        other_case = ClinicalCase.objects.create(
+            spec_location=self.case1.spec_location,
+            radiation_therapy_type=self.case1.radiation_therapy_type,
+        )
+        other_dataset = DataSet.objects.create(clinical_case=other_case)
+        Result.objects.create(data_set=other_dataset, model_structure=model_structure, value=100.0)
+
+        response = self.client.post(self.url, {
+            "clinical_case_ids": [self.case1.id, self.case2.id]
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['result_count'], 4)
+        by_parameter = {p['parameter']: p for p in response.data['aggregated_parameters']}
+        self.assertEqual(set(by_parameter), {'Dose', 'NTCP'})
+        ntcp = by_parameter['NTCP']
+        self.assertEqual(ntcp['count'], 1)
+        self.assertEqual(ntcp['unit'], '%')
+        self.assertEqual(ntcp['max_value'], 5.0)
+        self.assertEqual(ntcp['min_meta']['clinical_case_id'], self.case2.id)
+        self.assertEqual(ntcp['max_meta']['treatment_duration'], 35)
+
+    def test_aggregation_empty_cohort(self):
+        response = self.client.post(self.url, {"clinical_case_ids": []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['clinical_case_count'], 0)
+        self.assertEqual(response.data['aggregated_parameters'], [])
+
+    def test_aggregation_by_filters(self):
+        response = self.client.post(self.url, {
+            "filters": {"gender": [2], "location": str(self.case1.spec_location.location_id)}
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['clinical_case_count'], 1)
+        self.assertEqual(response.data['result_count'], 1)
+        param_data = response.data['aggregated_parameters'][0]
+        self.assertEqual(param_data['average'], 15.0)
+        self.assertEqual(param_data['min_meta']['clinical_case_id'], self.case2.id)
+
+    def test_aggregation_by_filters_and_ids(self):
+        response = self.client.post(self.url, {
+            "filters": {"source": [Source.objects.get().id]},
+            "clinical_case_ids": [self.case1.id],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['clinical_case_count'], 1)
+        self.assertEqual(response.data['result_count'], 2)
+
+    def test_aggregation_by_range_filters(self):
+        response = self.client.post(self.url, {
+            "filters": {"age__gte": 50, "or": ["gender:1|number_of_fractions__lte:25"]}
+        }, format='json')
+        self.assertEqual(response.data['clinical_case_count'], 1)
+        self.assertEqual(response.data['result_count'], 1)
+
+    def test_aggregation_unknown_filter(self):
+        response = self.client.post(self.url, {"filters": {"colour": "red"}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_aggregation_cache_hit_and_invalidation(self):
+        stats_url = reverse('aggregate-metrics-cache-stats')
+        # Статистика кэша — только для администраторов
+        self.assertEqual(self.client.get(stats_url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(stats_url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_authenticate(user=self.user)
+        before = self.client.get(stats_url).data
+
+        data = {"clinical_case_ids": [self.case2.id, self.case1.id]}
+        first = self.client.post(self.url, data, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.post(self.url, {
+                "clinical_case_ids": [self.case1.id, self.case2.id, self.case1.id]
+            }, format='json')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(len(queries.captured_queries), 0)
+
+        after = self.client.get(stats_url).data
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        # Счётчики лежат в общем для процессов кэше, а не в памяти процесса
+        versions = caches[aggregation.VERSIONS_CACHE_ALIAS]
+        self.assertEqual(versions.get(aggregation.HITS_KEY), after['hits'])
+
+        # Новый результат в когорте сбрасывает кэш после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            Result.objects.create(
+                data_set=DataSet.objects.create(clinical_case=self.case2),
+                model_structure=ModelStructure.objects.get(),
+                value=40.0,
+            )
+            uncommitted = self.client.post(self.url, data, format='json')
+        self.assertEqual(uncommitted.data, first.data)
+        third = self.client.post(self.url, data, format='json')
+        self.assertEqual(third.data['result_count'], 4)
+
+    def test_aggregation_from_statistics_matches_results(self):
+        location_id = self.case1.spec_location.location_id
+        by_ids = self.client.post(self.url, {
+            "clinical_case_ids": [self.case1.id, self.case2.id]
+        }, format='json')
+
+        with CaptureQueriesContext(connection) as queries:
+            registry = self.client.post(self.url, {"filters": {}}, format='json')
+        self.assertFalse(any('"therapy_result"' in q['sql'] and 'GROUP BY' in q['sql']
+                             for q in queries.captured_queries))
+        by_location = self.client.post(self.url, {
+            "filters": {"location": [location_id]}
+        }, format='json')
+
+        self.assertEqual(registry.data, by_ids.data)
+        self.assertEqual(by_location.data, by_ids.data)
+
+        other_location = self.client.post(self.url, {
+            "filters": {"location": [location_id + 1000]}
+        }, format='json')
+        self.assertEqual(other_location.data['result_count'], 0)
+
+    def test_aggregation_stats(self):
+        ClinicalCase.objects.filter(id=self.case1.id).update(quantity=10)
+        ClinicalCase.objects.filter(id=self.case2.id).update(quantity=30)
+        Result.objects.filter(value=15.0).update(lower_value=12.0, upper_value=18.0)
+        response = self.client.post(self.url, {
+            "clinical_case_ids": [self.case1.id, self.case2.id],
+            "stats": "all",
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        param = response.data['aggregated_parameters'][0]
+        self.assertEqual(param['average'], 15.0)
+        self.assertEqual(param['median'], 15.0)
+        self.assertEqual(param['q1'], 12.5)
+        self.assertEqual(param['q3'], 17.5)
+        self.assertEqual(param['iqr'], 5.0)
+        self.assertEqual(param['std'], 5.0)
+        margin = 1.959963984540054 * 5.0 / 3 ** 0.5
+        self.assertEqual(param['ci95'], [round(15.0 - margin, 2), round(15.0 + margin, 2)])
+        self.assertEqual(param['lower_mean'], 12.0)
+        self.assertEqual(param['upper_mean'], 18.0)
+
+    def test_aggregation_weighted_mean(self):
+        # Веса неравные, и взвешенное среднее отличается от обычного
+        ClinicalCase.objects.filter(id=self.case1.id).update(quantity=10)
+        ClinicalCase.objects.filter(id=self.case2.id).update(quantity=30)
+        Result.objects.filter(value=20.0).update(value=26.0)
+        response = self.client.post(self.url, {
+            "clinical_case_ids": [self.case1.id, self.case2.id],
+            "stats": "weighted_mean",
+        }, format='json')
+
+        param = response.data['aggregated_parameters'][0]
+        self.assertEqual(param['average'], 17.0)
+        # (10 + 26) * 10 + 15 * 30 = 810 при суммарном весе 50
+        self.assertEqual(param['weighted_mean'], 16.2)
+
+        # Случай с нулевым количеством не входит во взвешенное среднее
+        # (фильтр меняет ключ кэша: update() не сбрасывает агрегаты)
+        ClinicalCase.objects.filter(id=self.case2.id).update(quantity=0)
+        response = self.client.post(self.url, {
+            "clinical_case_ids": [self.case1.id, self.case2.id],
+            "filters": {},
+            "stats": "weighted_mean",
+        }, format='json')
+        self.assertEqual(response.data['aggregated_parameters'][0]['weighted_mean'], 18.0)
+
+    def test_aggregation_stats_selection(self):
+        response = self.client.post(
+            self.url + "?stats=median,std",
+            {"filters": {}},
+            format='json',
+        )
+        param = response.data['aggregated_parameters'][0]
+        self.assertEqual(param['median'], 15.0)
+        self.assertEqual(param['std'], 5.0)
+        self.assertNotIn('iqr', param)
+
+        # Без stats в кэше не должен оказаться ответ со статистиками
+        response = self.client.post(self.url, {"filters": {}}, format='json')
+        self.assertNotIn('median', response.data['aggregated_parameters'][0])
+
+        response = self.client.post(self.url, {"filters": {}, "stats": ["mode"]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TypeaheadViewSetTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        Diagnosis.objects.bulk_create([
+            Diagnosis(code='C61', description='Злокачественное новообразование предстательной железы'),
+            Diagnosis(code='C62', description='Злокачественное новообразование яичка'),
+            Diagnosis(code='C50.1', description='Злокачественное новообразование молочной железы'),
+        ])
+        Histology.objects.bulk_create([
+            Histology(name='Аденокарцинома'),
+            Histology(name='Карцинома in situ'),
+            Histology(name='Плоскоклеточная карцинома'),
+            Histology(name='Саркома'),
+        ])
+
+    def _typeahead(self, dictionary, **params):
+        response = self.client.get(reverse('typeahead-detail', args=[dictionary]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_icd_code_prefix(self):
+        data = self._typeahead('diagnosis', q='c6')
+        self.assertEqual([label.split()[0] for _, label in data], ['C61', 'C62'])
+        pk, label = data[0]
+        self.assertEqual(pk, Diagnosis.objects.get(code='C61').pk)
+        self.assertEqual(label, 'C61 Злокачественное новообразование предстательной железы')
+        self.assertEqual(len(self._typeahead('diagnosis', q='C50.')), 1)
+
+    def test_ranked_names_and_limit(self):
+        data = self._typeahead('histology', q='карцин')
+        labels = [label for _, label in data]
+        # Совпадение с начала названия идёт первым
+        self.assertEqual(labels[0], 'Карцинома in situ')
+        self.assertEqual(set(labels), {'Аденокарцинома', 'Карцинома in situ', 'Плоскоклеточная карцинома'})
+        self.assertEqual(len(self._typeahead('histology', q='карцин', limit=1)), 1)
+        self.assertEqual(self._typeahead('diagnosis', q='яичк')[0][1].split()[0], 'C62')
+
+    def test_trigram_fuzzy_match(self):
+        if not trigram_available():
+            self.skipTest('pg_trgm не установлен')
+        # Опечатка находится только нечётким сравнением
+        labels = [label for _, label in self._typeahead('histology', q='аденакарцинома')]
+        self.assertEqual(labels[0], 'Аденокарцинома')
+
+    def test_empty_and_invalid_requests(self):
+        self.assertEqual(self._typeahead('histology', q=' '), [])
+        response = self.client.get(reverse('typeahead-detail', args=['patients']), {'q': 'a'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('typeahead-detail', args=['histology']), {'q': 'a', 'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+
+class BulkUpsertTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.location = Location.objects.create(name='Простата')
+        self.other_location = Location.objects.create(name='Прямая кишка')
+        self.spec_location = SpecLocation.objects.create(location=self.location, name='Предстательная железа')
+        self.diagnosis = Diagnosis.objects.create(code='C61', description='Старое описание')
+        self.case = ClinicalCase.objects.create(
+            spec_location=self.spec_location,
+            radiation_therapy_type=RadiationTherapyType.objects.create(name='Фотонная'),
+            diagnosis=self.diagnosis,
+        )
+        self.dataset = DataSet.objects.create(clinical_case=self.case)
+        self.structure = ModelStructure.objects.create(
+            model_name=ModelName.objects.create(name='LKB'),
+            parameter=Parameter.objects.create(name='TD50'),
+        )
+        self.result = Result.objects.create(data_set=self.dataset, model_structure=self.structure, value=1.0)
+
+    def test_dictionary_upsert(self):
+        url = reverse('diagnosis-upsert')
+        payload = [
+            {'code': 'C61', 'description': 'Рак предстательной железы'},
+            {'code': 'C62', 'description': 'Рак яичка'},
+            {'code': 'C62', 'description': 'Новообразование яичка'},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'upserted': 2})
+        # Существующие строки не читаются перед записью
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "therapy_diagnosis"' in q['sql']])
+
+        self.assertEqual(Diagnosis.objects.get(pk=self.diagnosis.pk).description, 'Рак предстательной железы')
+        self.assertEqual(Diagnosis.objects.get(code='C62').description, 'Новообразование яичка')
+        # Сигналы не отправлялись, но подписи в сводке случая обновлены
+        self.assertIn('Рак предстательной железы', ClinicalCaseSummary.objects.get(clinical_case=self.case).text_diagnosis)
+        self.assertEqual(check_case_summaries(), [])
+
+        # Повторная загрузка ничего не дублирует
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Diagnosis.objects.count(), 2)
+
+        response = self.client.post(url, [{'description': 'Без кода'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('code', response.data[0])
+
+    def test_key_only_and_related_upsert(self):
+        Tumor.objects.create(short_name='T1', name='Опухоль T1')
+        response = self.client.post(reverse('tumor-upsert'), [{'short_name': 'T1'}, {'short_name': 'T2'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Tumor.objects.get(short_name='T1').name, 'Опухоль T1')
+        self.assertTrue(Tumor.objects.filter(short_name='T2').exists())
+
+        # Смена локализации переносит результаты в другую группу статистики
+        response = self.client.post(reverse('spec-location-upsert'), [
+            {'name': 'Предстательная железа', 'location': 'Прямая кишка'},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(SpecLocation.objects.get().location, self.other_location)
+        self.assertEqual(
+            list(ParameterStatistic.objects.values_list('location', 'count')), [(self.other_location.id, 1)]
+        )
+
+    def test_versions_change_after_commit(self):
+        version = dictionaries.dictionary_version()
+        generation = aggregation._generation()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('tumor-upsert'), [{'short_name': 'T3'}], format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post(reverse('spec-location-upsert'), [
+                {'name': 'Предстательная железа', 'location': 'Прямая кишка'},
+            ], format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # До фиксации транзакции версии прежние
+            self.assertEqual(dictionaries.dictionary_version(), version)
+            self.assertEqual(aggregation._generation(), generation)
+        self.assertNotEqual(dictionaries.dictionary_version(), version)
+        self.assertNotEqual(aggregation._generation(), generation)
+
+    def test_result_upsert(self):
+        other_dataset = DataSet.objects.create(clinical_case=self.case)
+        response = self.client.post(reverse('result-upsert'), [
+            {'data_set': self.dataset.id, 'model_structure': self.structure.id, 'value': 3.0},
+            {'data_set': other_dataset.id, 'model_structure': {'model_name': 'LKB', 'parameter': 'TD50'},
+             'value': 5.0},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'upserted': 2})
+        self.result.refresh_from_db()
+        self.assertEqual(self.result.value, 3.0)
+        self.assertEqual(Result.objects.count(), 2)
+
+        statistic = ParameterStatistic.objects.get(model_structure=self.structure)
+        self.assertEqual((statistic.count, statistic.sum, statistic.max_value), (2, 8.0, 5.0))
+        self.assertEqual(ClinicalCaseSummary.objects.get(clinical_case=self.case).result_count, 2)
+        self.assertEqual(check_statistics(), [])
+
+        # Только новые результаты: группа не пересчитывается, а дополняется.
+        # Существующий результат (набор 1, структура 1) не входит в ключи,
+        # но попадает в выборку по наборам и структурам
+        third_dataset = DataSet.objects.create(clinical_case=self.case)
+        other_structure = ModelStructure.objects.create(
+            model_name=self.structure.model_name, parameter=Parameter.objects.create(name='n'),
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('result-upsert'), [
+                {'data_set': third_dataset.id, 'model_structure': self.structure.id, 'value': 0.5},
+                {'data_set': self.dataset.id, 'model_structure': other_structure.id, 'value': 0.1},
+            ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([
+            q for q in queries.captured_queries
+            if q['sql'].startswith('DELETE FROM "therapy_parameterstatistic"')
+        ])
+        # Вставка или обновление определяется самой записью, без чтения результатов до неё
+        sql = [q['sql'] for q in queries.captured_queries]
+        insert = next(i for i, q in enumerate(sql) if q.lstrip().startswith('INSERT INTO "therapy_result"'))
+        self.assertFalse([q for q in sql[:insert] if 'FROM "therapy_result"' in q])
+        statistic.refresh_from_db()
+        self.assertEqual((statistic.count, statistic.min_value), (3, 0.5))
+        self.assertEqual(check_statistics(), [])
+
+        response = self.client.post(reverse('result-upsert'), [
+            {'model_structure': self.structure.id, 'value': 3.0},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('data_set', response.data[0])
+
+        # Обычное создание повторного результата отклоняется проверкой
+        response = self.client.post(reverse('result-list'), {
+            'data_set': self.dataset.id, 'model_structure': self.structure.id, 'value': 4.0,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkEditTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.location = Location.objects.create(name='Простата')
+        self.spec_location = SpecLocation.objects.create(location=self.location, name='Предстательная железа')
+        self.other_spec_location = SpecLocation.objects.create(
+            location=Location.objects.create(name='Прямая кишка'), name='Прямая кишка'
+        )
+        self.photon = RadiationTherapyType.objects.create(name='Фотонная')
+        self.proton = RadiationTherapyType.objects.create(name='Протонная')
+        self.source = Source.objects.create(name='Отозванная публикация')
+        self.other_source = Source.objects.create(name='Публикация')
+        self.structure = ModelStructure.objects.create(
+            model_name=ModelName.objects.create(name='LKB'),
+            parameter=Parameter.objects.create(name='TD50'),
+        )
+        self.cases = []
+        for index, source in enumerate([self.source, self.source, self.other_source]):
+            case = ClinicalCase.objects.create(
+                age=60 + index,
+                spec_location=self.spec_location,
+                radiation_therapy_type=self.photon,
+            )
+            dataset = DataSet.objects.create(clinical_case=case, source=source)
+            Result.objects.create(data_set=dataset, model_structure=self.structure, value=10.0 + index)
+            self.cases.append(case)
+        self.url = reverse('clinical-case-bulk')
+
+    def test_case_bulk_update_by_filter(self):
+        response = self.client.patch(
+            f'{self.url}?source={self.source.id}',
+            {'values': {'radiation_therapy_type': 'Протонная', 'spec_location': self.other_spec_location.id}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'updated': 2})
+        self.assertEqual(
+            list(ClinicalCase.objects.order_by('id').values_list('radiation_therapy_type', flat=True)),
+            [self.proton.id, self.proton.id, self.photon.id],
+        )
+        # Сигналы не отправлялись: текст, сводки и статистика обновлены явно
+        self.assertIn('Протонная', ClinicalCase.objects.get(pk=self.cases[0].pk).rendered_text)
+        self.assertEqual(check_case_summaries(), [])
+        self.assertEqual(check_statistics(), [])
+        self.assertEqual(
+            ParameterStatistic.objects.get(location=self.other_spec_location.location).count, 2
+        )
+
+    def test_case_bulk_update_validates_patched_fields(self):
+        ids = [self.cases[0].id]
+        response = self.client.patch(self.url, {'ids': ids, 'values': {'age': 'много'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('age', response.data)
+
+        response = self.client.patch(self.url, {'ids': ids, 'values': {'result_count': 5}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('result_count', response.data)
+
+        response = self.client.patch(self.url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('values', response.data)
+
+        # Без ids и фильтра изменение всей таблицы не выполняется
+        response = self.client.patch(self.url, {'values': {'age': 70}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ids', response.data)
+
+        # Обязательные поля, которых нет в values, не проверяются
+        response = self.client.patch(self.url, {'ids': ids, 'values': {'age': 70}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ClinicalCase.objects.get(pk=ids[0]).age, 70)
+
+    def test_case_bulk_delete(self):
+        complication = Complication.objects.create(name='Ректит')
+        for case in self.cases:
+            ClinicalCaseComplication.objects.create(clinical_case=case, complication=complication)
+        # Статистика ссылается на удаляемые результаты (min_result, max_result)
+        statistic = ParameterStatistic.objects.get()
+        self.assertEqual(statistic.min_result.data_set.clinical_case_id, self.cases[0].id)
+        ids = [self.cases[0].id, self.cases[1].id]
+        response = self.client.delete(self.url, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data, {'deleted': 2, 'datasets': 2, 'results': 2, 'complications': 2}
+        )
+        self.assertEqual(list(ClinicalCase.objects.values_list('id', flat=True)), [self.cases[2].id])
+        self.assertEqual(DataSet.objects.count(), 1)
+        self.assertEqual(ClinicalCaseComplication.objects.count(), 1)
+        self.assertEqual(
+            list(ClinicalCaseSummary.objects.values_list('clinical_case', flat=True)), [self.cases[2].id]
+        )
+        # Отложенные проверки внешних ключей: ни в одной зависимой таблице
+        # не осталось ссылок на удалённые строки
+        connection.check_constraints()
+        self.assertEqual(check_case_summaries(), [])
+        self.assertEqual(check_statistics(), [])
+
+        response = self.client.delete(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_result_bulk_update_and_delete(self):
+        url = reverse('result-bulk')
+        response = self.client.patch(
+            f'{url}?clinical_case={self.cases[0].id}', {'values': {'value': 30.0}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'updated': 1})
+        self.assertEqual(ParameterStatistic.objects.get().max_value, 30.0)
+        self.assertEqual(check_statistics(), [])
+
+        # Второй результат той же структуры в наборе данных нарушает уникальность
+        dataset = DataSet.objects.get(clinical_case=self.cases[0])
+        response = self.client.patch(
+            url, {'ids': list(Result.objects.values_list('id', flat=True)), 'values': {'data_set': dataset.id}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Result.objects.filter(data_set=dataset).count(), 1)
+
+        # Набор данных сбрасывается в null: результат выпадает из счётчиков
+        # и статистики случая
+        result = Result.objects.get(data_set__clinical_case=self.cases[0])
+        response = self.client.patch(
+            url, {'ids': [result.id], 'values': {'data_set': None}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ClinicalCaseSummary.objects.get(clinical_case=self.cases[0]).result_count, 0)
+        self.assertEqual(ParameterStatistic.objects.get().count, 2)
+        self.assertEqual(check_case_summaries(), [])
+        self.assertEqual(check_statistics(), [])
+
+        response = self.client.delete(f'{url}?model_structure={self.structure.id}', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'deleted': 3})
+        self.assertFalse(Result.objects.exists())
+        self.assertFalse(ParameterStatistic.objects.exists())
+        self.assertEqual(check_case_summaries(), [])
+
+class ReferenceBundleViewSetTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('reference-bundle-list')
+        self.stage = Stage.objects.create(name='I')
+        Stage.objects.create(name='II')
+        location = Location.objects.create(name='Простата', short_name='ПЖ')
+        SpecLocation.objects.create(name='Предстательная железа', location=location)
+
+    def test_compact_bundle(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['ETag'])
+        dictionaries = json.loads(response.content)['dictionaries']
+        stages = dictionaries['stage']
+        self.assertEqual(stages['fields'], ['id', 'name', 'note'])
+        self.assertEqual([row[1] for row in stages['rows']], ['I', 'II'])
+        self.assertNotIn('created_at', dictionaries['location']['fields'])
+        self.assertIn('location_id', dictionaries['spec-location']['fields'])
+        self.assertEqual(dictionaries['grade']['rows'], [])
+        self.assertIn('unit_id', dictionaries['parameter']['fields'])
+        self.assertIn('model_type', dictionaries['model-name']['fields'])
+        # Диагнозы и осложнения ищутся через typeahead
+        self.assertNotIn('diagnosis', dictionaries)
+        self.assertNotIn('complication', dictionaries)
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(response.content, b'')
+
+        # Изменение справочника меняет версию и ETag после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stage.name = 'IA'
+            self.stage.save()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        rows = json.loads(response.content)['dictionaries']['stage']['rows']
+        self.assertEqual(rows[0][1], 'IA')
+
+    def test_etag_shared_between_processes(self):
+        first = self.client.get(self.url)
+        version = caches[dictionaries.VERSIONS_CACHE_ALIAS].get(dictionaries.VERSION_KEY)
+        self.assertEqual(first['ETag'], dictionaries.bundle_etag(version))
+        # Другой процесс: своя память справочников, общая версия
+        with mock.patch.dict(dictionaries._store, {'version': None, 'entries': {}, 'bundle': None}):
+            other = self.client.get(self.url)
+            self.assertEqual(other['ETag'], first['ETag'])
+            with self.captureOnCommitCallbacks(execute=True):
+                self.stage.name = 'IB'
+                self.stage.save()
+            changed = self.client.get(self.url)
+
+        # Процесс, в памяти которого старые справочники, не отвечает 304
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'], changed['ETag'])
+        rows = json.loads(response.content)['dictionaries']['stage']['rows']
+        self.assertEqual(rows[0][1], 'IB')
@@ -0,0 +1,76 @@
+import re
+from functools import lru_cache
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest, Length
+
+from .models import Complication, Diagnosis, Histology, SpecLocation
+
+
+# Словари автодополнения: имя в URL -> (модель, поля поиска, поля подписи)
+TYPEAHEAD_DICTIONARIES = {
+    "diagnosis": (Diagnosis, ("description",), ("code", "description")),
+    "spec-location": (SpecLocation, ("name",), ("name",)),
+    "histology": (Histology, ("name",), ("name",)),
+    "complication": (Complication, ("name", "alt_name"), ("name",)),
+}
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# Начало кода МКБ-10: буква, до двух цифр и необязательная часть после точки
+ICD_CODE_PATTERN = re.compile(r"^[A-Za-z]\d{0,2}(\.\d*)?$")
+
+
+@lru_cache(maxsize=None)
+def trigram_available():
+    """Установлено ли расширение pg_trgm (проверяется один раз на процесс)."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def _any(fields, lookup, term):
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f"{field}__{lookup}": term})
+    return condition
+
+
+def _ranked(queryset, fields, term):
+    # Сначала совпадения с начала строки, затем по похожести и длине подписи
+    prefix_rank = Case(
+        When(_any(fields, "istartswith", term), then=Value(0)),
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+    if trigram_available():
+        # Оператор %> использует GIN-индексы gin_trgm_ops (миграция 0018)
+        similarities = [TrigramWordSimilarity(term, field) for field in fields]
+        similarity = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+        return (
+            queryset.filter(_any(fields, "trigram_word_similar", term))
+            .annotate(prefix_rank=prefix_rank, similarity=similarity)
+            .order_by("prefix_rank", "-similarity", Length(fields[0]), fields[0])
+        )
+    # Без pg_trgm: подстрока без учёта регистра
+    return (
+        queryset.filter(_any(fields, "icontains", term))
+        .annotate(prefix_rank=prefix_rank)
+        .order_by("prefix_rank", Length(fields[0]), fields[0])
+    )
+
+
+def typeahead(dictionary, term, limit=DEFAULT_LIMIT):
+    """Подсказки словаря в виде [[id, подпись], ...] не длиннее limit."""
+    model, search_fields, label_fields = TYPEAHEAD_DICTIONARIES[dictionary]
+    queryset = model.objects.all()
+    if dictionary == "diagnosis" and ICD_CODE_PATTERN.match(term):
+        # C6 -> C61, C62...: префиксный поиск по индексу UPPER(code)
+        queryset = queryset.filter(code__istartswith=term).order_by("code")
+    else:
+        queryset = _ranked(queryset, search_fields, term)
+    rows = queryset.values_list("id", *label_fields)[:limit]
+    return [[pk, " ".join(str(part) for part in parts if part)] for pk, *parts in rows]
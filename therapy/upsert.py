@@ -0,0 +1,133 @@
+from django.db import connection, transaction
+
+from . import parameter_statistics
+from .aggregation import invalidate_aggregations
+from .case_summary import refresh_case_counts, refresh_case_summaries
+from .dictionaries import DICTIONARY_MODELS, bump_dictionary_version
+from .models import ClinicalCase, DataSet, Result, SpecLocation
+from .natural_keys import UPSERT_KEYS
+from .signals import AGGREGATION_DEPENDENCIES, SUMMARY_DICTIONARIES
+
+
+BATCH_SIZE = 1000
+
+
+def _key(model, item):
+    return tuple(
+        getattr(item[name], "pk", item[name]) for name in UPSERT_KEYS[model]
+    )
+
+
+def _spec_location_groups(names):
+    return parameter_statistics.result_groups(
+        Result.objects.filter(data_set__clinical_case__spec_location__name__in=names)
+    )
+
+
+def _write_batch(model, objects, unique_fields, update_fields):
+    """
+    Один INSERT ... ON CONFLICT по unique_fields. Возвращает {id: True для
+    вставленной строки, False для обновлённой}: признак берётся из самой
+    записи (xmax = 0 у новой версии строки только при вставке). Без
+    update_fields конфликтующие строки не меняются и не возвращаются.
+    """
+    meta = model._meta
+    quote = connection.ops.quote_name
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    conflict = ", ".join(quote(meta.get_field(name).column) for name in unique_fields)
+    if update_fields:
+        columns = [quote(meta.get_field(name).column) for name in update_fields]
+        action = "DO UPDATE SET " + ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+    else:
+        action = "DO NOTHING"
+    row = "(" + ", ".join(["%s"] * len(fields)) + ")"
+    params = [
+        field.get_db_prep_save(field.pre_save(obj, True), connection)
+        for obj in objects
+        for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {quote(meta.db_table)} ({', '.join(quote(field.column) for field in fields)})
+            VALUES {', '.join([row] * len(objects))}
+            ON CONFLICT ({conflict}) {action}
+            RETURNING {quote(meta.pk.column)}, (xmax = 0)
+            """,
+            params,
+        )
+        return dict(cursor.fetchall())
+
+
+def _refresh_derived(model, keys, previous_groups, updated_groups):
+    # Запись в обход ORM не отправляет сигналы: то, что делают обработчики
+    # в therapy.signals, выполняется здесь по набору ключей
+    if model in DICTIONARY_MODELS:
+        # Версия меняется в transaction.on_commit, после фиксации записи
+        bump_dictionary_version()
+    if model in SUMMARY_DICTIONARIES:
+        (field,) = UPSERT_KEYS[model]
+        lookup = f"{SUMMARY_DICTIONARIES[model]}__{field}__in"
+        refresh_case_summaries(
+            ClinicalCase.objects.filter(**{lookup: [key for key, in keys]})
+            .values_list("pk", flat=True)
+        )
+    if model is SpecLocation:
+        current_groups = _spec_location_groups([key for key, in keys])
+        parameter_statistics.refresh_statistics(previous_groups | current_groups)
+    if model is Result:
+        # Вставленные результаты уже добавлены к статистике по порциям;
+        # у обновлённых могло измениться значение, их группы пересчитываются
+        parameter_statistics.refresh_statistics(updated_groups)
+        refresh_case_counts(
+            DataSet.objects.filter(pk__in={data_set_id for data_set_id, _ in keys})
+            .values_list("clinical_case_id", flat=True)
+        )
+
+
+def upsert(model, items):
+    """
+    Вставляет или обновляет строки model по уникальному ключу
+    UPSERT_KEYS[model] запросами INSERT ... ON CONFLICT DO UPDATE, без
+    чтения существующих строк. items — словари validated_data; обновляются
+    только переданные поля. Повторы ключа схлопываются (побеждает
+    последний). Возвращает число обработанных строк.
+    """
+    unique_fields = list(UPSERT_KEYS[model])
+    latest = {}
+    for item in items:
+        latest[_key(model, item)] = item
+
+    # Элементы с одинаковым набором полей — одним запросом
+    batches = {}
+    for item in latest.values():
+        batches.setdefault(tuple(sorted(item)), []).append(model(**item))
+
+    with transaction.atomic():
+        previous_groups = set()
+        if model is SpecLocation:
+            # Смена локализации переносит результаты в другие группы
+            # статистики; прежние группы после записи уже не найти
+            previous_groups = _spec_location_groups([key for key, in latest])
+        updated_groups = set()
+        for fields, objects in batches.items():
+            update_fields = [name for name in fields if name not in unique_fields]
+            for start in range(0, len(objects), BATCH_SIZE):
+                written = _write_batch(
+                    model, objects[start:start + BATCH_SIZE], unique_fields, update_fields
+                )
+                if model is not Result:
+                    continue
+                inserted = [pk for pk, is_inserted in written.items() if is_inserted]
+                updated = [pk for pk, is_inserted in written.items() if not is_inserted]
+                parameter_statistics.merge_statistics(Result.objects.filter(pk__in=inserted))
+                if updated and "value" in update_fields:
+                    updated_groups |= parameter_statistics.result_groups(
+                        Result.objects.filter(pk__in=updated)
+                    )
+        _refresh_derived(model, list(latest), previous_groups, updated_groups)
+        # Поколение агрегатов тоже меняется только после фиксации
+        # (transaction.on_commit), в том числе внешней транзакции
+        if model in AGGREGATION_DEPENDENCIES:
+            invalidate_aggregations()
+    return len(latest)
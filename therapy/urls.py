@@ -45,6 +45,8 @@ router.register(
 router.register(
     prefix="aggregate-metrics", viewset=views.AggregatedMetricsView, basename="aggregate-metrics"
 )
+router.register(prefix="typeahead", viewset=views.TypeaheadViewSet, basename="typeahead")
+router.register(prefix="reference-bundle", viewset=views.ReferenceBundleViewSet, basename="reference-bundle")
 
 urlpatterns = [
     path("", include(router.urls)),
@@ -1,7 +1,11 @@
+import tempfile
+
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.decorators import action
+from rest_framework.validators import UniqueValidator
 from .models import (
     Location,
     SpecLocation,
@@ -24,9 +28,13 @@ from .models import (
     Node,
     Metastasis,
     ClinicalCaseComplication,
+    ParameterStatistic,
 )
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
 from django.http import JsonResponse
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from .serializers import (
     LocationSerializer,
@@ -50,20 +58,149 @@ from .serializers import (
     NodeSerializer,
     MetastasisSerializer,
     ClinicalCaseComplicationSerializer,
+    IngestClinicalCaseSerializer,
+    BulkEditSerializer,
+    load_related_objects,
 )
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.parsers import JSONParser
+from rest_framework.parsers import JSONParser, MultiPartParser
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, viewsets, permissions, filters
 
 from django.db.models import Count
-from collections import defaultdict
 from rest_framework.views import APIView
+from .pagination import KeysetPagination
+from .search import FullTextSearchFilter
+from .case_summary import refresh_case_summaries
+from .ingest import ingest_cases
+from .natural_keys import UPSERT_KEYS
+from .upsert import upsert
+from . import bulk_edit
+from .bulk_import import IMPORT_FORMATS, ImportFileError, import_rows, read_rows
+from .dictionaries import bundle_etag, dictionary_version, reference_bundle
+from .typeahead import DEFAULT_LIMIT, MAX_LIMIT, TYPEAHEAD_DICTIONARIES, typeahead
+from .aggregation import (
+    aggregate_results,
+    aggregate_statistics,
+    aggregation_cache_stats,
+    cached_aggregation,
+    cohort_results,
+    invalidate_aggregations,
+)
+from .analysis_table import ANALYSIS_FORMATS, write_analysis_table
+from .export import EXPORT_FORMATS, iterate_rows, stream_csv, stream_ndjson
+from .stats_engine import attach_statistics, parse_stats
+from .filters import (
+    ClinicalCaseFilterSet,
+    filter_clinical_cases,
+    split_values,
+    validate_filter_spec,
+)
 
 # from .permissions import NotBobPermission
 
 
-class RadiationTherapyTypeViewSet(viewsets.ModelViewSet):
+class BulkSerializerMixin:
+
+    def get_bulk_serializer(self, serializer_class, data):
+        # Справочники всех элементов загружаются заранее, по запросу на таблицу.
+        # Связи можно указывать id или естественным ключом; ?create_missing=1
+        # дополняет справочники неизвестными значениями
+        context = self.get_serializer_context()
+        create_missing = self.request.query_params.get("create_missing") in ("1", "true")
+        context["related_objects"] = load_related_objects(serializer_class, data, create_missing)
+        return serializer_class(data=data, many=True, context=context)
+
+
+class BulkUpsertMixin(BulkSerializerMixin):
+    """
+    POST <префикс>/upsert/ со списком объектов: вставка или обновление
+    по естественному ключу (therapy.natural_keys.UPSERT_KEYS) одним
+    INSERT ... ON CONFLICT на пачку, без чтения существующих строк.
+    """
+
+    @action(detail=False, methods=["post"], url_path="upsert")
+    def upsert(self, request):
+        if not isinstance(request.data, list):
+            raise ValidationError({"non_field_errors": "Ожидается список объектов."})
+        serializer_class = self.get_serializer_class()
+        model = serializer_class.Meta.model
+        with transaction.atomic():
+            serializer = self.get_bulk_serializer(serializer_class, request.data)
+            # Существующий ключ здесь не ошибка, а строка для обновления
+            serializer.child.validators = []
+            for name in UPSERT_KEYS[model]:
+                field = serializer.child.fields[name]
+                field.required, field.allow_null = True, False
+                if hasattr(field, "allow_blank"):
+                    field.allow_blank = False
+                field.validators = [
+                    validator for validator in field.validators
+                    if not isinstance(validator, UniqueValidator)
+                ]
+            serializer.is_valid(raise_exception=True)
+            count = upsert(model, serializer.validated_data)
+        return Response({"upserted": count})
+
+
+class BulkEditMixin:
+    """
+    PATCH <префикс>/bulk/ {"ids": [...], "values": {...}} и DELETE
+    <префикс>/bulk/ {"ids": [...]}: изменение и удаление набора строк
+    (therapy.bulk_edit) одним UPDATE или DELETE на таблицу. Строки
+    отбираются по ids и/или обычными параметрами фильтра списка.
+    """
+
+    def get_bulk_edit_params(self, request):
+        params = BulkEditSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(self.get_queryset())
+        if "ids" in params.validated_data:
+            queryset = queryset.filter(pk__in=params.validated_data["ids"])
+        elif not queryset.query.where:
+            # Без ids и фильтра запрос затронул бы всю таблицу
+            raise ValidationError({"ids": "Передайте ids или параметры фильтра."})
+        ids = sorted(set(queryset.order_by().values_list("pk", flat=True)))
+        return ids, params.validated_data.get("values")
+
+    @action(detail=False, methods=["patch"], url_path="bulk", url_name="bulk")
+    def bulk_update(self, request):
+        serializer_class = self.get_serializer_class()
+        try:
+            with transaction.atomic():
+                ids, values = self.get_bulk_edit_params(request)
+                if values is None:
+                    raise ValidationError({"values": "Обязательное поле."})
+                # Проверяются только изменяемые поля
+                serializer = self.get_serializer(data=values, partial=True)
+                serializer.validators = []
+                writable = {
+                    name for name, field in serializer.fields.items() if not field.read_only
+                }
+                unknown = values.keys() - writable
+                if unknown:
+                    raise ValidationError(
+                        {name: "Поле нельзя изменить." for name in sorted(unknown)}
+                    )
+                serializer.is_valid(raise_exception=True)
+                counts = bulk_edit.bulk_update(
+                    serializer_class.Meta.model, ids, serializer.validated_data
+                )
+        except IntegrityError:
+            raise ValidationError(
+                {"non_field_errors": "Изменение нарушает уникальность записей."}
+            )
+        return Response(counts)
+
+    @bulk_update.mapping.delete
+    def bulk_delete(self, request):
+        with transaction.atomic():
+            ids, _ = self.get_bulk_edit_params(request)
+            counts = bulk_edit.bulk_delete(self.get_serializer_class().Meta.model, ids)
+        return Response(counts)
+
+
+class RadiationTherapyTypeViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = RadiationTherapyTypeSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -97,7 +234,7 @@ class ClinicalCaseComplicationViewSet(viewsets.ModelViewSet):
         return ClinicalCaseComplication.objects.all()
 
 
-class LocationViewSet(viewsets.ModelViewSet):
+class LocationViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = LocationSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -114,7 +251,7 @@ class LocationViewSet(viewsets.ModelViewSet):
         return Location.objects.all()
 
 
-class SpecLocationViewSet(viewsets.ModelViewSet):
+class SpecLocationViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = SpecLocationSerializer
     permission_classes = (permissions.IsAuthenticated,)
 
@@ -133,7 +270,7 @@ class SpecLocationViewSet(viewsets.ModelViewSet):
         return SpecLocation.objects.all()
 
 
-class SpecLocationViewSet(viewsets.ModelViewSet):
+class SpecLocationViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = SpecLocationSerializer
     permission_classes = (permissions.IsAuthenticated,) 
 
@@ -158,17 +295,16 @@ class SpecLocationViewSet(viewsets.ModelViewSet):
 
 
 
-class DiagnosisViewSet(viewsets.ModelViewSet):
+class DiagnosisViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = DiagnosisSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
         filters.OrderingFilter,
+        FullTextSearchFilter,
     ]
 
     filterset_fields = ["code", "description", "note"]
-    search_fields = ["code", "description", "note"]
     ordering_fields = ["code", "description", "note"]
     ordering = ["code"]
 
@@ -211,16 +347,15 @@ class RiskGroupViewSet(viewsets.ModelViewSet):
         return RiskGroup.objects.all()
 
 
-class ComplicationViewSet(viewsets.ModelViewSet):
+class ComplicationViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = ComplicationSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
         filters.OrderingFilter,
+        FullTextSearchFilter,
     ]
     filterset_fields = ["name", "alt_name", "spec_location", "note"]
-    search_fields = ["name", "alt_name", "spec_location__name", "note"]
     ordering_fields = ["name", "alt_name", "spec_location", "note"]
     ordering = ["name"]
 
@@ -228,7 +363,7 @@ class ComplicationViewSet(viewsets.ModelViewSet):
         return Complication.objects.all()
 
 
-class HistologyViewSet(viewsets.ModelViewSet):
+class HistologyViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = HistologySerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -245,7 +380,7 @@ class HistologyViewSet(viewsets.ModelViewSet):
         return Histology.objects.all()
 
 
-class GradeViewSet(viewsets.ModelViewSet):
+class GradeViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = GradeSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -262,7 +397,7 @@ class GradeViewSet(viewsets.ModelViewSet):
         return Grade.objects.all()
 
 
-class TumorViewSet(viewsets.ModelViewSet):
+class TumorViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = TumorSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -279,7 +414,7 @@ class TumorViewSet(viewsets.ModelViewSet):
         return Tumor.objects.all()
 
 
-class NodeViewSet(viewsets.ModelViewSet):
+class NodeViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = NodeSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -296,7 +431,7 @@ class NodeViewSet(viewsets.ModelViewSet):
         return Node.objects.all()
 
 
-class MetastasisViewSet(viewsets.ModelViewSet):
+class MetastasisViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = MetastasisSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -313,171 +448,138 @@ class MetastasisViewSet(viewsets.ModelViewSet):
         return Metastasis.objects.all()
 
 
-class ClinicalCaseViewSet(viewsets.ModelViewSet):
+class ClinicalCaseViewSet(BulkSerializerMixin, BulkEditMixin, viewsets.ModelViewSet):
 
     serializer_class = ClinicalCaseSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = KeysetPagination
+    filter_backends = [
+        DjangoFilterBackend,
+        filters.OrderingFilter,
+        FullTextSearchFilter,
+    ]
+    # Фильтры случаев (__in, диапазоны, __not, OR-группы) — через бэкенд
+    filterset_class = ClinicalCaseFilterSet
+    keyset_ordering_fields = (
+        "id",
+        "age",
+        "age_min",
+        "age_max",
+        "quantity",
+        "number_of_fractions",
+        "single_dose",
+        "treatment_duration",
+    )
 
     def get_queryset(self):
-        queryset = ClinicalCase.objects.all()
-        location_filter = self.request.query_params.get("location")
-        age_filter = self.request.query_params.get("age")
-        age_min_filter = self.request.query_params.get("age_min")
-        age_max_filter = self.request.query_params.get("age_max")
-        quantity_filter = self.request.query_params.get("quantity")
-        gender_filter = self.request.query_params.get("gender")
-        diagnosis_filter = self.request.query_params.get("diagnosis")
-        spec_location_filter = self.request.query_params.get("spec_location")
-        complication_filter = self.request.query_params.get("complication")
-        stage_filter = self.request.query_params.get("stage")
-        risk_group_filter = self.request.query_params.get("risk_group")
-        radiation_therapy_type_filter = self.request.query_params.get(
-            "radiation_therapy_type"
+        return ClinicalCaseSerializer.setup_eager_loading(
+            ClinicalCase.objects.all(),
+            ClinicalCaseSerializer.get_requested_fields(self.request),
         )
-        tumor_filter = self.request.query_params.get("tumor")
-        node_filter = self.request.query_params.get("node")
-        metastasis_filter = self.request.query_params.get("metastasis")
-        histology_filter = self.request.query_params.get("histology")
-        grade_filter = self.request.query_params.get("grade")
-        number_of_fractions_filter = self.request.query_params.get(
-            "number_of_fractions"
-        )
-        single_dose_filter = self.request.query_params.get("single_dose")
-        treatment_duration_filter = self.request.query_params.get("treatment_duration")
-        
-        result_filter = self.request.query_params.get("result")
-        dataset_filter = self.request.query_params.get("dataset")
-        source_filter = self.request.query_params.get("source")
-        model_structure_filter = self.request.query_params.get("model_structure")
-        model_name_filter = self.request.query_params.get("model_name")
-        parameter_filter = self.request.query_params.get("parameter")
-
-        location_list = []
-        age_list = []
-        age_min_list = []
-        gender_list = []
-        quantity_list = []
-        diagnosis_list = []
-        spec_location_list = []
-        complication_list = []
-        stage_list = []
-        risk_group_list = []
-        radiation_therapy_type_list = []
-        tumor_list = []
-        node_list = []
-        metastasis_list = []
-        histology_list = []
-        grade_list = []
-        number_of_fractions_list = []
-        single_dose_list = []
-        treatment_duration_list = []
-
-        if result_filter:
-            result_list = result_filter.split(",")
-            queryset = queryset.filter(dataset__result__in=result_list)
-
-        if dataset_filter:
-            dataset_list = dataset_filter.split(",")
-            queryset = queryset.filter(dataset__in=dataset_list)
-
-        if source_filter:
-            source_list = source_filter.split(",")
-            queryset = queryset.filter(dataset__source__in=source_list)
-
-        if model_structure_filter:
-            ms_list = model_structure_filter.split(",")
-            queryset = queryset.filter(dataset__result__model_structure__in=ms_list)
-
-        if model_name_filter:
-            mn_list = model_name_filter.split(",")
-            queryset = queryset.filter(dataset__result__model_structure__model_name__in=mn_list)
-
-        if parameter_filter:
-            param_list = parameter_filter.split(",")
-            queryset = queryset.filter(dataset__result__model_structure__parameter__in=param_list)
-            
-        if age_filter:
-            age_list = age_filter.split(",")
-            queryset = queryset.filter(age__in=age_list)
-        if location_filter:
-            location_list = location_filter.split(",")
-            queryset = queryset.filter(spec_location__location__in=location_list)
-        if age_min_filter:
-            age_min_list = age_min_filter.split(",")
-            queryset = queryset.filter(age_min__in=age_min_list)
-        if gender_filter:
-            gender_list = gender_filter.split(",")
-            queryset = queryset.filter(gender__in=gender_list)
-        if age_max_filter:
-            age_max_list = age_max_filter.split(",")
-            queryset = queryset.filter(age_max__in=age_max_list)
-        if quantity_filter:
-            quantity_list = quantity_filter.split(",")
-            queryset = queryset.filter(quantity__in=quantity_list)
-        if diagnosis_filter:
-            diagnosis_list = diagnosis_filter.split(",")
-            queryset = queryset.filter(diagnosis__in=diagnosis_list)
-        if spec_location_filter:
-            spec_location_list = spec_location_filter.split(",")
-            queryset = queryset.filter(spec_location__in=spec_location_list)
-        if complication_filter:
-            complication_list = complication_filter.split(",")
-            queryset = queryset.filter(clinicalcasecomplication__complication__in=complication_list)
-        if stage_filter:
-            stage_list = stage_filter.split(",")
-            queryset = queryset.filter(stage__in=stage_list)
-        if risk_group_filter:
-            risk_group_list = risk_group_filter.split(",")
-            queryset = queryset.filter(risk_group__in=risk_group_list)
-        if radiation_therapy_type_filter:
-            radiation_therapy_type_list = radiation_therapy_type_filter.split(",")
-            queryset = queryset.filter(
-                radiation_therapy_type__in=radiation_therapy_type_list
-            )
-        if tumor_filter:
-            tumor_list = tumor_filter.split(",")
-            queryset = queryset.filter(tumor__in=tumor_list)
-        if node_filter:
-            node_list = node_filter.split(",")
-            queryset = queryset.filter(node__in=node_list)
-        if metastasis_filter:
-            metastasis_list = metastasis_filter.split(",")
-            queryset = queryset.filter(metastasis__in=metastasis_list)
-        if histology_filter:
-            histology_list = histology_filter.split(",")
-            queryset = queryset.filter(histology__in=histology_list)
-        if grade_filter:
-            grade_list = grade_filter.split(",")
-            queryset = queryset.filter(grade__in=grade_list)
-        if number_of_fractions_filter:
-            number_of_fractions_list = number_of_fractions_filter.split(",")
-            queryset = queryset.filter(number_of_fractions__in=number_of_fractions_list)
-        if single_dose_filter:
-            single_dose_list = single_dose_filter.split(",")
-            queryset = queryset.filter(single_dose__in=single_dose_list)
-        if treatment_duration_filter:
-            treatment_duration_list = treatment_duration_filter.split(",")
-            queryset = queryset.filter(treatment_duration__in=treatment_duration_list)
-
-        return queryset
 
     def create(self, request, *args, **kwargs):
         # если пришёл список – делаем bulk_create
         if isinstance(request.data, list):
-            serializers = [ self.get_serializer(data=item) for item in request.data ]
-            # проверяем валидность каждого
-            for ser in serializers:
-                ser.is_valid(raise_exception=True)
-            # собираем списком объекты (но не сохраняем через .save())
-            objs = [ ClinicalCase(**ser.validated_data) for ser in serializers ]
-            ClinicalCase.objects.bulk_create(objs)
+            # созданные записи справочников откатываются вместе с ошибкой проверки
+            with transaction.atomic():
+                serializer = self.get_bulk_serializer(ClinicalCaseSerializer, request.data)
+                serializer.is_valid(raise_exception=True)
+                # собираем списком объекты (но не сохраняем через .save())
+                objs = [ ClinicalCase(**data) for data in serializer.validated_data ]
+                for obj in objs:
+                    obj.rendered_text = obj.render_text()
+                ClinicalCase.objects.bulk_create(objs)
+                # bulk_create не отправляет сигналы, сбрасываем кэш агрегатов
+                # и строим сводки случаев сами
+                invalidate_aggregations()
+                refresh_case_summaries(obj.id for obj in objs)
             # формируем ответ – можно вернуть просто список «id» новых объектов
             created_ids = [ obj.id for obj in objs ]
             return Response({'created_ids': created_ids}, status=status.HTTP_201_CREATED)
         # иначе – как обычно
         return super().create(request, *args, **kwargs)
 
-class UnitViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=["post"], url_path="ingest")
+    def ingest(self, request):
+        # Случаи с вложенными наборами данных, результатами и осложнениями
+        if not isinstance(request.data, list):
+            raise ValidationError({"non_field_errors": "Ожидается список клинических случаев."})
+        with transaction.atomic():
+            serializer = self.get_bulk_serializer(IngestClinicalCaseSerializer, request.data)
+            serializer.is_valid(raise_exception=True)
+            created = ingest_cases(serializer.validated_data)
+        return Response({"created": created}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=["post"], url_path="import", url_name="import",
+            parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        # Файл «случай × результат» (CSV или XLSX) в поле file; строки
+        # с ошибками пропускаются и возвращаются в отчёте
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": "Файл не передан."})
+        file_format = request.data.get("file_format") or upload.name.rpartition(".")[2].lower()
+        if file_format not in IMPORT_FORMATS:
+            raise ValidationError(
+                {"file_format": "Допустимые форматы: " + ", ".join(IMPORT_FORMATS)}
+            )
+        create_missing = request.query_params.get("create_missing") in ("1", "true")
+        try:
+            report = import_rows(read_rows(upload, file_format), create_missing=create_missing)
+        except ImportFileError as error:
+            raise ValidationError({"file": str(error)})
+        created = status.HTTP_201_CREATED if report["cases"] else status.HTTP_200_OK
+        return Response(report, status=created)
+
+    @action(detail=False, methods=["get"], url_path="export")
+    def export(self, request):
+        # Потоковая выгрузка отфильтрованной когорты в NDJSON или CSV.
+        # Параметр называется export_format: format занят DRF
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError(
+                {"export_format": "Допустимые форматы: " + ", ".join(EXPORT_FORMATS)}
+            )
+        serializer = self.get_serializer()
+        # Те же фильтры, что и у списка (?search= и др.); порядок по id
+        # нужен для выгрузки порциями
+        queryset = self.filter_queryset(self.get_queryset()).order_by("id")
+        rows = iterate_rows(queryset, serializer)
+        if export_format == "csv":
+            content = stream_csv(rows, list(serializer.fields))
+        else:
+            content = stream_ndjson(rows)
+        response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
+        response["Content-Disposition"] = (
+            f'attachment; filename="clinical_cases.{export_format}"'
+        )
+        return response
+
+    @action(detail=False, methods=["get"], url_path="analysis-table")
+    def analysis_table(self, request):
+        # Таблица «случай × результат» для отфильтрованной когорты в колоночном
+        # формате; файл пишется порциями во временный файл и отдаётся потоком
+        export_format = request.query_params.get("export_format", "parquet")
+        if export_format not in ANALYSIS_FORMATS:
+            raise ValidationError(
+                {"export_format": "Допустимые форматы: " + ", ".join(ANALYSIS_FORMATS)}
+            )
+        results = Result.objects.all()
+        cohort = filter_clinical_cases(ClinicalCase.objects.all(), request.query_params)
+        if cohort.query.where:
+            results = results.filter(data_set__clinical_case__in=cohort.values("id"))
+
+        output = tempfile.TemporaryFile()
+        write_analysis_table(output, results, export_format)
+        output.seek(0)
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=f"analysis_table.{export_format}",
+            content_type=ANALYSIS_FORMATS[export_format],
+        )
+
+class UnitViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = UnitSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -511,7 +613,7 @@ class ParameterViewSet(viewsets.ModelViewSet):
         return Parameter.objects.all()
 
 
-class ModelNameViewSet(viewsets.ModelViewSet):
+class ModelNameViewSet(BulkUpsertMixin, viewsets.ModelViewSet):
     serializer_class = ModelNameSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -561,7 +663,7 @@ class ModelStructureViewSet(viewsets.ModelViewSet):
         return ModelStructure.objects.all()
 
 
-class ResultViewSet(viewsets.ModelViewSet):
+class ResultViewSet(BulkUpsertMixin, BulkEditMixin, viewsets.ModelViewSet):
     serializer_class = ResultSerializer
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
@@ -584,7 +686,11 @@ class ResultViewSet(viewsets.ModelViewSet):
     ordering = ["model_structure"]
 
     def get_queryset(self):
-        queryset = Result.objects.all()
+        queryset = Result.objects.select_related(
+            "model_structure__parameter__unit",
+            "model_structure__model_name",
+            "data_set__source",
+        )
         clinical_case_id = self.request.query_params.get("clinical_case")
 
         if clinical_case_id:
@@ -598,12 +704,11 @@ class SourceViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
     filter_backends = [
         DjangoFilterBackend,
-        filters.SearchFilter,
         filters.OrderingFilter,
+        FullTextSearchFilter,
     ]
 
     filterset_fields = ["full_name", "name", "url"]
-    search_fields = ["full_name", "name", "note", "url"]
     ordering_fields = ["full_name", "name", "note", "url"]
     ordering = ["name"]
 
@@ -631,86 +736,127 @@ class DataSetViewSet(viewsets.ModelViewSet):
     ordering = ["result"]
 
     def get_queryset(self):
-        return DataSet.objects.all()
+        # Текст случая хранится в строке случая, справочники не нужны
+        return DataSet.objects.select_related("clinical_case", "source")
 
 class AggregatedMetricsView(viewsets.ViewSet):
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
-    def create(self, request):
+    def get_cohort(self, request):
+        # Когорта задаётся списком id или теми же фильтрами, что и список
+        # клинических случаев; фильтры превращаются в подзапрос
         clinical_case_ids = request.data.get("clinical_case_ids", [])
+        if "filters" not in request.data:
+            return clinical_case_ids
+
+        filters = validate_filter_spec(request.data["filters"])
+        cohort = filter_clinical_cases(ClinicalCase.objects.all(), filters)
+        if "clinical_case_ids" in request.data:
+            cohort = cohort.filter(id__in=clinical_case_ids)
+        return cohort.values("id")
+
+    def get_statistic_locations(self, request):
+        # Когорта «весь реестр» или «локализации» считается по накопленной
+        # статистике ParameterStatistic; None — нужен расчёт по результатам
+        if "clinical_case_ids" in request.data or "filters" not in request.data:
+            return None
+        active = {
+            name: value
+            for name, value in request.data["filters"].items()
+            if value not in (None, "", [])
+        }
+        if set(active) - {"location"}:
+            return None
+        return split_values(active["location"]) if active else []
+
+    def aggregate_from_statistics(self, location_ids):
+        statistics = ParameterStatistic.objects.all()
+        cases = ClinicalCase.objects.all()
+        if location_ids:
+            statistics = statistics.filter(location__in=location_ids)
+            cases = cases.filter(spec_location__location__in=location_ids)
+        total_result_count, aggregated = aggregate_statistics(statistics)
+        return {
+            "clinical_case_count": cases.count(),
+            "result_count": total_result_count,
+            "aggregated_parameters": aggregated
+        }
 
-        # Получаем результаты с привязкой к клиническим случаям
-        results = Result.objects.filter(
-            data_set__clinical_case__id__in=clinical_case_ids,
-            value__isnull=False
-        ).select_related(
-            'model_structure__model_name',
-            'model_structure__parameter',
-            'model_structure__parameter__unit',
-            'data_set__clinical_case'
-        )
+    def get_stats(self, request):
+        # Дополнительные статистики: stats в теле запроса или в query-параметрах
+        return parse_stats(request.data.get("stats", request.query_params.get("stats")))
 
-        # Считаем уникальные случаи и общее количество результатов
-        unique_case_count = ClinicalCase.objects.filter(id__in=clinical_case_ids).distinct().count()
-        total_result_count = results.count()
-
-        # Группируем значения
-        grouped_data = defaultdict(list)
-
-        for r in results:
-            model = r.model_structure.model_name.name if r.model_structure and r.model_structure.model_name else None
-            param = r.model_structure.parameter.name if r.model_structure and r.model_structure.parameter else "N/A"
-            unit = r.model_structure.parameter.unit.name if (
-                r.model_structure and 
-                r.model_structure.parameter and 
-                r.model_structure.parameter.unit
-            ) else ""
-
-            case = r.data_set.clinical_case
-            meta = {
-                "value": r.value,
-                "number_of_fractions": case.number_of_fractions,
-                "single_dose": case.single_dose,
-                "treatment_duration": case.treatment_duration,
-                "clinical_case_id": case.id 
-            }
-
-            grouped_data[(model, param, unit)].append(meta)
-
-        # Формируем ответ
-        aggregated = []
-        for (model, param, unit), entries in grouped_data.items():
-            values = [e["value"] for e in entries]
-            avg = sum(values) / len(values)
-
-            min_entry = min(entries, key=lambda x: x["value"])
-            max_entry = max(entries, key=lambda x: x["value"])
-
-            aggregated.append({
-                "model": model,
-                "parameter": param,
-                "unit": unit,
-                "count": len(values),
-                "average": round(avg, 2),
-                "min_value": round(min_entry["value"], 2),
-                "min_meta": {
-                    "number_of_fractions": min_entry["number_of_fractions"],
-                    "single_dose": min_entry["single_dose"],
-                    "treatment_duration": min_entry["treatment_duration"],
-                    "clinical_case_id": min_entry["clinical_case_id"]
-                },
-                "max_value": round(max_entry["value"], 2),
-                "max_meta": {
-                    "number_of_fractions": max_entry["number_of_fractions"],
-                    "single_dose": max_entry["single_dose"],
-                    "treatment_duration": max_entry["treatment_duration"],
-                    "clinical_case_id": max_entry["clinical_case_id"]
+    def create(self, request):
+        cohort = self.get_cohort(request)
+        location_ids = self.get_statistic_locations(request)
+        stats = self.get_stats(request)
+
+        def compute():
+            if location_ids is not None:
+                data = self.aggregate_from_statistics(location_ids)
+            else:
+                # Группировка и поиск минимума/максимума выполняются в БД
+                results = cohort_results(cohort)
+                unique_case_count = ClinicalCase.objects.filter(id__in=cohort).count()
+                total_result_count, aggregated = aggregate_results(results)
+                data = {
+                    "clinical_case_count": unique_case_count,
+                    "result_count": total_result_count,
+                    "aggregated_parameters": aggregated
                 }
-            })
+            if stats:
+                attach_statistics(data["aggregated_parameters"], cohort_results(cohort), stats)
+            return data
+
+        spec = {
+            name: request.data[name]
+            for name in ("clinical_case_ids", "filters")
+            if name in request.data
+        }
+        spec["stats"] = stats
+        return Response(cached_aggregation(spec, compute))
+
+    @action(detail=False, methods=["get"], url_path="cache-stats",
+            permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        return Response(aggregation_cache_stats())
+
+
+class TypeaheadViewSet(viewsets.ViewSet):
+    # Автодополнение справочников: /typeahead/<словарь>/?q=...&limit=...
+    # Ответ — компактные пары [id, подпись], без сериализаторов
+    permission_classes = (permissions.IsAuthenticated,)
+    lookup_value_regex = "[a-z-]+"
+
+    def retrieve(self, request, pk=None):
+        if pk not in TYPEAHEAD_DICTIONARIES:
+            raise NotFound("Неизвестный словарь.")
+        term = request.query_params.get("q", "").strip()
+        try:
+            limit = min(int(request.query_params.get("limit", DEFAULT_LIMIT)), MAX_LIMIT)
+        except ValueError:
+            raise ValidationError({"limit": "Ожидается целое число."})
+        if not term or limit < 1:
+            return Response([])
+        return Response(typeahead(pk, term, limit))
+
+
+class ReferenceBundleViewSet(viewsets.ViewSet):
+    # Все справочники одним ответом с ETag по версии справочников.
+    # Версия общая для процессов (кэш versions), поэтому ETag одинаков
+    # у всех процессов. Токен проверяется без запроса пользователя,
+    # поэтому повторный запрос с If-None-Match получает 304 без обращения к БД
+    authentication_classes = (JWTStatelessUserAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
 
-        return Response({
-            "clinical_case_count": unique_case_count,
-            "result_count": total_result_count,
-            "aggregated_parameters": aggregated
-        })
-        
\ No newline at end of file
+    def list(self, request):
+        version = dictionary_version()
+        etag = bundle_etag(version)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = HttpResponse(reference_bundle(version), content_type="application/json")
+        response["ETag"] = etag
+        # Клиент хранит ответ, но каждый раз сверяет ETag
+        response["Cache-Control"] = "private, no-cache"
+        return response
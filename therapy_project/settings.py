@@ -1,3 +1,4 @@
+import tempfile
 from datetime import timedelta
 from pathlib import Path
 
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -122,6 +124,50 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Кэш агрегатов ограничен по размеру; LocMemCache вытесняет давно не
+# использованные ключи, CULL_FREQUENCY = MAX_ENTRIES удаляет по одному.
+# Сами агрегаты могут храниться в памяти процесса: поколение, которое их
+# сбрасывает, лежит в общем кэше versions.
+AGGREGATION_CACHE_MAX_ENTRIES = 1000
+
+# Версии данных (поколение агрегатов, версия справочников) и счётчики
+# попаданий кэша агрегатов должны быть общими для всех процессов.
+# FileBasedCache общий для процессов одного сервера, но incr в нём не
+# атомарный и при одновременных запросах счётчики приблизительны; при
+# нескольких серверах укажите Redis или Memcached
+VERSIONS_CACHE_LOCATION = Path(tempfile.gettempdir()) / 'therapy-versions'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': VERSIONS_CACHE_LOCATION,
+        'TIMEOUT': None,
+    },
+    'aggregates': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'therapy-aggregates',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': AGGREGATION_CACHE_MAX_ENTRIES,
+            'CULL_FREQUENCY': AGGREGATION_CACHE_MAX_ENTRIES,
+        },
+    },
+}
+
+
+# Экспорт клинических случаев читается порциями из серверного курсора
+EXPORT_CHUNK_SIZE = 2000
+
+# Пакетная загрузка случаев (clinical-case/ingest/) присылает тела
+# в десятки мегабайт, стандартного лимита в 2,5 МБ не хватает
+DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 